@@ -0,0 +1,67 @@
+"""Сколько входов в секунду выдерживает хэшер пароля.
+
+Запуск из каталога с manage.py:
+
+    python benchmarks/password_hashing.py --seconds 3 --threads 4
+
+Для каждого хэшера из PASSWORD_HASHERS печатает проверок пароля в
+секунду в одном потоке (это и есть входов в секунду на ядро), в
+--threads потоках и во сколько раз это быстрее исходного хэшера
+Django, PBKDF2 с параметрами по умолчанию. Хэш не выносится из потока
+запроса, поэтому весь выигрыш - это более дешевые параметры хэшера.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.hashers import (  # noqa: E402
+    PBKDF2PasswordHasher, check_password, get_hashers, make_password)
+
+PASSWORD = 'correct horse battery staple'
+
+
+def run(encoded, seconds):
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        check_password(PASSWORD, encoded)
+        done += 1
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    baseline = run(PBKDF2PasswordHasher().encode(PASSWORD, 'baseline'),
+                   args.seconds) / args.seconds
+    print(f'{"исходный":14} {baseline:10.1f} входов/с на ядро '
+          f'(pbkdf2_sha256, {PBKDF2PasswordHasher.iterations} итераций)')
+    for hasher in get_hashers():
+        try:
+            encoded = make_password(PASSWORD, hasher=hasher.algorithm)
+        except ValueError as error:
+            print(f'{hasher.algorithm:14} пропущен: {error}')
+            continue
+        single = run(encoded, args.seconds) / args.seconds
+        with ThreadPoolExecutor(args.threads) as pool:
+            total = sum(pool.map(
+                run, [encoded] * args.threads,
+                [args.seconds] * args.threads)) / args.seconds
+        print(f'{hasher.algorithm:14} {single:10.1f} входов/с на ядро '
+              f'{total:10.1f} входов/с в {args.threads} потоках '
+              f'{single / baseline:6.2f}x к исходному')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Сравнение django.views.static.serve и yatube.files.serve.
+
+Запуск из каталога с manage.py:
+
+    python benchmarks/static_serving.py --requests 2000
+
+Для каждого способа печатает запросов в секунду и байт на ответ для
+обычной загрузки и для повторной с If-Modified-Since.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import RequestFactory  # noqa: E402
+from django.views.static import serve as django_serve  # noqa: E402
+
+from yatube.files import serve as yatube_serve  # noqa: E402
+
+NAME = 'bootstrap.0123456789ab.css'
+
+
+def make_root():
+    root = tempfile.mkdtemp()
+    content = b'.btn { display: inline-block; font-weight: 400; }\n' * 4000
+    with open(os.path.join(root, NAME), 'wb') as file:
+        file.write(content)
+    with open(os.path.join(root, NAME + '.gz'), 'wb') as file:
+        file.write(gzip.compress(content, compresslevel=9))
+    return root
+
+
+def run(view, root, requests, **headers):
+    factory = RequestFactory()
+    transferred = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request = factory.get('/static/' + NAME, **headers)
+        response = view(request, NAME, document_root=root)
+        if response.streaming:
+            transferred += sum(len(chunk) for chunk in response)
+        else:
+            transferred += len(response.content)
+        response.close()
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, transferred // requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+    root = make_root()
+    try:
+        last_modified = yatube_serve(
+            RequestFactory().get('/'), NAME, document_root=root
+        )['Last-Modified']
+        scenarios = (
+            ('первая загрузка', {'HTTP_ACCEPT_ENCODING': 'gzip, br'}),
+            ('повторная', {'HTTP_ACCEPT_ENCODING': 'gzip, br',
+                           'HTTP_IF_MODIFIED_SINCE': last_modified}),
+        )
+        for title, headers in scenarios:
+            for name, view in (('django.views.static', django_serve),
+                               ('yatube.files', yatube_serve)):
+                rps, size = run(view, root, args.requests, **headers)
+                print(f'{title:16} {name:20} {rps:10.0f} req/s '
+                      f'{size:8} байт/ответ')
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,236 @@
-from django.contrib import admin
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.utils import prepare_lookup_value
+from django.contrib.admin.views.main import (IGNORED_PARAMS, PAGE_VAR,
+                                             SEARCH_VAR)
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 
-from .models import Comment, Follow, Group, Post
+from . import moderation, search
+from .models import Comment, Follow, Group, ModerationJob, Post, Task
 
 
-class PostAdmin(admin.ModelAdmin):
-    list_display = ('text', 'pub_date', 'author')
+def estimate_count(model, using='default'):
+    """Примерное число строк таблицы без полного COUNT(*)."""
+    db = connections[using]
+    table = model._meta.db_table
+    with db.cursor() as cursor:
+        if db.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s', (table,))
+        elif db.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                (table,))
+        else:
+            # Максимум ключа берется из индекса; удаления его не уменьшают
+            return model._default_manager.using(using).aggregate(
+                count=Max('pk'))['count'] or 0
+        row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для списка без фильтров считает строки по статистике СУБД.
+
+    Точный COUNT(*) выполняется, только если таблица небольшая или
+    список отфильтрован.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        # Условие менеджера (например, скрытие удаленных) фильтром не считаем
+        default = queryset.model._default_manager.all().query.where
+        if len(queryset.query.where.children) <= len(default.children):
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class GroupActionForm(ActionForm):
+    group = forms.ModelChoiceField(
+        Group.objects.all(), required=False, label='Сообщество')
+
+
+class ModerationAdmin(admin.ModelAdmin):
+    """Массовые действия уходят в фоновую задачу ModerationJob."""
+
+    action_form = GroupActionForm
+
+    def get_actions(self, request):
+        # Синхронное удаление тысяч строк упирается в таймаут запроса
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def selection(self, request, queryset):
+        """Условие отбора и строка поиска для задачи.
+
+        Если выбраны все объекты списка, сохраняются его фильтры, а не
+        id: строка задачи остается маленькой, а подходящие под фильтры
+        объекты, добавленные во время работы, тоже будут обработаны.
+        """
+        if request.POST.get('select_across') != '1':
+            return {'pk__in': list(queryset.values_list('pk', flat=True))}, ''
+        lookup = {
+            key: prepare_lookup_value(key, value)
+            for key, value in request.GET.items()
+            if key not in IGNORED_PARAMS and key != PAGE_VAR}
+        return lookup, request.GET.get(SEARCH_VAR, '')
+
+    def queue_job(self, request, action, lookup, group=None, search=''):
+        job = moderation.queue(action, lookup, request.user, group, search)
+        url = reverse('admin:posts_moderationjob_change', args=(job.pk,))
+        self.message_user(request, format_html(
+            'Задача <a href="{}">{}</a> поставлена в очередь, '
+            'объектов: {}', url, job, job.total))
+
+    def target_group(self, request):
+        field = GroupActionForm.base_fields['group']
+        try:
+            group = field.clean(request.POST.get('group'))
+        except ValidationError:
+            group = None
+        if group is None:
+            self.message_user(request, 'Выберите сообщество', messages.ERROR)
+        return group
+
+
+class PostAdmin(ModerationAdmin, LargeTableAdmin):
+    list_display = ('text', 'pub_date', 'author', 'group')
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    autocomplete_fields = ('author', 'group')
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.search_posts(queryset, search_term), False
+
+    def move_to_group(self, request, queryset):
+        group = self.target_group(request)
+        if group is not None:
+            lookup, search = self.selection(request, queryset)
+            self.queue_job(request, ModerationJob.MOVE_POSTS, lookup, group,
+                           search)
+    move_to_group.short_description = 'Перенести в сообщество'
 
-class GroupAdmin(admin.ModelAdmin):
+    def delete_posts(self, request, queryset):
+        lookup, search = self.selection(request, queryset)
+        self.queue_job(request, ModerationJob.DELETE_POSTS, lookup,
+                       search=search)
+    delete_posts.short_description = 'Удалить выбранные записи'
+
+    def delete_authors_posts(self, request, queryset):
+        self.queue_job(request, ModerationJob.DELETE_POSTS, {
+            'author_id__in': list(
+                queryset.values_list('author_id', flat=True).distinct())})
+    delete_authors_posts.short_description = (
+        'Удалить все записи авторов выбранных')
+
+    actions = ('move_to_group', 'delete_posts', 'delete_authors_posts')
+
+
+class GroupAdmin(ModerationAdmin):
+    list_display = ('title', 'posts_count', 'last_post_date')
     search_fields = ('title',)
     prepopulated_fields = {'slug': ('title',)}
 
+    def move_posts(self, request, queryset):
+        group = self.target_group(request)
+        if group is not None:
+            group_ids = queryset.exclude(pk=group.pk).values_list(
+                'pk', flat=True)
+            self.queue_job(request, ModerationJob.MOVE_POSTS,
+                           {'group_id__in': list(group_ids)}, group)
+    move_posts.short_description = 'Перенести записи в сообщество'
+
+    actions = ('move_posts',)
 
-class CommentAdmin(admin.ModelAdmin):
+
+class CommentAdmin(ModerationAdmin, LargeTableAdmin):
     list_display = ('post', 'author', 'text', 'created')
+    list_select_related = ('post', 'author')
+    autocomplete_fields = ('post', 'author')
+    action_form = ActionForm
+
+    def purge_comments(self, request, queryset):
+        lookup, search = self.selection(request, queryset)
+        self.queue_job(request, ModerationJob.DELETE_COMMENTS, lookup,
+                       search=search)
+    purge_comments.short_description = 'Удалить выбранные комментарии'
+
+    def purge_authors_comments(self, request, queryset):
+        self.queue_job(request, ModerationJob.DELETE_COMMENTS, {
+            'author_id__in': list(
+                queryset.values_list('author_id', flat=True).distinct())})
+    purge_authors_comments.short_description = (
+        'Удалить все комментарии авторов выбранных (спам)')
+
+    actions = ('purge_comments', 'purge_authors_comments')
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+
+
+class ModerationJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'progress', 'created_by',
+                    'updated')
+    list_filter = ('status', 'action')
+    list_select_related = ('created_by',)
+    readonly_fields = ('action', 'lookup', 'search', 'group', 'status',
+                       'total', 'processed', 'last_id', 'affected_groups',
+                       'error', 'created_by', 'created', 'updated')
+
+    def progress(self, job):
+        return f'{job.processed} из {job.total}'
+    progress.short_description = 'Прогресс'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'attempts', 'run_at', 'locked_by',
+                    'updated')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'kwargs', 'key', 'status', 'run_at',
+                       'attempts', 'locked_by', 'locked_until', 'error',
+                       'created', 'updated')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(ModerationJob, ModerationJobAdmin)
+admin.site.register(Task, TaskAdmin)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
     verbose_name = 'Записи'
+
+    def ready(self):
+        from . import search, sharding, signals  # noqa: F401
+
+        post_migrate.connect(search.install, sender=self)
@@ -0,0 +1,55 @@
+"""Вынос старых записей из горячих таблиц.
+
+Записи старше POST_ARCHIVE_DAYS вместе с комментариями переносятся в
+ArchivedPost и ArchivedComment, а мягко удаленные строки старше
+SOFT_DELETE_RETENTION_DAYS удаляются насовсем. Мягко удаленное в архив
+не попадает: запись дождется очистки в posts_post, а комментарии
+архивируемой записи удаляются вместе с ней. Ленты читают только
+posts_post, поэтому ее индексы остаются неглубокими.
+"""
+from django.db import transaction
+
+from . import changelog
+from .models import ArchivedComment, ArchivedPost, Comment, Post
+
+
+def archive_batch(cutoff, batch_size):
+    """Переносит в архив одну пачку записей старше cutoff."""
+    with transaction.atomic():
+        posts = list(Post.objects.filter(pub_date__lt=cutoff)
+                     .order_by('pk')[:batch_size])
+        if not posts:
+            return 0
+        post_ids = [post.pk for post in posts]
+        ArchivedPost.objects.bulk_create([
+            ArchivedPost(
+                id=post.pk, text=post.text, pub_date=post.pub_date,
+                author_id=post.author_id, group_id=post.group_id,
+                image=post.image.name, comment_count=post.comment_count,
+                views=post.views)
+            for post in posts
+        ])
+        ArchivedComment.objects.bulk_create([
+            ArchivedComment(
+                id=comment.pk, post_id=comment.post_id,
+                author_id=comment.author_id, text=comment.text,
+                created=comment.created)
+            for comment in Comment.objects.filter(post_id__in=post_ids)
+        ])
+        # Сигналы удаления поправят статистику сообществ, а картинки
+        # останутся: на них теперь ссылается архив
+        with changelog.archiving():
+            Post.all_objects.filter(pk__in=post_ids).delete()
+    return len(posts)
+
+
+def purge_batch(cutoff, batch_size):
+    """Удаляет насовсем пачку строк, мягко удаленных раньше cutoff."""
+    purged = 0
+    for manager in (Comment.all_objects, Post.all_objects):
+        with transaction.atomic():
+            ids = list(manager.filter(deleted_at__lt=cutoff).order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            manager.filter(pk__in=ids).delete()
+        purged += len(ids)
+    return purged
@@ -0,0 +1,137 @@
+"""Журнал изменений для внешних потребителей (transactional outbox).
+
+Сохранение и удаление Group, Post, Comment и Follow добавляет строку
+ChangeEvent в той же транзакции, что и само изменение: событие видно
+тогда и только тогда, когда изменение закоммичено. Массовые операции
+мимо сигналов (update, bulk_create) пишут события явно.
+
+Потребители (поисковые индексы, прогрев кэша, аналитика) читают журнал
+пачками по возрастанию id и хранят смещение в ChangeConsumer. Смещение
+сдвигается после обработки пачки, так что доставка «хотя бы один раз»:
+обработчик должен быть идемпотентным. Сброс смещения в ноль проигрывает
+журнал заново. При шардировании события пишутся в default, отдельно от
+транзакции шарда. Перенос в архив (posts.archive) пишет событие
+archived, а не deleted: данные не удалены, а лишь переехали.
+"""
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Min
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from .models import ChangeConsumer, ChangeEvent
+
+_delete_action = ContextVar('delete_action', default=ChangeEvent.DELETED)
+
+
+def payload(instance):
+    deferred = instance.get_deferred_fields()
+    data = {}
+    for field in instance._meta.concrete_fields:
+        if field.attname in deferred:
+            continue
+        value = field.value_from_object(instance)
+        if isinstance(value, FieldFile):
+            value = value.name or None
+        data[field.attname] = value
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def event(instance, action):
+    return ChangeEvent(model=instance._meta.label_lower,
+                       object_id=instance.pk, action=action,
+                       payload=payload(instance))
+
+
+def record(instance, action):
+    event(instance, action).save()
+
+
+def deleted_action():
+    return _delete_action.get()
+
+
+@contextmanager
+def archiving():
+    """Удаления внутри блока записываются как перенос в архив."""
+    token = _delete_action.set(ChangeEvent.ARCHIVED)
+    try:
+        yield
+    finally:
+        _delete_action.reset(token)
+
+
+def record_many(queryset, action):
+    """События для строк queryset, измененных в обход сигналов."""
+    ChangeEvent.objects.bulk_create(
+        [event(instance, action) for instance in queryset.iterator()],
+        batch_size=settings.CHANGELOG_BATCH_SIZE)
+
+
+def read(after, limit, now=None):
+    """До limit событий после after по возрастанию id.
+
+    id выдается при вставке, а строка видна после коммита: на PostgreSQL
+    и MySQL транзакция с меньшим id может закоммититься позже, чем
+    следующая. Поэтому чтение останавливается перед пропуском в id, пока
+    событие за пропуском моложе CHANGELOG_GAP_TIMEOUT, - незакоммиченная
+    строка успеет появиться. Более старый пропуск считается откатом и
+    проходится. Транзакции дольше этого окна могут потерять события.
+    """
+    events = list(ChangeEvent.objects.filter(pk__gt=after)
+                  .order_by('pk')[:limit])
+    horizon = (now or timezone.now()) - timedelta(
+        seconds=settings.CHANGELOG_GAP_TIMEOUT)
+    # С нуля читают новые потребители: пропуск там от очистки журнала
+    expected = after + 1 if after else None
+    for index, change in enumerate(events):
+        if expected is not None and change.pk != expected \
+                and change.created > horizon:
+            return events[:index]
+        expected = change.pk + 1
+    return events
+
+
+def consume(name, handler, batch_size=None):
+    """Передает handler новые для потребителя name события пачками.
+
+    Возвращает число обработанных событий. Один потребитель должен
+    работать в одном процессе.
+    """
+    batch_size = batch_size or settings.CHANGELOG_BATCH_SIZE
+    consumer, _ = ChangeConsumer.objects.get_or_create(name=name)
+    processed = 0
+    while True:
+        events = read(consumer.position, batch_size)
+        if not events:
+            break
+        handler(events)
+        consumer.position = events[-1].pk
+        consumer.save(update_fields=('position', 'updated'))
+        processed += len(events)
+        if len(events) < batch_size:
+            break
+    return processed
+
+
+def reset(name, position=0):
+    ChangeConsumer.objects.update_or_create(
+        name=name, defaults={'position': position})
+
+
+def purge(now=None):
+    """Удаляет события старше CHANGELOG_RETENTION_DAYS, уже прочитанные
+    всеми потребителями."""
+    cutoff = (now or timezone.now()) - timedelta(
+        days=settings.CHANGELOG_RETENTION_DAYS)
+    events = ChangeEvent.objects.filter(created__lt=cutoff)
+    position = ChangeConsumer.objects.aggregate(
+        position=Min('position'))['position']
+    if position is not None:
+        events = events.filter(pk__lte=position)
+    return events.delete()[0]
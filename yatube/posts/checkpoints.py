@@ -0,0 +1,29 @@
+import json
+import os
+
+
+class Checkpoint:
+    """Состояние долгой задачи в JSON-файле, чтобы продолжить после сбоя."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, state):
+        # Через временный файл: оборванная запись не испортит чекпоинт
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
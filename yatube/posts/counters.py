@@ -0,0 +1,176 @@
+"""Счетчики просмотров записей с отложенной пакетной записью.
+
+UPDATE на каждый просмотр сериализовал бы писателей SQLite, поэтому
+просмотры копятся и уходят в базу одним UPDATE ... CASE на пачку записей.
+В режиме 'local' они копятся в памяти процесса и сбрасываются фоновым
+потоком раз в VIEW_COUNT_FLUSH_INTERVAL секунд, по VIEW_COUNT_MAX_PENDING
+записей и при выходе процесса; поток запускает yatube.wsgi. При падении
+процесса теряется не больше одного интервала. В режиме 'cache' просмотры
+складываются счетчиками в общем кэше всех воркеров, а в базу их переносит
+периодическая задача posts.flush_view_counts.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Post
+from .writebehind import defer
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEY = 'views:{db}:{pk}'
+# Метка "запись уже в списке на сброс" и сам список: пронумерованные слоты
+MARK_KEY = 'views:mark:{db}:{pk}'
+SLOT_KEY = 'views:slot:{}'
+LAST_SLOT_KEY = 'views:last-slot'
+FLUSHED_SLOT_KEY = 'views:flushed-slot'
+# Три параметра на запись: SQLite по умолчанию принимает до 999
+UPDATE_BATCH_SIZE = 300
+SLOT_BATCH_SIZE = 1000
+
+
+def write(counts):
+    """Прибавляет просмотры; counts - Counter по (база, id записи)."""
+    by_db = {}
+    for (db, pk), count in counts.items():
+        if count > 0:
+            by_db.setdefault(db, []).append((pk, count))
+    for db, increments in by_db.items():
+        for start in range(0, len(increments), UPDATE_BATCH_SIZE):
+            batch = increments[start:start + UPDATE_BATCH_SIZE]
+            Post.all_objects.using(db).filter(
+                pk__in=[pk for pk, _ in batch]).update(
+                views=F('views') + Case(
+                    *(When(pk=pk, then=Value(count)) for pk, count in batch),
+                    default=Value(0), output_field=IntegerField()))
+
+
+class LocalCounter:
+
+    def __init__(self):
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.flushed = time.monotonic()
+        self.thread = None
+
+    def start(self):
+        """Запускает сброс по таймеру и регистрирует сброс при выходе."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.run, name='view-counts', daemon=True)
+            self.thread.start()
+        atexit.register(self.shutdown)
+
+    def run(self):
+        while True:
+            time.sleep(settings.VIEW_COUNT_FLUSH_INTERVAL)
+            try:
+                # Поток и так фоновый, пишем без очереди write-behind
+                write(self.take())
+            except Exception:
+                logger.exception('Не удалось записать просмотры')
+
+    def shutdown(self):
+        # Поток write-behind при выходе уже не успеет
+        write(self.take())
+
+    def add(self, db, pk):
+        with self.lock:
+            self.pending[db, pk] += 1
+            due = (len(self.pending) >= settings.VIEW_COUNT_MAX_PENDING
+                   or time.monotonic() - self.flushed
+                   >= settings.VIEW_COUNT_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.flushed = time.monotonic()
+        return pending
+
+    def flush(self):
+        with self.lock:
+            self.flushed = time.monotonic()
+        # Запрос не ждет записи: ее выполнит очередь write-behind. Пока
+        # сброс ждет там, новые просмотры копятся и уходят с ним же
+        defer(self.write_pending, key='views:local')
+
+    def write_pending(self):
+        write(self.take())
+
+
+local = LocalCounter()
+
+
+def register(db, pk):
+    cache.add(LAST_SLOT_KEY, 0, None)
+    slot = cache.incr(LAST_SLOT_KEY)
+    cache.set(SLOT_KEY.format(slot), (db, pk), None)
+
+
+def add_shared(db, pk):
+    key = COUNTER_KEY.format(db=db, pk=pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+    # В список на сброс запись попадает раз за интервал, а не на каждый
+    # просмотр. Слот, потерянный гонкой с flush_shared, восстановится,
+    # когда истечет метка
+    if cache.add(MARK_KEY.format(db=db, pk=pk), 1,
+                 settings.VIEW_COUNT_FLUSH_INTERVAL):
+        register(db, pk)
+
+
+def flush_shared():
+    """Переносит в базу просмотры записей из слотов после прошлого сброса.
+
+    Запускать не больше одного сброса одновременно.
+    """
+    first = cache.get(FLUSHED_SLOT_KEY, 0) + 1
+    last = cache.get(LAST_SLOT_KEY, 0)
+    flushed = 0
+    for start in range(first, last + 1, SLOT_BATCH_SIZE):
+        end = min(start + SLOT_BATCH_SIZE, last + 1)
+        slot_keys = [SLOT_KEY.format(slot) for slot in range(start, end)]
+        posts = set(cache.get_many(slot_keys).values())
+        # Метки снимаем до чтения счетчиков: просмотр после этой точки
+        # снова поставит запись в список
+        cache.delete_many([MARK_KEY.format(db=db, pk=pk) for db, pk in posts])
+        keys = {COUNTER_KEY.format(db=db, pk=pk): (db, pk)
+                for db, pk in posts}
+        counts = cache.get_many(keys)
+        write(Counter({keys[key]: count for key, count in counts.items()}))
+        for key, count in counts.items():
+            # Вычитаем записанное, а не удаляем: новые просмотры сохранятся
+            try:
+                cache.decr(key, count)
+            except ValueError:
+                pass
+        cache.delete_many(slot_keys)
+        cache.set(FLUSHED_SLOT_KEY, end - 1, None)
+        flushed += sum(1 for count in counts.values() if count > 0)
+    return flushed
+
+
+def hit(post):
+    if settings.VIEW_COUNT_MODE == 'cache':
+        add_shared(post._state.db, post.pk)
+    else:
+        local.add(post._state.db, post.pk)
+
+
+def flush():
+    if settings.VIEW_COUNT_MODE == 'cache':
+        return flush_shared()
+    return local.flush()
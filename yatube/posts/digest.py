@@ -0,0 +1,93 @@
+"""Дайджест новых записей авторов, на которых подписан пользователь.
+
+Получатели идут пачками. На пачку выполняется по запросу за подписками
+и записями, каждая запись рендерится один раз, сколько бы подписчиков
+ее ни получило, а письма уходят через одно соединение.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .models import Follow, Post, User
+
+PERIODS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+SUBJECTS = {
+    'daily': 'Новые записи за день',
+    'weekly': 'Новые записи за неделю',
+}
+
+
+def recipient_chunks(chunk_size, after=0):
+    """Отдает id получателей по возрастанию пачками, начиная после after."""
+    recipients = (User.objects.filter(is_active=True, follower__isnull=False)
+                  .exclude(email='').order_by('id').distinct()
+                  .values_list('id', flat=True))
+    while True:
+        chunk = list(recipients.filter(id__gt=after)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1]
+
+
+def build_messages(user_ids, period, since, until):
+    authors = defaultdict(list)
+    for user_id, author_id in Follow.objects.filter(
+            user_id__in=user_ids).values_list('user_id', 'author_id'):
+        authors[user_id].append(author_id)
+
+    posts = defaultdict(list)
+    post_template = get_template('email/digest_post.txt')
+    rendered = {}
+    for post in (Post.objects
+                 .filter(author_id__in={pk for ids in authors.values()
+                                        for pk in ids},
+                         pub_date__gte=since, pub_date__lt=until)
+                 .select_related('author', 'group')
+                 .order_by('-pub_date').iterator()):
+        posts[post.author_id].append(post)
+        rendered[post.pk] = mark_safe(post_template.render(
+            {'post': post, 'site_url': settings.DIGEST_SITE_URL}))
+
+    digest_template = get_template('email/digest.txt')
+    messages = []
+    for user in User.objects.filter(id__in=user_ids).order_by('id'):
+        user_posts = sorted(
+            (post for author_id in authors[user.pk]
+             for post in posts[author_id]),
+            key=lambda post: post.pub_date, reverse=True)
+        if not user_posts:
+            continue
+        shown = user_posts[:settings.DIGEST_POST_COUNT]
+        body = digest_template.render({
+            'user': user,
+            'posts': [rendered[post.pk] for post in shown],
+            'more': len(user_posts) - len(shown),
+            'site_url': settings.DIGEST_SITE_URL,
+        })
+        messages.append(EmailMessage(
+            SUBJECTS[period], body, to=[user.email]))
+    return messages
+
+
+def send_chunk(user_ids, period, since, until):
+    """Собирает и отправляет письма пачки получателей.
+
+    Вызывается и в дочерних процессах, поэтому принимает только
+    простые значения.
+    """
+    messages = build_messages(user_ids, period, since, until)
+    batch_size = settings.DIGEST_SEND_BATCH_SIZE
+    sent = 0
+    with get_connection() as connection:
+        for start in range(0, len(messages), batch_size):
+            sent += connection.send_messages(
+                messages[start:start + batch_size]) or 0
+    return sent
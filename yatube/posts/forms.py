@@ -1,6 +1,11 @@
+import re
+
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import widgets
 
+from .images import IMAGE_ERRORS, ImageTooLarge, process_image
 from .models import Comment, Post
 
 
@@ -20,6 +25,24 @@ class PostForm(forms.ModelForm):
             'image': 'Добавьте картинку'
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if not isinstance(image, UploadedFile):
+            return image
+        if image.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise forms.ValidationError(
+                'Файл слишком большой, максимум '
+                f'{settings.IMAGE_MAX_UPLOAD_SIZE // 2 ** 20} МБ')
+        try:
+            return process_image(image)
+        except ImageTooLarge:
+            raise forms.ValidationError(
+                'Изображение слишком большое, максимум '
+                f'{settings.IMAGE_MAX_PIXELS // 10 ** 6} Мп')
+        except IMAGE_ERRORS:
+            raise forms.ValidationError(
+                'Не удалось обработать изображение')
+
 
 class CommentForm(forms.ModelForm):
 
@@ -29,3 +52,26 @@ class CommentForm(forms.ModelForm):
         widgets = {'text': widgets.Textarea}
         labels = {'text': 'Текст комментария'}
         help_texts = {'text': 'Оставьте комментарий'}
+
+
+class BatchFollowForm(forms.Form):
+    FOLLOW = 'follow'
+    UNFOLLOW = 'unfollow'
+
+    action = forms.ChoiceField(
+        choices=((FOLLOW, 'Подписаться'), (UNFOLLOW, 'Отписаться')),
+        label='Действие')
+    usernames = forms.CharField(
+        widget=widgets.Textarea, label='Авторы',
+        help_text='Имена пользователей через пробел или запятую')
+
+    @staticmethod
+    def split(value):
+        return set(filter(None, re.split(r'[\s,]+', value)))
+
+    def clean_usernames(self):
+        usernames = self.split(self.cleaned_data['usernames'])
+        if len(usernames) > settings.FOLLOW_BATCH_LIMIT:
+            raise forms.ValidationError(
+                f'Не больше {settings.FOLLOW_BATCH_LIMIT} авторов за раз')
+        return sorted(usernames)
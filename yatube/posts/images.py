@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85, 'method': 4},
+}
+
+# Все, чем Pillow и пул отвечают на плохой или слишком тяжелый файл.
+# TimeoutError из concurrent.futures до Python 3.11 не наследует OSError,
+# а KeyError и ValueError бывают при сохранении в формат файла
+IMAGE_ERRORS = (OSError, SyntaxError, KeyError, ValueError, TimeoutError,
+                Image.DecompressionBombError)
+
+_executor = None
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def executor():
+    # Pillow отпускает GIL при декодировании и масштабировании,
+    # так что потоки дают и параллельность, и предел нагрузки на CPU
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='image')
+    return _executor
+
+
+def check_pixels(upload):
+    """Проверяет размер по заголовку, не декодируя картинку.
+
+    Так время обработки ограничено и задача, не уложившаяся в таймаут,
+    не займет исполнителя пула надолго.
+    """
+    upload.seek(0)
+    with Image.open(upload) as image:
+        width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f'{width}x{height}')
+
+
+def process_image(upload):
+    check_pixels(upload)
+    future = executor().submit(normalize_image, upload)
+    try:
+        return future.result(timeout=settings.IMAGE_PROCESS_TIMEOUT)
+    except TimeoutError:
+        # Еще не начатая задача просто уйдет из очереди
+        future.cancel()
+        raise
+
+
+def normalize_image(upload):
+    upload.seek(0)
+    with Image.open(upload) as image:
+        image.verify()
+    upload.seek(0)
+    with Image.open(upload) as image:
+        image_format = image.format
+        if getattr(image, 'is_animated', False):
+            # Анимацию не пережимаем, чтобы не потерять кадры
+            upload.seek(0)
+            return upload
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(settings.IMAGE_MAX_SIZE, Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        # EXIF и прочие метаданные не передаются и в файл не попадают
+        image.save(output, format=image_format,
+                   **SAVE_OPTIONS.get(image_format, {}))
+    return SimpleUploadedFile(
+        upload.name, output.getvalue(),
+        content_type=Image.MIME.get(image_format, upload.content_type))
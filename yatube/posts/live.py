@@ -0,0 +1,281 @@
+"""Живые обновления лент по Server-Sent Events.
+
+Django 2.2 не умеет ASGI, поэтому события отдает отдельное
+ASGI-приложение yatube.asgi:application, а прокси направляет к нему
+адреса LIVE_URL; страницы по-прежнему обслуживает WSGI.
+
+Раз в LIVE_POLL_INTERVAL процесс читает новые строки журнала изменений
+(posts.changelog) и раздает их через Hub. Журнал пишут все WSGI-воркеры,
+так что он служит общей шиной между процессами: на событие приходится
+один запрос к базе и одна отрисовка комментария при любом числе
+слушателей. Слушатель ленты хранит только счетчик новых записей,
+слушатель записи - короткую очередь фрагментов. Переполнивший очередь
+отключается, EventSource переподключится сам. Больше
+LIVE_MAX_CONNECTIONS соединений процесс не принимает.
+"""
+import asyncio
+import json
+import logging
+import re
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.template.loader import render_to_string
+from users.middleware import get_user
+
+from . import changelog
+from .models import ChangeEvent, Comment, Follow
+
+logger = logging.getLogger(__name__)
+
+FEED = 'feed'
+AUTHOR = 'author:{}'
+POST = 'post:{}'
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.LIVE_DB_WORKERS, thread_name_prefix='live')
+    return _executor
+
+
+def call(func, *args):
+    """Выполняет синхронный код Django вне цикла событий."""
+    def job():
+        close_old_connections()
+        return func(*args)
+    return asyncio.get_running_loop().run_in_executor(executor(), job)
+
+
+def latest_event_id():
+    return ChangeEvent.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+
+
+def collect(after):
+    """Сообщения (тема, html) по событиям журнала после after.
+
+    html равен None для новой записи: слушатели лент считают только их
+    количество.
+    """
+    events = changelog.read(after, settings.LIVE_BATCH_SIZE)
+    messages, comment_ids = [], []
+    for event in events:
+        if event.action != ChangeEvent.CREATED:
+            continue
+        if event.model == 'posts.post':
+            author_id = json.loads(event.payload)['author_id']
+            messages += [(FEED, None), (AUTHOR.format(author_id), None)]
+        elif event.model == 'posts.comment':
+            comment_ids.append(event.object_id)
+    comments = Comment.objects.select_related('author').filter(
+        pk__in=comment_ids).order_by('pk')
+    for comment in comments:
+        messages.append((
+            POST.format(comment.post_id),
+            render_to_string('includes/comment.html', {'item': comment})))
+    return messages, events[-1].pk if events else after
+
+
+class Listener:
+
+    def __init__(self, topics):
+        self.topics = topics
+        self.new_posts = 0
+        self.fragments = deque()
+        self.overflow = False
+        self.closed = False
+        self.wakeup = asyncio.Event()
+
+    def deliver(self, html):
+        if html is None:
+            self.new_posts += 1
+        elif len(self.fragments) < settings.LIVE_QUEUE_SIZE:
+            self.fragments.append(html)
+        else:
+            self.overflow = True
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+    def drain(self):
+        self.wakeup.clear()
+        chunk = b''
+        if self.new_posts:
+            chunk += message('posts', json.dumps({'count': self.new_posts}))
+            self.new_posts = 0
+        while self.fragments:
+            chunk += message('comment', self.fragments.popleft())
+        if self.overflow:
+            # Отставший слушатель переподключится с чистого листа
+            chunk += message('overflow', '')
+            self.closed = True
+        return chunk
+
+
+class Hub:
+
+    def __init__(self):
+        self.topics = defaultdict(set)
+        self.connections = 0
+        self.tailer = None
+
+    def subscribe(self, listener):
+        self.connections += 1
+        for topic in listener.topics:
+            self.topics[topic].add(listener)
+        self.start()
+
+    def unsubscribe(self, listener):
+        self.connections -= 1
+        for topic in listener.topics:
+            listeners = self.topics.get(topic)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self.topics[topic]
+
+    def publish(self, topic, html=None):
+        for listener in self.topics.get(topic, ()):
+            listener.deliver(html)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if (self.tailer is None or self.tailer.done()
+                or self.tailer.get_loop() is not loop):
+            self.tailer = loop.create_task(self.tail())
+
+    async def tail(self):
+        after = await call(latest_event_id)
+        while self.topics:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            try:
+                messages, after = await call(collect, after)
+            except Exception:
+                logger.exception('Не удалось прочитать журнал изменений')
+                continue
+            for topic, html in messages:
+                self.publish(topic, html)
+
+
+hub = Hub()
+
+ROUTES = (
+    (re.compile(r'^feed/$'), 'feed'),
+    (re.compile(r'^follow/$'), 'follow'),
+    (re.compile(r'^posts/(?P<post_id>\d+)/$'), 'post'),
+)
+
+
+def session_user(headers):
+    cookie = SimpleCookie()
+    for name, value in headers:
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    engine = import_module(settings.SESSION_ENGINE)
+    # Та же проверка сессии, что и у страниц, включая хэш пароля
+    return get_user(SimpleNamespace(
+        session=engine.SessionStore(morsel and morsel.value)))
+
+
+def followed_topics(headers):
+    user = session_user(headers)
+    if not user.is_authenticated:
+        return None
+    return {AUTHOR.format(author_id) for author_id in Follow.objects.filter(
+        user=user).values_list('author_id', flat=True)}
+
+
+async def respond(send, status, text, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+def message(event, data):
+    lines = ''.join(f'data: {line}\n' for line in data.splitlines() or [''])
+    return f'event: {event}\n{lines}\n'.encode()
+
+
+async def stream(listener, receive, send):
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        listener.close()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    hub.subscribe(listener)
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'more_body': True,
+                    'body': f'retry: {settings.LIVE_RETRY}\n\n'.encode()})
+        while not listener.closed:
+            try:
+                await asyncio.wait_for(listener.wakeup.wait(),
+                                       settings.LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                chunk = b': keepalive\n\n'
+            else:
+                chunk = listener.drain()
+            if listener.closed and not chunk:
+                break
+            # send ждет, пока сервер отдаст данные медленному клиенту
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': not listener.closed})
+    finally:
+        hub.unsubscribe(listener)
+        watcher.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    path = scope['path']
+    prefix = settings.LIVE_URL or '/'
+    route = kwargs = None
+    if path.startswith(prefix):
+        for pattern, name in ROUTES:
+            match = pattern.match(path[len(prefix):])
+            if match:
+                route, kwargs = name, match.groupdict()
+                break
+    if route is None:
+        return await respond(send, 404, 'Not Found')
+    if hub.connections >= settings.LIVE_MAX_CONNECTIONS:
+        return await respond(send, 503, 'Service Unavailable',
+                             [(b'retry-after', b'30')])
+    if route == 'feed':
+        topics = {FEED}
+    elif route == 'post':
+        topics = {POST.format(kwargs['post_id'])}
+    else:
+        topics = await call(followed_topics, scope['headers'])
+        if topics is None:
+            return await respond(send, 403, 'Forbidden')
+    await stream(Listener(topics), receive, send)
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts import archive
+
+
+class Command(BaseCommand):
+    help = ('Переносит старые записи в архивные таблицы и окончательно '
+            'удаляет давно удаленные мягко. Можно прерывать в любой момент')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.POST_ARCHIVE_DAYS,
+                            help='Архивировать записи старше, дней')
+        parser.add_argument('--retention', type=int,
+                            default=settings.SOFT_DELETE_RETENTION_DAYS,
+                            help='Хранить мягко удаленные строки, дней')
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+        purged = archived = 0
+
+        purge_cutoff = now - timedelta(days=options['retention'])
+        while True:
+            count = archive.purge_batch(purge_cutoff, batch_size)
+            if not count:
+                break
+            purged += count
+
+        archive_cutoff = now - timedelta(days=options['days'])
+        while True:
+            count = archive.archive_batch(archive_cutoff, batch_size)
+            if not count:
+                break
+            archived += count
+
+        self.stdout.write(
+            f'Удалено насовсем: {purged}, перенесено в архив: {archived}')
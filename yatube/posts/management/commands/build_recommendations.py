@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации авторов для всех пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int,
+                            help='Сколько авторов хранить на пользователя')
+        parser.add_argument('--block-size', type=int,
+                            help='Сколько пользователей считать за раз')
+
+    def handle(self, *args, **options):
+        stored = build_recommendations(
+            top=options['top'], block_size=options['block_size'])
+        self.stdout.write(f'Сохранено рекомендаций: {stored}')
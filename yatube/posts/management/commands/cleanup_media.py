@@ -0,0 +1,174 @@
+import heapq
+import os
+import posixpath
+import time
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from posts import sharding
+from posts.checkpoints import Checkpoint
+from posts.models import ArchivedPost, Post
+
+SCAN_WINDOW = 10000
+
+
+def listing(path, start=None):
+    """Записи каталога по имени, начиная со start, окнами по SCAN_WINDOW.
+
+    Каждое окно - отдельный проход scandir с heapq.nsmallest, так что
+    даже плоский каталог старых загрузок с миллионами файлов не читается
+    в память целиком.
+    """
+    lower, inclusive = start, True
+    while True:
+        with os.scandir(path) as entries:
+            if lower is not None:
+                entries = (
+                    entry for entry in entries if entry.name > lower
+                    or inclusive and entry.name == lower)
+            window = heapq.nsmallest(
+                SCAN_WINDOW, entries, key=attrgetter('name'))
+        yield from window
+        if len(window) < SCAN_WINDOW:
+            return
+        lower, inclusive = window[-1].name, False
+
+
+def scan(root, relative, after=()):
+    """Обходит дерево в лексикографическом порядке, начиная после after."""
+    head = after[0] if after else None
+    for entry in listing(os.path.join(root, relative), head):
+        path = posixpath.join(relative, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan(
+                root, path, after[1:] if entry.name == head else ())
+        elif entry.is_file(follow_symlinks=False) and entry.name != head:
+            yield path, entry
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки и миниатюры, на которые больше не ссылаются '
+            'посты. Можно прерывать: работа продолжится с чекпоинта')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--limit', type=int,
+                            help='Сколько файлов проверить за этот запуск')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Не трогать файлы моложе, секунд')
+        parser.add_argument('--checkpoint',
+                            default=settings.MEDIA_CLEANUP_CHECKPOINT)
+        parser.add_argument('--reset', action='store_true',
+                            help='Начать обход заново')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options['checkpoint'])
+        if options['reset']:
+            checkpoint.clear()
+        state = checkpoint.load()
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.checked = self.deleted = 0
+        deadline = time.time() - options['min_age']
+        limit = options['limit']
+
+        batch = []
+        for path, entry in self.files(state.get('last')):
+            if entry.stat().st_mtime <= deadline:
+                batch.append(path)
+            if len(batch) >= options['batch_size']:
+                self.process(batch)
+                checkpoint.save({'last': path})
+                batch = []
+            self.checked += 1
+            if limit and self.checked >= limit:
+                self.process(batch)
+                checkpoint.save({'last': path})
+                break
+        else:
+            self.process(batch)
+            self.purge_thumbnails()
+            checkpoint.clear()
+
+        self.stdout.write(
+            f'Проверено файлов: {self.checked}, удалено: {self.deleted}')
+
+    def files(self, last):
+        after = tuple(last.split('/')) if last else ()
+        upload_to = Post._meta.get_field('image').upload_to.strip('/')
+        roots = sorted(
+            {upload_to, thumbnail_settings.THUMBNAIL_PREFIX.strip('/')})
+        for top in roots:
+            if after and top < after[0]:
+                continue
+            if os.path.isdir(os.path.join(settings.MEDIA_ROOT, top)):
+                yield from scan(
+                    settings.MEDIA_ROOT, top,
+                    after[1:] if after and top == after[0] else ())
+
+    def referenced(self, names):
+        managers = [Post.all_objects.using(alias)
+                    for alias in sharding.post_databases()]
+        found = set()
+        for manager in (*managers, ArchivedPost.objects):
+            found.update(manager.filter(image__in=names)
+                         .values_list('image', flat=True))
+        return found
+
+    def process(self, batch):
+        if not batch:
+            return
+        prefix = thumbnail_settings.THUMBNAIL_PREFIX
+        thumbnails = [path for path in batch if path.startswith(prefix)]
+        originals = [path for path in batch if not path.startswith(prefix)]
+        orphans = set(originals) - self.referenced(originals)
+        # Миниатюры, о которых sorl знает, решает purge_thumbnails по
+        # источнику; здесь остаются только неизвестные хранилищу ключей
+        orphans.update(
+            path for path in thumbnails
+            if default.kvstore.get(ImageFile(path, default.storage)) is None)
+        for path in sorted(orphans):
+            if self.dry_run or self.verbosity > 1:
+                self.stdout.write(f'Сирота: {path}')
+            if not self.dry_run:
+                try:
+                    os.remove(os.path.join(settings.MEDIA_ROOT, path))
+                except FileNotFoundError:
+                    # Файл успели удалить параллельно
+                    continue
+            self.deleted += 1
+
+    def purge_thumbnails(self):
+        """Удаляет миниатюры картинок, на которые не ссылается ни один
+        пост, в том числе архивный, вместе с их ключами sorl."""
+        kvstore = default.kvstore
+        upload_to = Post._meta.get_field('image').upload_to.strip('/')
+        source_keys = iter(kvstore._find_keys(identity='thumbnails'))
+        while True:
+            keys = list(islice(source_keys, self.batch_size))
+            if not keys:
+                break
+            sources = [
+                source for source in map(kvstore._get, keys)
+                if source is not None and source.name.startswith(upload_to)]
+            unused = ({source.name for source in sources}
+                      - self.referenced([source.name for source in sources]))
+            for source in sources:
+                if source.name not in unused:
+                    continue
+                count = len(
+                    kvstore._get(source.key, identity='thumbnails') or [])
+                if self.dry_run or self.verbosity > 1:
+                    self.stdout.write(
+                        f'Миниатюры без источника: {source.name}, {count}')
+                if not self.dry_run:
+                    kvstore.delete(source)
+                self.deleted += count
@@ -0,0 +1,49 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import changelog
+
+
+class Command(BaseCommand):
+    help = ('Выводит новые для потребителя события журнала изменений '
+            'строками JSON и сохраняет его смещение')
+
+    def add_arguments(self, parser):
+        parser.add_argument('consumer', help='Имя потребителя')
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.CHANGELOG_BATCH_SIZE)
+        parser.add_argument('--from', type=int, dest='position',
+                            help='Начать после события с этим id, '
+                                 '0 - проиграть журнал заново')
+        parser.add_argument('--follow', action='store_true',
+                            help='Ждать новые события, не завершаясь')
+        parser.add_argument('--purge', action='store_true',
+                            help='Удалить старые прочитанные события')
+
+    def handle(self, *args, **options):
+        if options['position'] is not None:
+            changelog.reset(options['consumer'], options['position'])
+        while True:
+            changelog.consume(options['consumer'], self.write,
+                              options['batch_size'])
+            if not options['follow']:
+                break
+            time.sleep(settings.CHANGELOG_POLL_INTERVAL)
+        if options['purge']:
+            purged = changelog.purge()
+            self.stderr.write(f'Удалено событий: {purged}')
+
+    def write(self, events):
+        for event in events:
+            self.stdout.write(json.dumps({
+                'id': event.pk,
+                'model': event.model,
+                'object_id': event.object_id,
+                'action': event.action,
+                'created': event.created.isoformat(),
+                'data': json.loads(event.payload),
+            }, ensure_ascii=False))
+        self.stdout.flush()
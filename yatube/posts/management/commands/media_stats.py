@@ -0,0 +1,43 @@
+from collections import Counter
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from posts import sharding
+from posts.models import Post
+
+
+def image_references():
+    """Пары (картинка, число записей) по всем базам с записями."""
+    databases = sharding.post_databases()
+    images = (
+        Post.objects.exclude(image='').exclude(image=None)
+        .values_list('image').annotate(refs=Count('id')).order_by()
+    )
+    rows = chain.from_iterable(
+        images.using(alias).iterator() for alias in databases)
+    if len(databases) == 1:
+        return rows
+    # Одна картинка может быть в нескольких шардах: складываем
+    totals = Counter()
+    for name, refs in rows:
+        totals[name] += refs
+    return totals.items()
+
+
+class Command(BaseCommand):
+    help = 'Показывает, сколько места экономит дедупликация картинок'
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        references = files = saved = 0
+        for name, refs in image_references():
+            references += refs
+            files += 1
+            if refs > 1 and storage.exists(name):
+                saved += storage.size(name) * (refs - 1)
+        ratio = 1 - files / references if references else 0
+        self.stdout.write(
+            f'Ссылок на картинки: {references}, файлов: {files}, '
+            f'доля дублей: {ratio:.1%}, сэкономлено: {saved} байт')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает закэшированные списки популярных постов и сообществ'
+
+    def handle(self, *args, **options):
+        top = trending.refresh()
+        self.stdout.write(
+            f'Популярных постов: {len(top[trending.POST])}, '
+            f'сообществ: {len(top[trending.GROUP])}')
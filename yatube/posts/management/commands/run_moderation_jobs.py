@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts import moderation
+from posts.models import ModerationJob
+
+
+class Command(BaseCommand):
+    help = ('Ставит в очередь задач незавершенные задачи модерации, в том '
+            'числе прерванные перезапуском сервера; выполняет их run_tasks')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Продолжить и задачи, завершившиеся ошибкой')
+
+    def handle(self, *args, **options):
+        statuses = [ModerationJob.PENDING, ModerationJob.RUNNING]
+        if options['retry_failed']:
+            ModerationJob.objects.filter(status=ModerationJob.FAILED).update(
+                status=ModerationJob.RUNNING, error='')
+        job_ids = ModerationJob.objects.filter(
+            status__in=statuses).order_by('pk').values_list('pk', flat=True)
+        for job_id in job_ids:
+            task = moderation.enqueue(job_id)
+            self.stdout.write(
+                f'Задача модерации {job_id}: {task.get_status_display()}')
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди и ставит периодические '
+            'из TASKS_PERIODIC')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.TASKS_WORKERS)
+        parser.add_argument('--processes', action='store_true',
+                            help='Пул процессов вместо пула потоков')
+        parser.add_argument('--once', action='store_true',
+                            help='Завершиться, когда готовых задач не '
+                                 'останется')
+
+    def handle(self, *args, **options):
+        worker = Worker(options['workers'], options['processes'])
+        self.stdout.write(f'Воркер {worker.name} запущен')
+        worker.run(once=options['once'])
@@ -0,0 +1,86 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import digest
+from posts.checkpoints import Checkpoint
+
+
+class Command(BaseCommand):
+    help = ('Рассылает дайджест новых записей от авторов из подписок. '
+            'Можно прерывать: рассылка продолжится с чекпоинта')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=sorted(digest.PERIODS),
+                            default='daily')
+        parser.add_argument('--chunk-size', type=int,
+                            default=settings.DIGEST_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int,
+                            default=settings.DIGEST_WORKERS)
+        parser.add_argument('--checkpoint',
+                            default=settings.DIGEST_CHECKPOINT)
+        parser.add_argument('--reset', action='store_true',
+                            help='Начать рассылку заново')
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options['checkpoint'])
+        if options['reset']:
+            checkpoint.clear()
+        period = options['period']
+        state = checkpoint.load()
+        if state.get('period') != period:
+            # Окно фиксируется при старте, чтобы продолжение рассылки
+            # не захватило записи, появившиеся после сбоя
+            until = timezone.now()
+            state = {
+                'period': period,
+                'since': (until - digest.PERIODS[period]).isoformat(),
+                'until': until.isoformat(),
+                'last': 0,
+            }
+        since = parse_datetime(state['since'])
+        until = parse_datetime(state['until'])
+
+        chunks = digest.recipient_chunks(
+            options['chunk_size'], after=state['last'])
+        if options['workers'] > 1:
+            results = self.pool(chunks, options['workers'], period,
+                                since, until)
+        else:
+            results = (
+                (chunk[-1], digest.send_chunk(chunk, period, since, until))
+                for chunk in chunks)
+
+        sent = 0
+        for last, count in results:
+            sent += count
+            state['last'] = last
+            checkpoint.save(state)
+        checkpoint.clear()
+        self.stdout.write(f'Отправлено писем: {sent}')
+
+    def pool(self, chunks, workers, *args):
+        """Отдает результаты пачек в порядке получателей.
+
+        Чекпоинт сдвигается только за непрерывно завершенным
+        префиксом, а в работе держится не больше двух пачек на процесс.
+        """
+        pending = deque()
+        with ProcessPoolExecutor(workers) as executor:
+            for chunk in chunks:
+                # Дочерние процессы не должны делить соединение с родителем
+                connections.close_all()
+                pending.append(
+                    (chunk[-1],
+                     executor.submit(digest.send_chunk, chunk, *args)))
+                if len(pending) >= workers * 2:
+                    last, future = pending.popleft()
+                    yield last, future.result()
+            while pending:
+                last, future = pending.popleft()
+                yield last, future.result()
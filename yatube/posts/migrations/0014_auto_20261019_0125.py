@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_group_stats(apps, schema_editor):
+    Group = apps.get_model('posts', 'Group')
+    Post = apps.get_model('posts', 'Post')
+    for group in Group.objects.all():
+        posts = Post.objects.filter(group=group)
+        group.posts_count = posts.count()
+        group.last_post = posts.order_by('-pub_date').first()
+        group.last_post_date = (
+            group.last_post.pub_date if group.last_post else None)
+        group.save(update_fields=(
+            'posts_count', 'last_post', 'last_post_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_auto_20261019_0123'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='last_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='posts.Post', verbose_name='Последняя запись'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='last_post_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата последней записи'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Записей'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date'], name='post_group_pub_date_idx'),
+        ),
+        migrations.RunPython(fill_group_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_auto_20261019_0150'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardTicket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Билет идентификатора',
+                'verbose_name_plural': 'Билеты идентификаторов',
+            },
+        ),
+    ]
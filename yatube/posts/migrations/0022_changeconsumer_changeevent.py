@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_shardticket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeConsumer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Потребитель')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Последнее обработанное событие')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Потребитель журнала',
+                'verbose_name_plural': 'Потребители журнала',
+            },
+        ),
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=32, verbose_name='Модель')),
+                ('object_id', models.PositiveIntegerField(verbose_name='id объекта')),
+                ('action', models.CharField(choices=[('created', 'Создание'), ('updated', 'Изменение'), ('deleted', 'Удаление')], max_length=16, verbose_name='Действие')),
+                ('payload', models.TextField(verbose_name='Данные (JSON)')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата события')),
+            ],
+            options={
+                'verbose_name': 'Событие журнала',
+                'verbose_name_plural': 'Журнал изменений',
+                'ordering': ('id',),
+            },
+        ),
+    ]
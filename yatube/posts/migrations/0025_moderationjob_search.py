@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0024_auto_20261019_0201'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moderationjob',
+            name='search',
+            field=models.CharField(blank=True, max_length=200, verbose_name='Поиск'),
+        ),
+    ]
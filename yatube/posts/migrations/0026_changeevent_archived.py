@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0025_moderationjob_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changeevent',
+            name='action',
+            field=models.CharField(choices=[('created', 'Создание'), ('updated', 'Изменение'), ('deleted', 'Удаление'), ('archived', 'Перенос в архив')], max_length=16, verbose_name='Действие'),
+        ),
+    ]
@@ -1,15 +1,53 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.db.models import F, Q
+from django.utils import timezone
+
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
 
+class SoftDeleteQuerySet(models.QuerySet):
+
+    def soft_delete(self):
+        # Счетчики сообществ и постов правит services.soft_delete_*
+        return self.filter(deleted_at__isnull=True).update(
+            deleted_at=timezone.now())
+
+    def create(self, **kwargs):
+        # Без явной базы шард выбирает роутер по самому экземпляру
+        if self._db is None:
+            obj = self.model(**kwargs)
+            obj.save(force_insert=True)
+            return obj
+        return super().create(**kwargs)
+
+
+class LiveManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """Только неудаленные строки: ими пользуются ленты и связи."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Group(models.Model):
     title = models.CharField(max_length=200,
                              verbose_name='Название сообщества')
     slug = models.SlugField(unique=True)
     description = models.TextField(verbose_name='Описание сообщества')
+    # Денормализованные поля каталога, обновляются сигналами Post
+    posts_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Записей')
+    last_post_date = models.DateTimeField(
+        blank=True, null=True, editable=False,
+        verbose_name='Дата последней записи')
+    # При шардировании запись лежит в другой базе: ограничение в СУБД
+    # не создаем, SET_NULL выполняет Django
+    last_post = models.ForeignKey(
+        'Post', on_delete=models.SET_NULL, blank=True, null=True,
+        editable=False, related_name='+', db_constraint=False,
+        verbose_name='Последняя запись')
 
     class Meta:
         verbose_name = 'Сообщество'
@@ -33,16 +71,41 @@ class Post(models.Model):
                               verbose_name='Сообщество',
                               help_text='Укажите сообщество')
     image = models.ImageField(verbose_name='Иллюстрация',
-                              upload_to='posts/', blank=True, null=True)
+                              upload_to='posts/', blank=True, null=True,
+                              storage=ContentAddressedStorage(),
+                              db_index=True)
+    comment_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Комментариев')
+    # Пишется пачками из posts.counters
+    views = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Просмотров')
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False,
+                                      verbose_name='Дата удаления')
+
+    objects = LiveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Запись'
         verbose_name_plural = 'Записи'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(fields=('group', '-pub_date'),
+                         name='post_group_pub_date_idx'),
+        )
 
     def __str__(self):
         return self.text[:15]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Нужно знать прежние сообщество и картинку, чтобы поправить
+        # счетчики сообщества и освободить замененный файл
+        instance._loaded_group_id = instance.__dict__.get('group_id')
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, verbose_name='Пост',
@@ -52,8 +115,13 @@ class Comment(models.Model):
                                related_name='comments',
                                on_delete=models.CASCADE)
     text = models.TextField(verbose_name='Комментарий')
-    created = models.DateTimeField(auto_now_add=True,
+    created = models.DateTimeField(auto_now_add=True, db_index=True,
                                    verbose_name='Дата комментария')
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False,
+                                      verbose_name='Дата удаления')
+
+    objects = LiveManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Комментарий'
@@ -77,3 +145,274 @@ class Follow(models.Model):
                 check=~Q(user=F('author')), name='no_self_following'
             )
         )
+        indexes = (
+            models.Index(fields=('author', 'id'),
+                         name='follow_author_id_idx'),
+            models.Index(fields=('user', 'id'),
+                         name='follow_user_id_idx'),
+        )
+
+
+class Recommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='recommendations',
+                             verbose_name='Пользователь')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+',
+                               verbose_name='Рекомендуемый автор')
+    score = models.FloatField(verbose_name='Вес рекомендации')
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        ordering = ('-score',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'author'), name='unique_recommendation'
+            ),
+        )
+        indexes = (
+            models.Index(fields=('user', '-score'),
+                         name='recommendation_user_idx'),
+        )
+
+
+class Notification(models.Model):
+    COMMENT = 'comment'
+    FOLLOW = 'follow'
+    VERBS = (
+        (COMMENT, 'Комментарий'),
+        (FOLLOW, 'Подписка'),
+    )
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE,
+                                  related_name='notifications',
+                                  verbose_name='Получатель')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE,
+                              related_name='+',
+                              verbose_name='Последний участник')
+    verb = models.CharField(max_length=16, choices=VERBS,
+                            verbose_name='Событие')
+    # Как Group.last_post: запись может лежать в шарде
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             blank=True, null=True, related_name='+',
+                             db_constraint=False, verbose_name='Пост')
+    count = models.PositiveIntegerField(default=1,
+                                        verbose_name='Число событий')
+    is_read = models.BooleanField(default=False, verbose_name='Прочитано')
+    updated = models.DateTimeField(db_index=True,
+                                   verbose_name='Дата события')
+
+    class Meta:
+        verbose_name = 'Уведомление'
+        verbose_name_plural = 'Уведомления'
+        ordering = ('-updated',)
+        indexes = (
+            models.Index(fields=('recipient', 'is_read'),
+                         name='notification_unread_idx'),
+        )
+
+
+class ModerationJob(models.Model):
+    MOVE_POSTS = 'move_posts'
+    DELETE_POSTS = 'delete_posts'
+    DELETE_COMMENTS = 'delete_comments'
+    ACTIONS = (
+        (MOVE_POSTS, 'Перенос записей в сообщество'),
+        (DELETE_POSTS, 'Удаление записей'),
+        (DELETE_COMMENTS, 'Удаление комментариев'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    action = models.CharField(max_length=32, choices=ACTIONS,
+                              verbose_name='Действие')
+    lookup = models.TextField(verbose_name='Условие отбора (JSON)')
+    search = models.CharField(max_length=200, blank=True,
+                              verbose_name='Поиск')
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL,
+                              blank=True, null=True, related_name='+',
+                              verbose_name='Целевое сообщество')
+    status = models.CharField(max_length=16, choices=STATUSES,
+                              default=PENDING, db_index=True,
+                              verbose_name='Состояние')
+    total = models.PositiveIntegerField(default=0, verbose_name='Всего')
+    processed = models.PositiveIntegerField(default=0,
+                                            verbose_name='Обработано')
+    last_id = models.PositiveIntegerField(default=0,
+                                          verbose_name='Последний id')
+    affected_groups = models.TextField(
+        default='[]', verbose_name='Затронутые сообщества (JSON)')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL,
+                                   blank=True, null=True, related_name='+',
+                                   verbose_name='Модератор')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создана')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Обновлена')
+
+    class Meta:
+        verbose_name = 'Задача модерации'
+        verbose_name_plural = 'Задачи модерации'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'№{self.pk}: {self.get_action_display()}'
+
+
+class ArchivedPost(models.Model):
+    """Старая запись, вынесенная из горячей таблицы posts_post.
+
+    id сохраняется, поэтому ссылки на запись продолжают работать.
+    """
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField(verbose_name='Текст поста')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+', verbose_name='Автор')
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL,
+                              blank=True, null=True, related_name='+',
+                              verbose_name='Сообщество')
+    image = models.ImageField(upload_to='posts/', blank=True, null=True,
+                              storage=ContentAddressedStorage(),
+                              db_index=True, verbose_name='Иллюстрация')
+    comment_count = models.PositiveIntegerField(
+        default=0, verbose_name='Комментариев')
+    views = models.PositiveIntegerField(default=0,
+                                        verbose_name='Просмотров')
+    deleted_at = models.DateTimeField(blank=True, null=True,
+                                      verbose_name='Дата удаления')
+    archived_at = models.DateTimeField(auto_now_add=True,
+                                       verbose_name='Дата архивации')
+
+    class Meta:
+        verbose_name = 'Архивная запись'
+        verbose_name_plural = 'Архивные записи'
+
+    def __str__(self):
+        return self.text[:15]
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE,
+                             related_name='comments', verbose_name='Пост')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+', verbose_name='Автор')
+    text = models.TextField(verbose_name='Комментарий')
+    created = models.DateTimeField(verbose_name='Дата комментария')
+    deleted_at = models.DateTimeField(blank=True, null=True,
+                                      verbose_name='Дата удаления')
+
+    class Meta:
+        verbose_name = 'Архивный комментарий'
+        verbose_name_plural = 'Архивные комментарии'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return self.text
+
+
+class ShardTicket(models.Model):
+    """Выдает id записей и комментариев, уникальные для всех шардов."""
+
+    class Meta:
+        verbose_name = 'Билет идентификатора'
+        verbose_name_plural = 'Билеты идентификаторов'
+
+
+class ChangeEvent(models.Model):
+    """Строка журнала изменений, пишется в транзакции самого изменения."""
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ARCHIVED = 'archived'
+    ACTIONS = (
+        (CREATED, 'Создание'),
+        (UPDATED, 'Изменение'),
+        (DELETED, 'Удаление'),
+        (ARCHIVED, 'Перенос в архив'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=32, verbose_name='Модель')
+    object_id = models.PositiveIntegerField(verbose_name='id объекта')
+    action = models.CharField(max_length=16, choices=ACTIONS,
+                              verbose_name='Действие')
+    payload = models.TextField(verbose_name='Данные (JSON)')
+    created = models.DateTimeField(auto_now_add=True, db_index=True,
+                                   verbose_name='Дата события')
+
+    class Meta:
+        verbose_name = 'Событие журнала'
+        verbose_name_plural = 'Журнал изменений'
+        ordering = ('id',)
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}: {self.action}'
+
+
+class ChangeConsumer(models.Model):
+    name = models.CharField(max_length=64, unique=True,
+                            verbose_name='Потребитель')
+    position = models.BigIntegerField(
+        default=0, verbose_name='Последнее обработанное событие')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Потребитель журнала'
+        verbose_name_plural = 'Потребители журнала'
+
+    def __str__(self):
+        return self.name
+
+
+class Task(models.Model):
+    """Фоновая задача в очереди posts.tasks."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    kwargs = models.TextField(default='{}', verbose_name='Аргументы (JSON)')
+    key = models.CharField(max_length=200, unique=True, blank=True,
+                           null=True, verbose_name='Ключ идемпотентности')
+    status = models.CharField(max_length=16, choices=STATUSES,
+                              default=PENDING, verbose_name='Состояние')
+    run_at = models.DateTimeField(verbose_name='Запустить не раньше')
+    attempts = models.PositiveIntegerField(default=0,
+                                           verbose_name='Попыток')
+    locked_by = models.CharField(max_length=100, blank=True,
+                                 verbose_name='Воркер')
+    locked_until = models.DateTimeField(blank=True, null=True,
+                                        verbose_name='Занята до')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создана')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Обновлена')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('run_at',)
+        indexes = (
+            models.Index(fields=('status', 'run_at'), name='task_due_idx'),
+        )
+
+    def __str__(self):
+        return f'№{self.pk}: {self.name}'
@@ -0,0 +1,132 @@
+"""Массовая модерация из админки фоновыми задачами.
+
+Задача хранит условие отбора (фильтры и поиск списка админки или id
+выбранных на странице объектов) и курсор по id. Каждая пачка
+обрабатывается в своей транзакции вместе со сдвигом курсора, так что
+прерванную задачу можно продолжить. Выполняет ее очередь posts.tasks
+(manage.py run_tasks), поэтому задача переживает перезапуск сервера;
+manage.py run_moderation_jobs только ставит незавершенные заново.
+Пересчет сообществ, популярного и версий лент выполняется один раз
+в конце.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from . import changelog, search, services, tasks, trending, versions
+from .models import ChangeEvent, Comment, ModerationJob, Post, Task
+
+logger = logging.getLogger(__name__)
+
+
+def move_posts(job, ids):
+    posts = Post.objects.filter(pk__in=ids)
+    groups = set(posts.values_list('group_id', flat=True))
+    # Мимо сигналов: статистику сообществ пересчитываем в конце
+    posts.update(group=job.group)
+    changelog.record_many(posts, ChangeEvent.UPDATED)
+    return groups | {job.group_id}
+
+
+def delete_posts(job, ids):
+    # Мягкое удаление: строки и картинки уберет архивация
+    services.soft_delete_posts(Post.objects.filter(pk__in=ids),
+                               bump_versions=False)
+    return set()
+
+
+def delete_comments(job, ids):
+    services.soft_delete_comments(Comment.objects.filter(pk__in=ids),
+                                  bump_versions=False)
+    return set()
+
+
+HANDLERS = {
+    ModerationJob.MOVE_POSTS: (Post, move_posts),
+    ModerationJob.DELETE_POSTS: (Post, delete_posts),
+    ModerationJob.DELETE_COMMENTS: (Comment, delete_comments),
+}
+
+
+def job_queryset(job):
+    model, _ = HANDLERS[job.action]
+    queryset = model.objects.filter(**json.loads(job.lookup))
+    if job.search:
+        # Поиск есть только в списке записей
+        queryset = search.search_posts(queryset, job.search)
+    return queryset
+
+
+def queue(action, lookup, user=None, group=None, search=''):
+    """Ставит задачу в очередь; lookup - аргументы filter() модели,
+    search - строка поиска списка записей."""
+    job = ModerationJob(action=action, lookup=json.dumps(lookup),
+                        search=search, group=group, created_by=user)
+    job.total = job_queryset(job).count()
+    with transaction.atomic():
+        job.save()
+        enqueue(job.pk)
+    return job
+
+
+def enqueue(job_id):
+    """Ставит задачу posts.run_moderation_job; уже стоящую не дублирует.
+
+    Завершенная задача очереди держит key, поэтому для прерванной или
+    упавшей задачи модерации key освобождается и ставится новая.
+    """
+    key = f'moderation:{job_id}'
+    Task.objects.filter(key=key, status__in=(Task.DONE, Task.FAILED)).update(
+        key=None)
+    return tasks.enqueue('posts.run_moderation_job', {'job_id': job_id},
+                         key=key)
+
+
+def run_batch(job_id):
+    """Обрабатывает одну пачку; возвращает False, когда работы не осталось."""
+    with transaction.atomic():
+        job = ModerationJob.objects.select_for_update().get(pk=job_id)
+        if job.status in (ModerationJob.DONE, ModerationJob.FAILED):
+            return False
+        _, handler = HANDLERS[job.action]
+        ids = list(
+            job_queryset(job).filter(pk__gt=job.last_id).order_by('pk')
+            .values_list('pk', flat=True)[:settings.MODERATION_BATCH_SIZE])
+        if not ids:
+            return False
+        groups = handler(job, ids)
+        job.status = ModerationJob.RUNNING
+        job.processed += len(ids)
+        job.last_id = ids[-1]
+        job.affected_groups = json.dumps(sorted(
+            set(json.loads(job.affected_groups)) | groups - {None}))
+        job.save()
+    return True
+
+
+def run(job_id):
+    try:
+        while run_batch(job_id):
+            pass
+    except Exception as error:
+        logger.exception('Задача модерации %s завершилась ошибкой', job_id)
+        ModerationJob.objects.filter(pk=job_id).update(
+            status=ModerationJob.FAILED, error=str(error))
+        # Часть пачек уже применена
+        versions.bump(versions.BULK)
+        return
+    finish(job_id)
+
+
+def finish(job_id):
+    with transaction.atomic():
+        job = ModerationJob.objects.select_for_update().get(pk=job_id)
+        if job.status in (ModerationJob.DONE, ModerationJob.FAILED):
+            return
+        services.refresh_group_stats(json.loads(job.affected_groups))
+        job.status = ModerationJob.DONE
+        job.save()
+    versions.bump(versions.BULK)
+    trending.refresh()
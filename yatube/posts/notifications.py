@@ -0,0 +1,94 @@
+"""Уведомления о комментариях и подписчиках.
+
+События одной транзакции записываются пачкой из очереди
+write-behind после коммита, так что запрос не ждет записи.
+Непрочитанное уведомление того же вида на тот же пост не дублируется,
+а увеличивает счетчик: «5 новых комментариев».
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Notification
+from .writebehind import defer
+
+UNREAD_KEY = 'notifications:unread:{}'
+
+
+def notify(recipient_id, actor_id, verb, post_id=None):
+    notify_many([(recipient_id, actor_id, verb, post_id)])
+
+
+def notify_many(events):
+    events = [event for event in events if event[0] != event[1]]
+    if not events:
+        return
+    defer(deliver, events)
+
+
+def deliver(events):
+    grouped = OrderedDict()
+    for recipient_id, actor_id, verb, post_id in events:
+        key = (recipient_id, verb, post_id)
+        count, _ = grouped.get(key, (0, None))
+        grouped[key] = (count + 1, actor_id)
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Непрочитанных у получателя мало: они уже схлопнуты
+        existing = {
+            (notification.recipient_id, notification.verb,
+             notification.post_id): notification
+            for notification in Notification.objects.select_for_update()
+            .filter(is_read=False,
+                    recipient_id__in={key[0] for key in grouped})
+        }
+        updated, created = [], []
+        for key, (count, actor_id) in grouped.items():
+            notification = existing.get(key)
+            if notification is None:
+                recipient_id, verb, post_id = key
+                created.append(Notification(
+                    recipient_id=recipient_id, actor_id=actor_id, verb=verb,
+                    post_id=post_id, count=count, updated=now))
+            else:
+                notification.count += count
+                notification.actor_id = actor_id
+                notification.updated = now
+                updated.append(notification)
+        Notification.objects.bulk_update(
+            updated, ('count', 'actor', 'updated'))
+        Notification.objects.bulk_create(created)
+    cache.delete_many(
+        [UNREAD_KEY.format(recipient_id) for recipient_id, _, _ in grouped])
+    return len(events)
+
+
+def unread_count(user):
+    key = UNREAD_KEY.format(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(
+            recipient=user, is_read=False).count()
+        cache.set(key, count, settings.NOTIFICATIONS_UNREAD_TIMEOUT)
+    return count
+
+
+def mark_read(user, shown):
+    """Отмечает прочитанными показанные уведомления.
+
+    Уведомление с другой страницы, пришедшее или дополненное после
+    показа, остается непрочитанным: условие включает и updated.
+    """
+    rows = Q()
+    for notification in shown:
+        rows |= Q(pk=notification.pk, updated=notification.updated)
+    if not rows:
+        return
+    Notification.objects.filter(rows, recipient=user, is_read=False).update(
+        is_read=True)
+    cache.delete(UNREAD_KEY.format(user.pk))
@@ -0,0 +1,148 @@
+"""Офлайн-расчет рекомендаций «на кого подписаться».
+
+Граф подписок, активность в сообществах и комментарии собираются в
+разреженные матрицы пользователь x пользователь, и кандидаты считаются
+матричными произведениями блоками строк, поэтому память ограничена
+размером блока, а не числом пользователей. Из каждого произведения в
+строке остается не больше RECOMMENDATION_CANDIDATES кандидатов.
+"""
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+
+from . import versions
+from .models import Comment, Follow, Post, Recommendation, User
+
+EDGES_CHUNK = 100000
+
+
+def load_edges(queryset, fields):
+    pairs = queryset.values_list(*fields).iterator(chunk_size=EDGES_CHUNK)
+    edges = np.fromiter(chain.from_iterable(pairs), dtype=np.int64)
+    edges = edges.reshape(-1, 2)
+    return edges[:, 0], edges[:, 1]
+
+
+def edges_matrix(queryset, fields, shape, binary=False):
+    rows, cols = load_edges(queryset, fields)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    matrix.sum_duplicates()
+    if binary:
+        matrix.data[:] = 1
+    else:
+        # Десять комментариев весомее одного, но не в десять раз
+        np.log1p(matrix.data, out=matrix.data)
+    return matrix
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+def build_matrices():
+    users = (User.objects.order_by('-pk').values_list('pk', flat=True)
+             .first() or 0) + 1
+    groups = (Post.objects.exclude(group=None).order_by('-group_id')
+              .values_list('group_id', flat=True).first() or 0) + 1
+
+    follows = edges_matrix(
+        Follow.objects.all(), ('user_id', 'author_id'),
+        (users, users), binary=True)
+    comments = edges_matrix(
+        Comment.objects.all(), ('author_id', 'post__author_id'),
+        (users, users))
+    authored = edges_matrix(
+        Post.objects.exclude(group=None), ('author_id', 'group_id'),
+        (users, groups))
+    commented = edges_matrix(
+        Comment.objects.exclude(post__group=None),
+        ('author_id', 'post__group_id'), (users, groups))
+    activity = normalize_rows(authored + commented)
+    return follows, comments, activity, normalize_rows(authored)
+
+
+def top_k(scores, k):
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        if start == end:
+            yield row, ()
+            continue
+        data = scores.data[start:end]
+        cols = scores.indices[start:end]
+        if len(data) > k:
+            best = np.argpartition(-data, k - 1)[:k]
+            data, cols = data[best], cols[best]
+        order = np.argsort(-data, kind='stable')
+        yield row, zip(cols[order].tolist(), data[order].tolist())
+
+
+def keep_top(matrix, k):
+    """Оставляет в каждой строке разреженной матрицы k наибольших."""
+    lengths = np.diff(matrix.indptr)
+    for row in np.flatnonzero(lengths > k):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        rest = np.argpartition(-matrix.data[start:end], k - 1)[k:]
+        matrix.data[start + rest] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def block_scores(matrices, start, end, weights, candidates):
+    follows, comments, activity, authors_activity = matrices
+    block = follows[start:end]
+    # Уже подписан или это сам пользователь: рекомендовать нечего
+    own = sparse.csr_matrix(
+        (np.ones(end - start), (np.arange(end - start),
+                                np.arange(start, end))),
+        shape=block.shape)
+    seen = block + own
+
+    def best(product):
+        # Произведения разрежены, но в популярном сообществе строка
+        # охватывает всех его авторов: складываем только лучших
+        product = product.tocsr()
+        product = product - product.multiply(seen)
+        product.eliminate_zeros()
+        return keep_top(product, candidates)
+
+    scores = (
+        weights['friends'] * best(block.dot(follows))
+        + weights['groups'] * best(
+            activity[start:end].dot(authors_activity.T))
+        + weights['comments'] * best(comments[start:end])
+    ).tocsr()
+    scores.eliminate_zeros()
+    return scores
+
+
+def build_recommendations(top=None, block_size=None):
+    top = top or settings.RECOMMENDATION_COUNT
+    block_size = block_size or settings.RECOMMENDATION_BLOCK_SIZE
+    candidates = max(top, settings.RECOMMENDATION_CANDIDATES)
+    weights = settings.RECOMMENDATION_WEIGHTS
+    matrices = build_matrices()
+    users = matrices[0].shape[0]
+    stored = 0
+    for start in range(0, users, block_size):
+        end = min(start + block_size, users)
+        scores = block_scores(matrices, start, end, weights, candidates)
+        recommendations = [
+            Recommendation(user_id=start + row, author_id=author,
+                           score=score)
+            for row, best in top_k(scores, top)
+            for author, score in best
+        ]
+        with transaction.atomic():
+            Recommendation.objects.filter(
+                user_id__gte=start, user_id__lt=end).delete()
+            Recommendation.objects.bulk_create(
+                recommendations, batch_size=block_size)
+        stored += len(recommendations)
+    versions.bump_now(versions.RECOMMENDATIONS)
+    return stored
@@ -0,0 +1,81 @@
+"""Полнотекстовый поиск по записям.
+
+На SQLite текст записей индексируется внешней таблицей FTS5, которую
+держат в актуальном состоянии триггеры. На других СУБД поиск идет
+обычным LIKE.
+"""
+import re
+
+from django.db import connection
+
+FTS_TABLE = 'posts_post_fts'
+
+INSTALL_SQL = (
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+)
+
+
+def fts_available(db=connection):
+    return db.vendor == 'sqlite'
+
+
+def install(using='default', **kwargs):
+    """Создает индекс и триггеры, если их нет.
+
+    Вызывается после каждой миграции: при изменении схемы SQLite
+    пересоздает таблицу posts_post, и ее триггеры теряются.
+    """
+    from django.db import connections
+
+    db = connections[using]
+    if not fts_available(db):
+        return
+    with db.cursor() as cursor:
+        tables = db.introspection.table_names(cursor)
+        if 'posts_post' not in tables:
+            return
+        created = FTS_TABLE not in tables
+        if created:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(text, "
+                f"content='posts_post', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')")
+        for sql in INSTALL_SQL:
+            cursor.execute(sql)
+        if created:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def fts_query(term):
+    # Каждое слово в кавычках как префикс: пользовательский ввод не
+    # разбирается как синтаксис запроса FTS5
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', term))
+
+
+def search_posts(queryset, term):
+    if not fts_available():
+        return queryset.filter(text__icontains=term)
+    query = fts_query(term)
+    if not query:
+        return queryset.none()
+    # Не id__in=RawSQL(...): лишние скобки превращают подзапрос в
+    # скалярный, и находится только первая запись
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    return queryset.extra(where=[
+        f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s)'], params=[query])
@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from . import changelog, notifications, trending, versions
+from .models import (ChangeEvent, Comment, Follow, Group, Notification, Post,
+                     Recommendation, User)
+
+FOLLOW_COUNTS_KEY = 'follow_counts:{}'
+
+
+def follow_counts(user):
+    key = FOLLOW_COUNTS_KEY.format(user.pk)
+    counts = cache.get(key)
+    if counts is None:
+        counts = {
+            'followers': user.following.count(),
+            'following': user.follower.count(),
+        }
+        cache.set(key, counts, settings.FOLLOW_COUNTS_TIMEOUT)
+    return counts
+
+
+def invalidate_follow_counts(user_ids):
+    cache.delete_many(
+        [FOLLOW_COUNTS_KEY.format(user_id) for user_id in user_ids])
+
+
+def author_ids(usernames):
+    return list(
+        User.objects.filter(username__in=usernames)
+        .values_list('pk', flat=True)
+    )
+
+
+def follow(user, authors):
+    # Одна вставка на всю пачку: повторы отсекает unique_following,
+    # подписку на себя убираем заранее из-за no_self_following
+    authors = [pk for pk in authors if pk != user.pk]
+    with transaction.atomic():
+        followed = set(Follow.objects.filter(
+            user=user, author_id__in=authors
+        ).values_list('author_id', flat=True))
+        Follow.objects.bulk_create(
+            (Follow(user=user, author_id=pk) for pk in authors),
+            ignore_conflicts=True
+        )
+        new_authors = [pk for pk in authors if pk not in followed]
+        changelog.record_many(
+            Follow.objects.filter(user=user, author_id__in=new_authors),
+            ChangeEvent.CREATED)
+    invalidate_follow_counts([user.pk, *authors])
+    if new_authors:
+        versions.bump(versions.FOLLOWS.format(user.pk),
+                      *(versions.AUTHOR.format(pk) for pk in new_authors))
+    trending.record_many(trending.AUTHOR, new_authors)
+    notifications.notify_many([
+        (pk, user.pk, Notification.FOLLOW, None) for pk in new_authors
+    ])
+    return authors
+
+
+def unfollow(user, authors):
+    with transaction.atomic():
+        Follow.objects.filter(user=user, author_id__in=authors).delete()
+    invalidate_follow_counts([user.pk, *authors])
+    return authors
+
+
+def recommended_authors(user, exclude=None):
+    # Рекомендации посчитаны заранее: здесь только чтение по индексу
+    if not user.is_authenticated:
+        return []
+    recommendations = Recommendation.objects.filter(user=user).annotate(
+        is_followed=Exists(Follow.objects.filter(
+            user=user, author=OuterRef('author')))
+    ).filter(is_followed=False).select_related('author')
+    if exclude is not None:
+        recommendations = recommendations.exclude(author=exclude)
+    return [
+        recommendation.author for recommendation
+        in recommendations[:settings.RECOMMENDATION_SHOW_COUNT]
+    ]
+
+
+def group_post_added(group_id, post):
+    if group_id is None:
+        return
+    groups = Group.objects.filter(pk=group_id)
+    groups.update(posts_count=F('posts_count') + 1)
+    groups.filter(
+        Q(last_post_date__isnull=True) | Q(last_post_date__lte=post.pub_date)
+    ).update(last_post=post, last_post_date=post.pub_date)
+
+
+def group_post_removed(group_id, post):
+    if group_id is None:
+        return
+    groups = Group.objects.filter(pk=group_id)
+    groups.filter(posts_count__gt=0).update(
+        posts_count=F('posts_count') - 1)
+    # При удалении поста last_post уже обнулен каскадом SET_NULL
+    if groups.filter(
+            Q(last_post=post) | Q(last_post__isnull=True)).exists():
+        refresh_last_post(group_id, exclude=post.pk)
+
+
+def refresh_last_post(group_id, exclude=None):
+    last_post = Post.objects.filter(group_id=group_id).exclude(
+        pk=exclude).order_by('-pub_date').only('pk', 'pub_date').first()
+    Group.objects.filter(pk=group_id).update(
+        last_post=last_post,
+        last_post_date=last_post.pub_date if last_post else None)
+
+
+def refresh_group_stats(group_ids):
+    # Полный пересчет для массовых операций, минующих сигналы
+    for group_id in group_ids:
+        Group.objects.filter(pk=group_id).update(
+            posts_count=Post.objects.filter(group_id=group_id).count())
+        refresh_last_post(group_id)
+
+
+def soft_delete_posts(posts, bump_versions=True):
+    """Скрывает записи из лент; строки и картинки остаются до архивации.
+
+    bump_versions=False оставляет сброс версий лент вызывающему, например
+    задаче модерации, которая удаляет записи пачками.
+    """
+    with transaction.atomic():
+        posts = posts.filter(deleted_at__isnull=True)
+        group_ids = set(posts.exclude(group=None).values_list(
+            'group_id', flat=True))
+        ids = list(posts.values_list('pk', flat=True))
+        deleted = posts.soft_delete()
+        refresh_group_stats(group_ids)
+        changelog.record_many(Post.all_objects.filter(pk__in=ids),
+                              ChangeEvent.DELETED)
+    if bump_versions:
+        # Мимо сигналов: сбрасываем версии всех лент разом
+        versions.bump(versions.BULK)
+    return deleted
+
+
+def soft_delete_comments(comments, bump_versions=True):
+    with transaction.atomic():
+        comments = comments.filter(deleted_at__isnull=True)
+        post_ids = set(comments.values_list('post_id', flat=True))
+        ids = list(comments.values_list('pk', flat=True))
+        deleted = comments.soft_delete()
+        refresh_comment_counts(post_ids)
+        changelog.record_many(Comment.all_objects.filter(pk__in=ids),
+                              ChangeEvent.DELETED)
+    if bump_versions:
+        versions.bump(versions.BULK)
+    return deleted
+
+
+def refresh_comment_counts(post_ids):
+    live_comments = Comment.objects.filter(
+        post=OuterRef('pk')).order_by().values('post').annotate(
+        count=Count('pk')).values('count')
+    Post.all_objects.filter(pk__in=post_ids).update(
+        comment_count=Coalesce(Subquery(live_comments), 0))
+
+
+def add_comment(post, author, form):
+    comment = form.save(commit=False)
+    comment.post = post
+    comment.author = author
+    # Счетчик Post.comment_count увеличивает сигнал в той же транзакции,
+    # при шардировании - в базе записи
+    with transaction.atomic(using=post._state.db):
+        comment.save()
+    return comment
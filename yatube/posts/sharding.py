@@ -0,0 +1,161 @@
+"""Необязательное шардирование записей и комментариев по автору.
+
+Если в POST_SHARDS перечислены псевдонимы баз, записи автора и
+комментарии к ним живут в базе POST_SHARDS[author_id % N], а
+пользователи, сообщества и все остальное остаются в default. Id выдает
+таблица-счетчик в default, поэтому они уникальны для всех шардов и
+растут со временем: ленты из нескольких шардов собираются слиянием
+потоков, упорядоченных по убыванию id.
+
+Связи между базами СУБД проверить не может, поэтому в этом режиме
+проверка внешних ключей SQLite выключена на шардах; в default она
+остается. Счетчики сообществ, популярное, поиск, архив и админка
+записей работают только с одной базой. Ссылки на картинки при сборке
+мусора в медиа ищутся во всех базах из post_databases().
+"""
+import heapq
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.db.models import prefetch_related_objects
+from django.dispatch import receiver
+
+SHARDED_MODELS = {('posts', 'post'), ('posts', 'comment')}
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def post_databases():
+    """Базы, где могут лежать записи: default и все шарды."""
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *settings.POST_SHARDS]))
+
+
+def shard_for(author_id):
+    shards = settings.POST_SHARDS
+    return shards[author_id % len(shards)]
+
+
+def is_sharded(model):
+    return (model._meta.app_label, model._meta.model_name) in SHARDED_MODELS
+
+
+def next_id():
+    from .models import ShardTicket
+
+    ticket = ShardTicket.objects.using(DEFAULT_DB_ALIAS).create()
+    # Счетчик AUTOINCREMENT не откатывается, старые билеты не нужны
+    ShardTicket.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk__lt=ticket.pk).delete()
+    return ticket.pk
+
+
+class PostShardRouter:
+
+    def shard_of(self, instance):
+        from .models import Comment, Post, User
+
+        if isinstance(instance, User):
+            return shard_for(instance.pk)
+        if isinstance(instance, Post):
+            return instance._state.db or shard_for(instance.author_id)
+        if isinstance(instance, Comment):
+            # Комментарий хранится рядом со своей записью
+            return instance._state.db or instance.post._state.db
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not enabled():
+            return None
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        return self.shard_of(instance) if instance is not None else None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if enabled() and (is_sharded(obj1) or is_sharded(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in settings.POST_SHARDS:
+            return None
+        return (app_label, model_name) in SHARDED_MODELS
+
+
+@receiver(connection_created)
+def disable_foreign_keys(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' \
+            and connection.alias in settings.POST_SHARDS:
+        connection.cursor().execute('PRAGMA foreign_keys = OFF')
+
+
+def related(queryset, *fields):
+    """select_related в одной базе, prefetch_related через шарды."""
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def author_posts(username, queryset):
+    """Записи автора по имени; в режиме шардирования - из его шарда."""
+    if not enabled():
+        return queryset.filter(author__username=username)
+    from .models import User
+
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        return queryset.none()
+    # JOIN с таблицами default на шарде невозможен
+    return queryset.select_related(None).using(
+        shard_for(author_id)).filter(author_id=author_id)
+
+
+def shard_stream(queryset, after, chunk_size):
+    """Записи одного шарда по убыванию id, порциями по chunk_size."""
+    while True:
+        chunk = queryset if after is None else queryset.filter(id__lt=after)
+        rows = list(chunk.order_by('-id')[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1].id
+
+
+def feed_page(request, per_page, author_ids=None, **filters):
+    """Страница ленты из всех шардов слиянием потоков по id.
+
+    Курсор ?after=<id> как у keyset_page: каждый шард отдает не больше
+    per_page + 1 строк на страницу.
+    """
+    from .models import Post
+
+    after = request.GET.get('after', '')
+    after = int(after) if after.isdigit() else None
+    if author_ids is None:
+        querysets = [Post.objects.using(alias).filter(**filters)
+                     for alias in settings.POST_SHARDS]
+    else:
+        by_shard = {}
+        for author_id in author_ids:
+            by_shard.setdefault(shard_for(author_id), []).append(author_id)
+        querysets = [
+            Post.objects.using(alias).filter(author_id__in=ids, **filters)
+            for alias, ids in by_shard.items()
+        ]
+    streams = [shard_stream(queryset, after, per_page + 1)
+               for queryset in querysets]
+    rows = list(islice(
+        heapq.merge(*streams, key=attrgetter('id'), reverse=True),
+        per_page + 1))
+    next_cursor = rows[per_page - 1].id if len(rows) > per_page else None
+    rows = rows[:per_page]
+    prefetch_related_objects(rows, 'author', 'group')
+    return rows, next_cursor
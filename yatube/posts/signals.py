@@ -0,0 +1,146 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import (changelog, notifications, services, sharding, tasks,
+               trending, versions)
+from .models import (ChangeEvent, Comment, Follow, Group, Notification,
+                     Post)
+from .storage import release_image
+from .writebehind import defer
+
+
+def record_comment(post_id, group_id):
+    trending.record(trending.POST, post_id)
+    if group_id:
+        trending.record(trending.GROUP, group_id)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def shard_id(sender, instance, **kwargs):
+    if sharding.enabled() and instance.pk is None:
+        instance.pk = sharding.next_id()
+
+
+# Версии для ETag лент; прежнее сообщество поста читаем до того, как
+# post_group_changed его перезапишет
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_versions(sender, instance, **kwargs):
+    versions.bump(
+        versions.FEEDS, versions.POST.format(instance.pk),
+        versions.AUTHOR.format(instance.author_id),
+        *{versions.GROUP.format(group_id) for group_id in (
+            instance.group_id, getattr(instance, '_loaded_group_id', None))
+          if group_id}, using=instance._state.db)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_versions(sender, instance, **kwargs):
+    # Счетчик комментариев виден в лентах автора и сообщества
+    post = Post.all_objects.using(instance._state.db).filter(
+        pk=instance.post_id).values('author_id', 'group_id').first() or {}
+    scopes = [versions.FEEDS, versions.POST.format(instance.post_id)]
+    if post:
+        scopes.append(versions.AUTHOR.format(post['author_id']))
+    if post.get('group_id'):
+        scopes.append(versions.GROUP.format(post['group_id']))
+    versions.bump(*scopes, using=instance._state.db)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_versions(sender, instance, **kwargs):
+    versions.bump(versions.AUTHOR.format(instance.author_id),
+                  versions.FOLLOWS.format(instance.user_id))
+
+
+@receiver(post_save, sender=Group)
+def group_versions(sender, instance, **kwargs):
+    versions.bump(versions.GROUP.format(instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # Запись лежит в той же базе, что и комментарий
+    Post.objects.using(instance._state.db).filter(pk=instance.post_id).update(
+        comment_count=F('comment_count') + 1)
+    defer(record_comment, instance.post_id, instance.post.group_id)
+    notifications.notify(instance.post.author_id, instance.author_id,
+                         Notification.COMMENT, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.deleted_at:
+        # Мягко удаленный комментарий уже вычтен из счетчика
+        return
+    Post.objects.using(instance._state.db).filter(
+        pk=instance.post_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created and instance.group_id:
+        trending.record(trending.GROUP, instance.group_id)
+
+
+@receiver(post_save, sender=Post)
+def post_group_changed(sender, instance, created, **kwargs):
+    loaded_group_id = getattr(instance, '_loaded_group_id', None)
+    if created or loaded_group_id != instance.group_id:
+        if not created:
+            services.group_post_removed(loaded_group_id, instance)
+        services.group_post_added(instance.group_id, instance)
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Post)
+def post_image_changed(sender, instance, created, **kwargs):
+    loaded_image = getattr(instance, '_loaded_image', None)
+    if not created and loaded_image and loaded_image != instance.image.name:
+        transaction.on_commit(partial(release_image, loaded_image))
+    if instance.image and instance.image.name != loaded_image:
+        # Одинаковые картинки хранятся одним файлом: миниатюры строим раз
+        tasks.warm_thumbnails.enqueue(
+            key=f'thumbnails:{instance.image.name}', name=instance.image.name)
+    instance._loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    if not instance.deleted_at:
+        services.group_post_removed(instance.group_id, instance)
+    if instance.image:
+        transaction.on_commit(partial(release_image, instance.image.name))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        trending.record(trending.AUTHOR, instance.author_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Follow)
+def log_saved(sender, instance, created, **kwargs):
+    changelog.record(
+        instance, ChangeEvent.CREATED if created else ChangeEvent.UPDATED)
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Follow)
+def log_deleted(sender, instance, **kwargs):
+    changelog.record(instance, changelog.deleted_action())
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager, suppress
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail import delete as delete_with_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from . import sharding
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файлы под именем sha256 содержимого.
+
+    Одинаковые картинки ложатся в один файл posts/ab/cd/<sha256>.<ext>,
+    поэтому и миниатюры sorl для них строятся один раз. Повторная
+    загрузка и release_image берут блокировку файла: загрузка обновляет
+    mtime, и release_image не удаляет файл моложе IMAGE_RELEASE_GRACE,
+    пока ссылающаяся запись еще не закоммичена.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save
+        return name
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        ).replace('\\', '/')
+
+    @contextmanager
+    def lock(self, name):
+        """Блокировка файла через O_EXCL: работает и на Windows.
+
+        Блокировка старше IMAGE_LOCK_TIMEOUT осталась от упавшего
+        процесса и снимается.
+        """
+        path = os.path.join(self.location, '.locks', os.path.basename(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                if age > settings.IMAGE_LOCK_TIMEOUT:
+                    with suppress(FileNotFoundError):
+                        os.remove(path)
+                else:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(path)
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        with self.lock(name):
+            if self.exists(name):
+                # Свежий mtime не дает release_image удалить файл до
+                # коммита новой записи
+                os.utime(self.path(name))
+                return name
+            return self._write(name, content)
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        # Пишем во временный файл и атомарно переименовываем: параллельная
+        # загрузка того же файла просто перезапишет идентичное содержимое
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            for chunk in content.chunks():
+                tmp.write(chunk)
+        os.chmod(tmp.name, self.file_permissions_mode or 0o644)
+        os.replace(tmp.name, full_path)
+        return name
+
+
+def release_image(name):
+    """Удаляет файл и миниатюры, если на него не ссылается ни одна запись.
+
+    Файл, который только что переиспользовала загрузка, остается:
+    ссылка на него появится после коммита, а если нет - его удалит
+    cleanup_media.
+    """
+    from .models import ArchivedPost, Post
+
+    if not name:
+        return False
+    # Ключи миниатюр sorl зависят от хранилища, поэтому берем его у поля
+    storage = Post._meta.get_field('image').storage
+    try:
+        path = storage.path(name)
+    except SuspiciousFileOperation:
+        # Имя вне MEDIA_ROOT: такой файл не наш
+        return False
+    with storage.lock(name):
+        # Дубликаты одной картинки могут лежать в разных шардах
+        if any(Post.all_objects.using(alias).filter(image=name).exists()
+               for alias in sharding.post_databases()):
+            return False
+        if ArchivedPost.objects.filter(image=name).exists():
+            return False
+        with suppress(FileNotFoundError):
+            if time.time() - os.path.getmtime(path) < \
+                    settings.IMAGE_RELEASE_GRACE:
+                return False
+        delete_with_thumbnails(ImageFile(name, storage))
+    return True
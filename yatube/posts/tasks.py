@@ -0,0 +1,261 @@
+"""Фоновые задачи в таблице базы, без внешнего брокера.
+
+Задача - зарегистрированная декоратором @task функция с JSON-аргументами.
+enqueue() вставляет строку Task в текущей транзакции, так что откат
+отменяет и задачу. manage.py run_tasks забирает готовые строки, выполняет
+их в пуле потоков или процессов и повторяет упавшие с экспоненциальной
+задержкой. Ключ идемпотентности не дает поставить ту же работу дважды;
+периодические задачи из TASKS_PERIODIC ставятся с ключом по номеру
+периода, поэтому несколько воркеров их не дублируют. С TASKS_EAGER
+задача выполняется сразу при постановке.
+
+Очередь write-behind (posts.writebehind) сюда не переезжает: это
+работа после коммита в памяти процесса - версии кэша, счетчики,
+уведомления, - и строка Task на каждое действие добавила бы к запросу
+ту самую запись в базу, которую write-behind убирает. Долгая работа,
+которая должна пережить процесс (модерация, миниатюры), идет через
+эту очередь.
+"""
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+from . import changelog, counters, moderation, trending
+from .models import Post, Task
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class TaskType:
+
+    def __init__(self, func, name, max_attempts, concurrency, timeout):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def enqueue(self, key=None, delay=0, **kwargs):
+        return enqueue(self.name, kwargs, key=key, delay=delay)
+
+
+def task(name, max_attempts=None, concurrency=None, timeout=None):
+    """Регистрирует функцию как задачу; concurrency - предел одновременно
+    выполняемых задач этого вида на все воркеры."""
+    def decorator(func):
+        task_type = TaskType(
+            func, name, max_attempts or settings.TASKS_MAX_ATTEMPTS,
+            concurrency, timeout or settings.TASKS_TIMEOUT)
+        registry[name] = task_type
+        return task_type
+    return decorator
+
+
+def enqueue(name, kwargs=None, key=None, delay=0):
+    """Ставит задачу; с тем же key возвращает уже поставленную."""
+    task_type = registry[name]
+    if key is not None:
+        existing = Task.objects.filter(key=key).first()
+        if existing is not None:
+            return existing
+    now = timezone.now()
+    fields = {
+        'name': name,
+        'kwargs': json.dumps(kwargs or {}, cls=DjangoJSONEncoder),
+        'key': key,
+        'run_at': now + timedelta(seconds=delay),
+    }
+    if settings.TASKS_EAGER:
+        fields.update(status=Task.RUNNING, attempts=1, locked_by='eager',
+                      locked_until=now + timedelta(seconds=task_type.timeout))
+    try:
+        with transaction.atomic():
+            new_task = Task.objects.create(**fields)
+    except IntegrityError:
+        # Тот же key успел поставить другой процесс
+        return Task.objects.get(key=key)
+    if settings.TASKS_EAGER:
+        execute(new_task.pk, 'eager')
+        new_task.refresh_from_db()
+    return new_task
+
+
+def backoff(attempt):
+    return min(settings.TASKS_RETRY_BACKOFF * 2 ** (attempt - 1),
+               settings.TASKS_RETRY_MAX_DELAY)
+
+
+def claim(worker, limit, now=None):
+    """Занимает до limit готовых задач; возвращает их id.
+
+    Строка занимается условным UPDATE по прежнему состоянию, поэтому
+    конкурирующие воркеры не получат одну задачу; предел concurrency
+    проверяется в том же UPDATE. Задачи упавшего воркера снова доступны
+    после истечения locked_until.
+    """
+    now = now or timezone.now()
+    candidates = Task.objects.filter(
+        Q(status=Task.PENDING, run_at__lte=now)
+        | Q(status=Task.RUNNING, locked_until__lt=now),
+        name__in=registry,
+    ).order_by('run_at', 'pk').values_list(
+        'pk', 'name', 'status', 'locked_until')[:limit * 10]
+    claimed = []
+    for pk, name, status, locked_until in candidates:
+        task_type = registry[name]
+        claimable = Task.objects.filter(
+            pk=pk, status=status, locked_until=locked_until)
+        if task_type.concurrency is not None:
+            busy = Task.objects.filter(
+                name=name, status=Task.RUNNING, locked_until__gte=now,
+            ).order_by().values('name').annotate(count=Count('pk')).filter(
+                count__gte=task_type.concurrency).values('name')
+            claimable = claimable.exclude(name__in=busy)
+        updated = claimable.update(
+            status=Task.RUNNING, attempts=F('attempts') + 1,
+            locked_by=worker, updated=now,
+            locked_until=now + timedelta(seconds=task_type.timeout))
+        if updated:
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def execute(task_id, worker):
+    """Выполняет задачу, занятую воркером worker.
+
+    Итог записывается, только пока задача занята этим же захватом: если
+    блокировка истекла и задачу забрал другой воркер, его результат
+    не затирается.
+    """
+    current = Task.objects.get(pk=task_id)
+    if current.status != Task.RUNNING or current.locked_by != worker:
+        return False
+    owned = Task.objects.filter(
+        pk=task_id, locked_by=worker, attempts=current.attempts)
+    task_type = registry[current.name]
+    try:
+        task_type(**json.loads(current.kwargs))
+    except Exception:
+        logger.exception('Задача %s завершилась ошибкой', current)
+        now = timezone.now()
+        if current.attempts >= task_type.max_attempts:
+            # Ключ освобождается: ту же работу можно поставить снова
+            changes = {'status': Task.FAILED, 'key': None}
+        else:
+            changes = {'status': Task.PENDING, 'run_at': now + timedelta(
+                seconds=backoff(current.attempts))}
+        owned.update(error=traceback.format_exc(), locked_until=None,
+                     updated=now, **changes)
+        return False
+    return bool(owned.update(
+        status=Task.DONE, locked_until=None, updated=timezone.now()))
+
+
+class Worker:
+    """Цикл manage.py run_tasks: ставит периодические задачи и раздает
+    готовые пулу, не занимая больше задач, чем свободных исполнителей."""
+
+    def __init__(self, workers, processes=False):
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.workers = workers
+        self.processes = processes
+        pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.pool = pool_class(max_workers=workers)
+        self.futures = set()
+        self.scheduled = {}
+
+    def schedule(self, now):
+        for name, (task_name, every) in settings.TASKS_PERIODIC.items():
+            period = int(now.timestamp() // every)
+            if self.scheduled.get(name) != period:
+                enqueue(task_name, key=f'periodic:{name}:{period}')
+                self.scheduled[name] = period
+
+    def tick(self, now=None):
+        now = now or timezone.now()
+        self.schedule(now)
+        self.futures = {future for future in self.futures
+                        if not future.done()}
+        free = self.workers - len(self.futures)
+        if free <= 0:
+            return 0
+        task_ids = claim(self.name, free, now)
+        if task_ids and self.processes:
+            # Дочерние процессы не должны наследовать открытые соединения
+            connections.close_all()
+        for task_id in task_ids:
+            self.futures.add(self.pool.submit(execute, task_id, self.name))
+        return len(task_ids)
+
+    def run(self, once=False):
+        try:
+            while True:
+                if self.tick():
+                    continue
+                if self.futures:
+                    wait(self.futures, timeout=settings.TASKS_POLL_INTERVAL,
+                         return_when=FIRST_COMPLETED)
+                elif once:
+                    return
+                else:
+                    time.sleep(settings.TASKS_POLL_INTERVAL)
+        finally:
+            self.pool.shutdown(wait=True)
+
+
+@task('posts.purge_tasks')
+def purge_tasks():
+    cutoff = timezone.now() - timedelta(days=settings.TASKS_RETENTION_DAYS)
+    Task.objects.filter(status__in=(Task.DONE, Task.FAILED),
+                        updated__lt=cutoff).delete()
+
+
+@task('posts.refresh_trending')
+def refresh_trending():
+    trending.refresh()
+
+
+@task('posts.purge_changelog')
+def purge_changelog():
+    changelog.purge()
+
+
+@task('posts.flush_view_counts', concurrency=1)
+def flush_view_counts():
+    counters.flush()
+
+
+@task('posts.run_moderation_job', concurrency=settings.MODERATION_WORKERS,
+      timeout=settings.MODERATION_TIMEOUT)
+def run_moderation_job(job_id):
+    # Ошибку run записывает в саму задачу модерации
+    moderation.run(job_id)
+
+
+@task('posts.warm_thumbnails', concurrency=settings.IMAGE_WORKERS)
+def warm_thumbnails(name):
+    """Строит миниатюры заранее, чтобы их не строил первый запрос ленты."""
+    storage = Post._meta.get_field('image').storage
+    for geometry, options in settings.POST_THUMBNAILS:
+        get_thumbnail(ImageFile(name, storage), geometry, **options)
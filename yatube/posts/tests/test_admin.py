@@ -0,0 +1,208 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import moderation, search
+from posts.admin import EstimatedCountPaginator
+from posts.models import Comment, Group, ModerationJob, Post, Task, User
+
+
+class PostAdminTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.group = Group.objects.create(title='Сообщество', slug='group')
+        cls.post = Post.objects.create(
+            text='Путешествие по Байкалу зимой', author=cls.admin,
+            group=cls.group)
+        Post.objects.create(text='Рецепт пирога', author=cls.admin)
+
+    def setUp(self):
+        self.client.force_login(PostAdminTests.admin)
+
+    def changelist_queries(self, model, **params):
+        url = reverse(f'admin:posts_{model}_changelist')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for model in ('post', 'comment'):
+            with self.subTest(model=model):
+                Comment.objects.create(post=PostAdminTests.post,
+                                       author=PostAdminTests.admin,
+                                       text='Комментарий')
+                # Первый запрос прогревает кэш пользователя и уведомлений
+                self.changelist_queries(model)
+                before, _ = self.changelist_queries(model)
+                for number in range(5):
+                    author = User.objects.create(
+                        username=f'{model}_author{number}')
+                    post = Post.objects.create(
+                        text='Еще запись', author=author,
+                        group=PostAdminTests.group)
+                    Comment.objects.create(
+                        post=post, author=author, text='Комментарий')
+                after, _ = self.changelist_queries(model)
+                self.assertEqual(after, before)
+
+    def test_full_text_search(self):
+        _, response = self.changelist_queries('post', q='байкал')
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [PostAdminTests.post])
+
+    def test_search_finds_every_match(self):
+        other = Post.objects.create(text='Снова байкал', author=self.admin)
+        found = search.search_posts(Post.objects.all(), 'байкал')
+        self.assertEqual(set(found), {PostAdminTests.post, other})
+
+    def test_search_syntax_is_escaped(self):
+        _, response = self.changelist_queries('post', q='"OR (')
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.get(pk=PostAdminTests.post.pk)
+        post.text = 'Путешествие по Алтаю'
+        post.save()
+        found = search.search_posts(Post.objects.all(), 'алтаю')
+        self.assertEqual(list(found), [post])
+        self.assertFalse(search.search_posts(Post.objects.all(), 'байкал'))
+        post.delete()
+        self.assertFalse(search.search_posts(Post.objects.all(), 'алтаю'))
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=0)
+    def test_unfiltered_count_estimated(self):
+        latest = Post.objects.create(text='Запись', author=self.admin)
+        Post.objects.filter(pk=PostAdminTests.post.pk).delete()
+        paginator = EstimatedCountPaginator(Post.objects.all(), 10)
+        self.assertEqual(paginator.count, latest.pk)
+        filtered = EstimatedCountPaginator(
+            Post.objects.filter(group=PostAdminTests.group), 10)
+        self.assertEqual(filtered.count, 0)
+
+
+@override_settings(MODERATION_BATCH_SIZE=2)
+class ModerationActionsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.spammer = User.objects.create(username='spammer')
+        cls.reader = User.objects.create(username='reader')
+        cls.old_group = Group.objects.create(title='Старое', slug='old')
+        cls.new_group = Group.objects.create(title='Новое', slug='new')
+        cls.spam = [
+            Post.objects.create(text=f'Спам {number}', author=cls.spammer,
+                                group=cls.old_group)
+            for number in range(5)
+        ]
+        cls.post = Post.objects.create(
+            text='Нормальная запись', author=cls.reader, group=cls.old_group)
+        cls.comments = [
+            Comment.objects.create(post=cls.post, author=cls.spammer,
+                                   text=f'Купите {number}')
+            for number in range(3)
+        ]
+        cls.comment = Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Спасибо')
+
+    def setUp(self):
+        self.client.force_login(ModerationActionsTests.admin)
+
+    def act(self, model, action, objects, **data):
+        self.client.post(reverse(f'admin:posts_{model}_changelist'), {
+            'action': action,
+            '_selected_action': [obj.pk for obj in objects],
+            **data,
+        })
+        job = ModerationJob.objects.get()
+        moderation.run(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_move_to_group(self):
+        spam = ModerationActionsTests.spam
+        new_group = ModerationActionsTests.new_group
+        job = self.act('post', 'move_to_group', spam, group=new_group.pk)
+        self.assertEqual(job.status, ModerationJob.DONE)
+        self.assertEqual((job.processed, job.total), (5, 5))
+        self.assertEqual(new_group.posts.count(), 5)
+        new_group.refresh_from_db()
+        self.assertEqual(new_group.posts_count, 5)
+        self.assertEqual(new_group.last_post, spam[-1])
+        old_group = ModerationActionsTests.old_group
+        old_group.refresh_from_db()
+        self.assertEqual(old_group.posts_count, 1)
+
+    def test_select_all_stores_changelist_filters(self):
+        self.client.post(reverse('admin:posts_post_changelist') + '?q=Спам', {
+            'action': 'delete_posts',
+            'select_across': '1',
+            '_selected_action': [ModerationActionsTests.spam[0].pk],
+        })
+        job = ModerationJob.objects.get()
+        self.assertEqual((job.lookup, job.search), ('{}', 'Спам'))
+        self.assertTrue(Task.objects.filter(
+            name='posts.run_moderation_job', key=f'moderation:{job.pk}',
+        ).exists())
+        # Запись, добавленная после постановки, тоже под условием
+        late = Post.objects.create(
+            text='Спам поздний', author=ModerationActionsTests.spammer)
+        moderation.run(job.pk)
+        self.assertEqual(list(Post.objects.all()),
+                         [ModerationActionsTests.post])
+        self.assertTrue(Post.all_objects.get(pk=late.pk).deleted_at)
+
+    def test_move_requires_group(self):
+        self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': 'move_to_group',
+            '_selected_action': [ModerationActionsTests.post.pk],
+        })
+        self.assertFalse(ModerationJob.objects.exists())
+
+    def test_delete_authors_posts(self):
+        job = self.act('post', 'delete_authors_posts',
+                       ModerationActionsTests.spam[:1])
+        self.assertEqual(job.processed, 5)
+        self.assertEqual(list(Post.objects.all()),
+                         [ModerationActionsTests.post])
+        old_group = ModerationActionsTests.old_group
+        old_group.refresh_from_db()
+        self.assertEqual(old_group.posts_count, 1)
+
+    def test_purge_authors_comments(self):
+        job = self.act('comment', 'purge_authors_comments',
+                       ModerationActionsTests.comments[:1])
+        self.assertEqual(job.status, ModerationJob.DONE)
+        self.assertEqual(list(Comment.objects.all()),
+                         [ModerationActionsTests.comment])
+        post = Post.objects.get(pk=ModerationActionsTests.post.pk)
+        self.assertEqual(post.comment_count, 1)
+
+    def test_merge_groups(self):
+        new_group = ModerationActionsTests.new_group
+        self.act('group', 'move_posts', [ModerationActionsTests.old_group],
+                 group=new_group.pk)
+        new_group.refresh_from_db()
+        self.assertEqual(new_group.posts_count, 6)
+
+    def test_progress_saved_per_batch(self):
+        job = moderation.queue(
+            ModerationJob.DELETE_POSTS,
+            {'author_id__in': [ModerationActionsTests.spammer.pk]})
+        self.assertTrue(moderation.run_batch(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (
+            ModerationJob.RUNNING, 2))
+        self.assertEqual(job.last_id, ModerationActionsTests.spam[1].pk)
+        self.assertEqual(Post.objects.count(), 4)
+        response = self.client.get(
+            reverse('admin:posts_moderationjob_changelist'))
+        self.assertContains(response, '2 из 5')
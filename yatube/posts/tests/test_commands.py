@@ -0,0 +1,466 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from scipy import sparse
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts import archive, moderation, recommendations, tasks, trending
+from posts.checkpoints import Checkpoint
+from posts.management.commands import cleanup_media
+from posts.models import (ArchivedPost, ChangeEvent, Comment, Follow,
+                          Group, ModerationJob, Post, Recommendation, Task,
+                          User)
+from posts.storage import release_image
+
+
+class BuildRecommendationsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.friend = User.objects.create(username='friend')
+        cls.friend_of_friend = User.objects.create(username='fof')
+        cls.group_author = User.objects.create(username='group_author')
+        cls.group = Group.objects.create(
+            title='тестовое сообщество',
+            slug='test_slug',
+            description='сообщество для тестов'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.friend)
+        Follow.objects.create(user=cls.friend, author=cls.friend_of_friend)
+        group_post = Post.objects.create(
+            text='Пост в сообществе', author=cls.group_author,
+            group=cls.group)
+        Comment.objects.create(
+            post=group_post, author=cls.reader, text='Интересно')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recommendations_built(self):
+        call_command('build_recommendations', block_size=2)
+        recommended = set(
+            Recommendation.objects.filter(
+                user=BuildRecommendationsTests.reader)
+            .values_list('author__username', flat=True))
+        self.assertEqual(recommended, {'fof', 'group_author'})
+        # Ни себя, ни уже отслеживаемых авторов не рекомендуем
+        self.assertFalse(Recommendation.objects.filter(
+            user=BuildRecommendationsTests.reader,
+            author__in=(BuildRecommendationsTests.reader,
+                        BuildRecommendationsTests.friend)).exists())
+
+    def test_keep_top_prunes_rows(self):
+        matrix = sparse.csr_matrix(np.array(
+            [[1, 5, 0, 3], [0, 0, 2, 0]], dtype=np.float32))
+        pruned = recommendations.keep_top(matrix, 1)
+        self.assertEqual(pruned.toarray().tolist(),
+                         [[0, 5, 0, 0], [0, 0, 2, 0]])
+
+    def test_rebuild_replaces_recommendations(self):
+        call_command('build_recommendations')
+        Follow.objects.create(
+            user=BuildRecommendationsTests.reader,
+            author=BuildRecommendationsTests.friend_of_friend)
+        call_command('build_recommendations', top=1)
+        self.assertEqual(
+            list(Recommendation.objects.filter(
+                user=BuildRecommendationsTests.reader)
+                .values_list('author__username', flat=True)),
+            ['group_author'])
+
+    def test_recommendations_on_follow_index(self):
+        call_command('build_recommendations')
+        Follow.objects.create(
+            user=BuildRecommendationsTests.reader,
+            author=BuildRecommendationsTests.group_author)
+        client = Client()
+        client.force_login(BuildRecommendationsTests.reader)
+        response = client.get(reverse('follow_index'))
+        self.assertEqual(
+            response.context['recommendations'],
+            [BuildRecommendationsTests.friend_of_friend])
+
+
+@override_settings(WRITE_BEHIND_EAGER=True)
+class RefreshTrendingTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(
+            title='тестовое сообщество',
+            slug='test_slug',
+            description='сообщество для тестов'
+        )
+        cls.quiet_post = Post.objects.create(
+            text='Тихий пост', author=cls.author)
+        cls.hot_post = Post.objects.create(
+            text='Горячий пост', author=cls.author, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_comments_rank_posts_and_groups(self):
+        for text in ('раз', 'два'):
+            Comment.objects.create(
+                post=RefreshTrendingTests.hot_post,
+                author=RefreshTrendingTests.reader, text=text)
+        Comment.objects.create(
+            post=RefreshTrendingTests.quiet_post,
+            author=RefreshTrendingTests.reader, text='три')
+        call_command('refresh_trending')
+
+        response = self.client.get(reverse('trending_index'))
+        self.assertEqual(
+            response.context['posts'],
+            [RefreshTrendingTests.hot_post, RefreshTrendingTests.quiet_post])
+        self.assertEqual(
+            response.context['groups'], [RefreshTrendingTests.group])
+
+    def test_old_buckets_decay(self):
+        now = time.time()
+        hour_ago = now - 60 * 60
+        trending.record(trending.POST, RefreshTrendingTests.quiet_post.pk,
+                        now=hour_ago)
+        trending.record(trending.POST, RefreshTrendingTests.quiet_post.pk,
+                        now=hour_ago)
+        trending.record(trending.POST, RefreshTrendingTests.hot_post.pk,
+                        now=now)
+        scores = trending.scores(trending.POST, now=now)
+        self.assertLess(scores[RefreshTrendingTests.quiet_post.pk], 2)
+        self.assertEqual(scores[RefreshTrendingTests.hot_post.pk], 1)
+
+    def test_cached_top_served_until_refresh(self):
+        self.assertEqual(trending.top(trending.POST), [])
+        Comment.objects.create(
+            post=RefreshTrendingTests.hot_post,
+            author=RefreshTrendingTests.reader, text='раз')
+        self.assertEqual(trending.top(trending.POST), [])
+        trending.refresh()
+        self.assertEqual(
+            trending.top(trending.POST), [RefreshTrendingTests.hot_post.pk])
+
+
+class CleanupMediaTests(TestCase):
+
+    REFERENCED = 'posts/aa/bb/' + 'a' * 64 + '.png'
+    ORPHAN = 'posts/cc/dd/' + 'c' * 64 + '.png'
+    THUMBNAIL = 'cache/11/22/' + '1' * 32 + '.jpg'
+    ORPHAN_THUMBNAIL = 'cache/ee/ff/' + 'e' * 32 + '.jpg'
+    # Миниатюра картинки удаленного поста: sorl ее знает
+    DELETED_SOURCE = 'posts/99/99/' + '9' * 64 + '.png'
+    STALE_THUMBNAIL = 'cache/33/44/' + '3' * 32 + '.jpg'
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.checkpoint = os.path.join(self.media, 'checkpoint.json')
+        settings = override_settings(
+            MEDIA_ROOT=self.media, MEDIA_CLEANUP_CHECKPOINT=self.checkpoint)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        for name in (self.REFERENCED, self.ORPHAN, self.THUMBNAIL,
+                     self.ORPHAN_THUMBNAIL, self.DELETED_SOURCE,
+                     self.STALE_THUMBNAIL):
+            path = os.path.join(self.media, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Image.new('RGB', (2, 2)).save(path, 'PNG')
+        author = User.objects.create(username='author')
+        Post.objects.create(text='С картинкой', author=author,
+                            image=self.REFERENCED)
+        source = ImageFile(self.REFERENCED)
+        default.kvstore.set(source)
+        default.kvstore.set(
+            ImageFile(self.THUMBNAIL, default.storage), source)
+        deleted = ImageFile(self.DELETED_SOURCE)
+        default.kvstore.set(deleted)
+        default.kvstore.set(
+            ImageFile(self.STALE_THUMBNAIL, default.storage), deleted)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media, name))
+
+    def test_orphans_deleted(self):
+        call_command('cleanup_media', min_age=0, stdout=StringIO())
+        self.assertTrue(self.exists(self.REFERENCED))
+        self.assertTrue(self.exists(self.THUMBNAIL))
+        self.assertFalse(self.exists(self.ORPHAN))
+        self.assertFalse(self.exists(self.ORPHAN_THUMBNAIL))
+        self.assertFalse(self.exists(self.STALE_THUMBNAIL))
+        self.assertIsNone(default.kvstore.get(ImageFile(self.DELETED_SOURCE)))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_dry_run(self):
+        call_command('cleanup_media', min_age=0, dry_run=True,
+                     stdout=StringIO())
+        self.assertTrue(self.exists(self.ORPHAN))
+        self.assertTrue(self.exists(self.STALE_THUMBNAIL))
+
+    def test_resume_from_checkpoint(self):
+        # Первыми в порядке обхода идут миниатюры cache/11/22, cache/33/44,
+        # известные sorl: их судьбу решит проход по источникам в конце
+        call_command('cleanup_media', min_age=0, limit=3, batch_size=1,
+                     stdout=StringIO())
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertFalse(self.exists(self.ORPHAN_THUMBNAIL))
+        self.assertTrue(self.exists(self.STALE_THUMBNAIL))
+        self.assertTrue(self.exists(self.ORPHAN))
+
+        call_command('cleanup_media', min_age=0, stdout=StringIO())
+        self.assertFalse(self.exists(self.ORPHAN))
+        self.assertFalse(self.exists(self.STALE_THUMBNAIL))
+        self.assertTrue(self.exists(self.REFERENCED))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_young_files_kept(self):
+        call_command('cleanup_media', stdout=StringIO())
+        self.assertTrue(self.exists(self.ORPHAN))
+
+    @mock.patch.object(cleanup_media, 'SCAN_WINDOW', 2)
+    def test_flat_directory_scanned_in_windows(self):
+        # Загрузки до хранилища по sha256 лежат в posts/ одним каталогом
+        legacy = [f'posts/legacy{number}.png' for number in range(5)]
+        for name in legacy:
+            Image.new('RGB', (2, 2)).save(
+                os.path.join(self.media, name), 'PNG')
+        Post.objects.create(text='Старая', author=User.objects.get(),
+                            image=legacy[3])
+        root = os.path.join(self.media, 'posts')
+        self.assertEqual(
+            [entry.name for entry in cleanup_media.listing(root, 'legacy1.png')
+             if entry.is_file()],
+            ['legacy1.png', 'legacy2.png', 'legacy3.png', 'legacy4.png'])
+
+        call_command('cleanup_media', min_age=0, limit=7, batch_size=1,
+                     stdout=StringIO())
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertFalse(self.exists(legacy[0]))
+        self.assertTrue(self.exists(legacy[4]))
+        call_command('cleanup_media', min_age=0, stdout=StringIO())
+        self.assertEqual([name for name in legacy if self.exists(name)],
+                         [legacy[3]])
+
+
+class SendDigestTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.silent = User.objects.create(username='silent')
+        cls.readers = [
+            User.objects.create(username=f'reader{number}',
+                                email=f'reader{number}@example.com')
+            for number in range(3)
+        ]
+        cls.lurker = User.objects.create(
+            username='lurker', email='lurker@example.com')
+        for reader in cls.readers:
+            Follow.objects.create(user=reader, author=cls.author)
+        Follow.objects.create(user=cls.lurker, author=cls.silent)
+        cls.post = Post.objects.create(
+            text='Свежая запись для дайджеста', author=cls.author)
+        old_post = Post.objects.create(
+            text='Запись двухнедельной давности', author=cls.author)
+        Post.objects.filter(pk=old_post.pk).update(
+            pub_date=old_post.pub_date - timedelta(weeks=2))
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.checkpoint = os.path.join(directory, 'digest.json')
+
+    def send(self, **options):
+        call_command('send_digest', workers=1, chunk_size=2,
+                     checkpoint=self.checkpoint, stdout=StringIO(),
+                     **options)
+
+    def test_followers_get_new_posts(self):
+        self.send()
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [reader.email for reader in SendDigestTests.readers])
+        body = mail.outbox[0].body
+        self.assertIn(SendDigestTests.post.text, body)
+        self.assertIn(reverse('post_view', args=(
+            'author', SendDigestTests.post.pk)), body)
+        self.assertNotIn('двухнедельной', body)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_weekly_period(self):
+        self.send(period='weekly')
+        self.assertEqual(mail.outbox[0].subject, 'Новые записи за неделю')
+
+    def test_resume_from_checkpoint(self):
+        first, second, third = SendDigestTests.readers
+        until = timezone.now()
+        Checkpoint(self.checkpoint).save({
+            'period': 'daily',
+            'since': (until - timedelta(days=1)).isoformat(),
+            'until': until.isoformat(),
+            'last': second.pk,
+        })
+        self.send()
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[third.email]])
+
+
+class RunModerationJobsTests(TestCase):
+
+    def setUp(self):
+        author = User.objects.create(username='spammer')
+        Post.objects.create(text='Спам', author=author)
+        self.job = moderation.queue(ModerationJob.DELETE_POSTS,
+                                    {'author_id__in': [author.pk]})
+
+    def test_queued_job_not_duplicated(self):
+        call_command('run_moderation_jobs', stdout=StringIO())
+        self.assertEqual(Task.objects.get().status, Task.PENDING)
+        self.assertTrue(Post.objects.exists())
+
+    @override_settings(TASKS_EAGER=True)
+    def test_interrupted_job_requeued(self):
+        # Воркер упал посреди задачи: задача очереди закрыта, а модерация
+        # осталась незавершенной
+        Task.objects.update(status=Task.DONE)
+        ModerationJob.objects.update(status=ModerationJob.RUNNING)
+        call_command('run_moderation_jobs', stdout=StringIO())
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ModerationJob.DONE)
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(Task.objects.filter(
+            key=f'moderation:{self.job.pk}').get().status, Task.DONE)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ArchivePostsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(title='Сообщество', slug='group')
+        cls.old_post = Post.objects.create(
+            text='Старая', author=cls.author, group=cls.group,
+            image='posts/aa/bb/' + 'a' * 64 + '.png')
+        Comment.objects.create(
+            post=cls.old_post, author=cls.author, text='Комментарий')
+        cls.post = Post.objects.create(
+            text='Новая', author=cls.author, group=cls.group)
+        cls.deleted = Post.objects.create(text='Удаленная', author=cls.author)
+        Post.all_objects.filter(pk=cls.old_post.pk).update(
+            pub_date=timezone.now() - timedelta(days=400))
+        Post.all_objects.filter(pk=cls.deleted.pk).update(
+            deleted_at=timezone.now() - timedelta(days=40))
+
+    def setUp(self):
+        self.image = os.path.join(
+            settings.MEDIA_ROOT, ArchivePostsTests.old_post.image.name)
+        os.makedirs(os.path.dirname(self.image), exist_ok=True)
+        Image.new('RGB', (2, 2)).save(self.image, 'PNG')
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT,
+                        ignore_errors=True)
+
+    def test_old_posts_archived_and_deleted_purged(self):
+        call_command('archive_posts', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(Post.all_objects.all()),
+                         [ArchivePostsTests.post])
+        archived = ArchivedPost.objects.get()
+        self.assertEqual(archived.pk, ArchivePostsTests.old_post.pk)
+        self.assertEqual(archived.comments.get().text, 'Комментарий')
+        # Картинку архивной записи не освобождает ни сигнал, ни очистка
+        self.assertFalse(release_image(archived.image.name))
+        call_command('cleanup_media', min_age=0, stdout=StringIO())
+        self.assertTrue(os.path.exists(self.image))
+        group = Group.objects.get(pk=ArchivePostsTests.group.pk)
+        self.assertEqual(group.posts_count, 1)
+        self.assertEqual(group.last_post, ArchivePostsTests.post)
+
+    def test_soft_deleted_rows_not_archived(self):
+        old = timezone.now() - timedelta(days=400)
+        hidden = Post.objects.create(text='Скрытая', author=self.author)
+        Post.all_objects.filter(pk=hidden.pk).update(
+            pub_date=old, deleted_at=timezone.now())
+        Comment.objects.create(post=ArchivePostsTests.old_post,
+                               author=self.author, text='Спам',
+                               deleted_at=timezone.now())
+        archive.archive_batch(timezone.now() - timedelta(days=365), 10)
+        archived = ArchivedPost.objects.get()
+        self.assertEqual(archived.pk, ArchivePostsTests.old_post.pk)
+        self.assertEqual(
+            list(archived.comments.values_list('text', flat=True)),
+            ['Комментарий'])
+        self.assertFalse(Comment.all_objects.filter(text='Спам').exists())
+        # Скрытая запись дождется очистки и удалится насовсем
+        self.assertTrue(Post.all_objects.filter(pk=hidden.pk).exists())
+        archive.purge_batch(timezone.now() + timedelta(days=1), 10)
+        self.assertFalse(Post.all_objects.filter(pk=hidden.pk).exists())
+
+    def test_archiving_is_not_logged_as_delete(self):
+        ChangeEvent.objects.all().delete()
+        archive.archive_batch(timezone.now() - timedelta(days=365), 10)
+        self.assertEqual(
+            set(ChangeEvent.objects.values_list('model', 'action')),
+            {('posts.post', ChangeEvent.ARCHIVED),
+             ('posts.comment', ChangeEvent.ARCHIVED)})
+
+
+class ConsumeChangesTests(TestCase):
+
+    def test_prints_new_events(self):
+        author = User.objects.create(username='author')
+        post = Post.objects.create(text='Новая запись', author=author)
+        output = StringIO()
+        call_command('consume_changes', 'export', stdout=output)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(
+            [(line['model'], line['object_id'], line['action'])
+             for line in lines],
+            [('posts.post', post.pk, 'created')])
+        self.assertEqual(lines[0]['data']['text'], 'Новая запись')
+
+        output = StringIO()
+        call_command('consume_changes', 'export', stdout=output)
+        self.assertEqual(output.getvalue(), '')
+        call_command('consume_changes', 'export', '--from', '0',
+                     stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 1)
+
+
+@override_settings(TASKS_PERIODIC={
+    'trending': ('posts.refresh_trending', 60)})
+class RunTasksTests(TransactionTestCase):
+
+    def test_runs_due_and_periodic_tasks(self):
+        tasks.enqueue('posts.purge_tasks')
+        later = tasks.enqueue('posts.purge_tasks', delay=60)
+        call_command('run_tasks', '--once', '--workers', '2',
+                     stdout=StringIO())
+        self.assertEqual(
+            sorted(Task.objects.exclude(pk=later.pk).values_list(
+                'name', 'status')),
+            [('posts.purge_tasks', Task.DONE),
+             ('posts.refresh_trending', Task.DONE)])
+        self.assertEqual(Task.objects.get(pk=later.pk).status, Task.PENDING)
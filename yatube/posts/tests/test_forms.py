@@ -1,12 +1,20 @@
+import os
+import re
 import shutil
 import tempfile
+import time
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
-from posts.models import Group, Post, User
+from posts.forms import PostForm
+from posts.models import Comment, Group, Post, User
+from posts.storage import release_image
 
 TEMP_MEDIA = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -30,7 +38,7 @@ class PostFormTests(TestCase):
             content=cls.small_gif,
             content_type='image/gif')
 
-        cls.test_image = f'posts/{cls.uploaded.name}'
+        cls.test_image = re.compile(r'posts/\w\w/\w\w/[0-9a-f]{64}\.gif')
 
         cls.author = User.objects.create_user(username='test_author')
         cls.group = Group.objects.create(
@@ -66,7 +74,7 @@ class PostFormTests(TestCase):
         self.assertEqual(Post.objects.count(), posts_count + 1)
         self.assertEqual(new_post.text, form_data['text'])
         self.assertEqual(new_post.group.id, form_data['group'])
-        self.assertEqual(new_post.image.name, PostFormTests.test_image)
+        self.assertRegex(new_post.image.name, PostFormTests.test_image)
 
     def test_post_create_unauthorized(self):
         posts_count_before = Post.objects.count()
@@ -208,6 +216,37 @@ class CommentFormTests(TestCase):
         self.assertEqual(comment.post, post)
         self.assertEqual(comment.author, post.author)
 
+    def test_comment_count(self):
+        post = Post.objects.create(
+            text='Пост для счетчика', author=CommentFormTests.author)
+        comments = [
+            Comment.objects.create(
+                post=post, author=CommentFormTests.author, text=text)
+            for text in ('раз', 'два')
+        ]
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 2)
+
+        comments[0].delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+    def test_comment_ajax_fragment(self):
+        author_client = Client()
+        author_client.force_login(CommentFormTests.author)
+        post = CommentFormTests.post
+        response = author_client.post(
+            reverse('add_comment', kwargs={'username': post.author.username,
+                                           'post_id': post.id}),
+            data={'text': 'Фрагмент'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 201)
+        self.assertTemplateUsed(response, 'includes/comment.html')
+        self.assertTemplateNotUsed(response, 'posts/post.html')
+        self.assertContains(response, 'Фрагмент', status_code=201)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
     def test_comment_unauthorized(self):
         post = CommentFormTests.post
         post_view_kwargs = {'username': post.author.username,
@@ -229,3 +268,136 @@ class CommentFormTests(TestCase):
                              reverse('login') + '?next=' + add_comment_url)
 
         self.assertEqual(post.comments.count(), comment_count)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA, IMAGE_MAX_SIZE=(200, 200))
+class ImageUploadTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @staticmethod
+    def photo(size=(600, 300)):
+        # Снимок «с телефона»: EXIF с поворотом на 90 градусов
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Phone'
+        buffer = BytesIO()
+        Image.new('RGB', size, color=(200, 10, 10)).save(
+            buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile(
+            'photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_image_normalized(self):
+        form = PostForm(data={'text': 'Фото'},
+                        files={'image': self.photo()})
+        self.assertTrue(form.is_valid(), form.errors)
+        with Image.open(form.cleaned_data['image']) as image:
+            self.assertEqual(image.size, (100, 200))
+            self.assertEqual(len(image.getexif()), 0)
+
+    @override_settings(IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_image_too_large(self):
+        form = PostForm(data={'text': 'Фото'},
+                        files={'image': self.photo()})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    @override_settings(IMAGE_MAX_PIXELS=100 * 100)
+    def test_image_with_too_many_pixels(self):
+        with mock.patch('posts.images.normalize_image') as normalize:
+            form = PostForm(data={'text': 'Фото'},
+                            files={'image': self.photo()})
+            self.assertFalse(form.is_valid())
+        self.assertIn('Мп', form.errors['image'][0])
+        normalize.assert_not_called()
+
+    @override_settings(IMAGE_PROCESS_TIMEOUT=0.01)
+    def test_slow_image_is_validation_error(self):
+        with mock.patch('posts.images.normalize_image',
+                        side_effect=lambda upload: time.sleep(0.2)):
+            form = PostForm(data={'text': 'Фото'},
+                            files={'image': self.photo()})
+            self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    def test_unsaveable_image_is_validation_error(self):
+        with mock.patch('posts.images.normalize_image',
+                        side_effect=KeyError('MPO')):
+            form = PostForm(data={'text': 'Фото'},
+                            files={'image': self.photo()})
+            self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA)
+class ContentAddressedStorageTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='test_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @staticmethod
+    def meme(name):
+        buffer = BytesIO()
+        Image.new('RGB', (30, 20), color=(10, 200, 10)).save(buffer, 'PNG')
+        return SimpleUploadedFile(
+            name, buffer.getvalue(), content_type='image/png')
+
+    @staticmethod
+    def age(path):
+        past = time.time() - settings.IMAGE_RELEASE_GRACE - 1
+        os.utime(path, (past, past))
+
+    def create_post(self, name):
+        form = PostForm(data={'text': 'Мем'}, files={'image': self.meme(name)})
+        self.assertTrue(form.is_valid(), form.errors)
+        post = form.save(commit=False)
+        post.author = ContentAddressedStorageTests.author
+        post.save()
+        return post
+
+    def test_duplicates_share_file(self):
+        first = self.create_post('meme.png')
+        second = self.create_post('meme_copy.PNG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.endswith('.png'))
+        self.assertTrue(os.path.exists(first.image.path))
+
+    def test_release_keeps_referenced_file(self):
+        first = self.create_post('meme.png')
+        second = self.create_post('meme_copy.png')
+        path = first.image.path
+
+        first.delete()
+        self.assertFalse(release_image(second.image.name))
+        self.assertTrue(os.path.exists(path))
+
+        second.delete()
+        self.age(path)
+        self.assertTrue(release_image(second.image.name))
+        self.assertFalse(os.path.exists(path))
+
+    def test_release_keeps_file_reused_by_upload(self):
+        post = self.create_post('meme.png')
+        path = post.image.path
+        post.delete()
+        self.age(path)
+        # Загрузка того же файла, запись которой еще не закоммичена
+        form = PostForm(data={'text': 'Мем'},
+                        files={'image': self.meme('again.png')})
+        self.assertTrue(form.is_valid(), form.errors)
+        storage = Post._meta.get_field('image').storage
+        self.assertEqual(
+            storage.save('posts/again.png', form.cleaned_data['image']),
+            post.image.name)
+        self.assertFalse(release_image(post.image.name))
+        self.assertTrue(os.path.exists(path))
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from posts import live
+from posts.models import Comment, Follow, Post, User
+
+
+async def request(path, headers=()):
+    inbox, sent = asyncio.Queue(), asyncio.Queue()
+    scope = {'type': 'http', 'path': path, 'headers': list(headers)}
+    task = asyncio.ensure_future(
+        live.application(scope, inbox.get, sent.put))
+    return task, inbox, sent
+
+
+async def events(sent, until):
+    """Собирает события потока, пока until(события) ложно."""
+    received = []
+    while not until(received):
+        message = await asyncio.wait_for(sent.get(), 5)
+        for block in message['body'].decode().split('\n\n'):
+            lines = block.splitlines()
+            if lines and lines[0].startswith('event: '):
+                received.append((lines[0][7:], '\n'.join(
+                    line[6:] for line in lines[1:])))
+    return received
+
+
+async def close(task, inbox):
+    inbox.put_nowait({'type': 'http.disconnect'})
+    await asyncio.wait_for(task, 5)
+
+
+def new_posts(received):
+    return sum(json.loads(data)['count']
+               for event, data in received if event == 'posts')
+
+
+@override_settings(LIVE_URL='/events/', LIVE_POLL_INTERVAL=0.01,
+                   LIVE_KEEPALIVE=0.05)
+class LiveEventsTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        self.other = User.objects.create(username='other')
+        self.post = Post.objects.create(text='Запись', author=self.author)
+
+    async def subscribe(self, path, headers=()):
+        task, inbox, sent = await request(path, headers)
+        start = await asyncio.wait_for(sent.get(), 5)
+        self.assertEqual(start['status'], 200)
+        await sent.get()
+        # Поток журнала запоминает последнее событие до новых записей
+        await asyncio.sleep(0.1)
+        return task, inbox, sent
+
+    def test_feed_counts_new_posts(self):
+        async def scenario():
+            task, inbox, sent = await self.subscribe('/events/feed/')
+            await live.call(lambda: [
+                Post.objects.create(text=f'Новая {number}',
+                                    author=self.author)
+                for number in range(2)])
+            received = await events(sent, lambda got: new_posts(got) >= 2)
+            await close(task, inbox)
+            return received
+
+        self.assertEqual(new_posts(asyncio.run(scenario())), 2)
+        self.assertEqual(live.hub.connections, 0)
+        self.assertFalse(live.hub.topics)
+
+    def test_post_streams_comment_fragments(self):
+        async def scenario():
+            task, inbox, sent = await self.subscribe(
+                f'/events/posts/{self.post.pk}/')
+            await live.call(lambda: Comment.objects.create(
+                post=self.post, author=self.other, text='Живой комментарий'))
+            received = await events(sent, bool)
+            await close(task, inbox)
+            return received
+
+        [(event, data)] = asyncio.run(scenario())
+        self.assertEqual(event, 'comment')
+        self.assertIn('Живой комментарий', data)
+        self.assertIn('comment_', data)
+
+    def test_follow_feed_needs_login_and_filters_authors(self):
+        self.client.force_login(self.other)
+        Follow.objects.create(user=self.other, author=self.author)
+        cookie = f'sessionid={self.client.cookies["sessionid"].value}'
+
+        async def scenario():
+            task, inbox, sent = await request('/events/follow/')
+            forbidden = await sent.get()
+            await task
+            task, inbox, sent = await self.subscribe(
+                '/events/follow/', [(b'cookie', cookie.encode())])
+
+            def publish():
+                Post.objects.create(text='Чужая', author=self.other)
+                Post.objects.create(text='Своя', author=self.author)
+            await live.call(publish)
+            received = await events(sent, new_posts)
+            await close(task, inbox)
+            return forbidden['status'], received
+
+        status, received = asyncio.run(scenario())
+        self.assertEqual(status, 403)
+        self.assertEqual(new_posts(received), 1)
+
+    def test_unknown_path_and_connection_limit(self):
+        async def status(path):
+            task, inbox, sent = await request(path)
+            start = await sent.get()
+            await task
+            return start['status']
+
+        self.assertEqual(asyncio.run(status('/events/unknown/')), 404)
+        with self.settings(LIVE_MAX_CONNECTIONS=0):
+            self.assertEqual(asyncio.run(status('/events/feed/')), 503)
+
+
+class HubTests(TestCase):
+
+    @override_settings(LIVE_QUEUE_SIZE=1)
+    def test_slow_listener_overflows(self):
+        hub = live.Hub()
+        listener = live.Listener({'post:1'})
+        for topic in listener.topics:
+            hub.topics[topic].add(listener)
+        hub.publish('post:1', 'первый')
+        hub.publish('post:1', 'второй')
+        hub.publish('post:2', 'чужой')
+        self.assertEqual(list(listener.fragments), ['первый'])
+        self.assertTrue(listener.overflow)
+        hub.unsubscribe(listener)
+        self.assertFalse(hub.topics)
+
+    def test_message_format(self):
+        self.assertEqual(live.message('comment', '<p>\nтекст</p>'),
+                         'event: comment\ndata: <p>\ndata: текст</p>\n\n'
+                         .encode())
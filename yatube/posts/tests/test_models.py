@@ -1,7 +1,14 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
 
-from posts.models import Group, Post
+from posts import changelog, services
+from posts.models import ChangeConsumer, ChangeEvent, Comment, Group, Post
 
 User = get_user_model()
 
@@ -26,3 +33,148 @@ class PostGroupTest(TestCase):
         for instance, expectation in instance_expectations:
             with self.subTest(instance):
                 self.assertEqual(expectation, str(instance))
+
+
+class GroupStatsTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+
+    def setUp(self):
+        self.group = Group.objects.create(
+            title='Первое сообщество', slug='first', description='')
+        self.other_group = Group.objects.create(
+            title='Второе сообщество', slug='second', description='')
+
+    def assertStats(self, group, count, last_post):
+        group.refresh_from_db()
+        self.assertEqual(group.posts_count, count)
+        self.assertEqual(group.last_post, last_post)
+        self.assertEqual(
+            group.last_post_date, last_post.pub_date if last_post else None)
+
+    def test_post_created(self):
+        first = Post.objects.create(
+            text='Первый', author=GroupStatsTest.author, group=self.group)
+        second = Post.objects.create(
+            text='Второй', author=GroupStatsTest.author, group=self.group)
+        self.assertStats(self.group, 2, second)
+        self.assertNotEqual(first, second)
+
+    def test_post_moved_to_other_group(self):
+        first = Post.objects.create(
+            text='Первый', author=GroupStatsTest.author, group=self.group)
+        second = Post.objects.create(
+            text='Второй', author=GroupStatsTest.author, group=self.group)
+        post = Post.objects.get(pk=second.pk)
+        post.group = self.other_group
+        post.save()
+        self.assertStats(self.group, 1, first)
+        self.assertStats(self.other_group, 1, second)
+
+        post.text = 'Без смены сообщества'
+        post.save()
+        self.assertStats(self.other_group, 1, second)
+
+    def test_post_deleted(self):
+        first = Post.objects.create(
+            text='Первый', author=GroupStatsTest.author, group=self.group)
+        second = Post.objects.create(
+            text='Второй', author=GroupStatsTest.author, group=self.group)
+        second.delete()
+        self.assertStats(self.group, 1, first)
+        first.delete()
+        self.assertStats(self.group, 0, None)
+
+
+class ChangeLogTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.reader = User.objects.create_user(username='TestReader')
+
+    def events(self):
+        return [(event.model, event.action, json.loads(event.payload))
+                for event in ChangeEvent.objects.all()]
+
+    def test_writes_are_logged(self):
+        post = Post.objects.create(text='Первый', author=ChangeLogTest.author)
+        post.text = 'Исправленный'
+        post.save()
+        comment = Comment.objects.create(
+            post=post, author=ChangeLogTest.reader, text='Комментарий')
+        comment.delete()
+        services.follow(ChangeLogTest.reader, [ChangeLogTest.author.pk])
+        events = self.events()
+        self.assertEqual(
+            [(model, action) for model, action, _ in events],
+            [('posts.post', ChangeEvent.CREATED),
+             ('posts.post', ChangeEvent.UPDATED),
+             ('posts.comment', ChangeEvent.CREATED),
+             ('posts.comment', ChangeEvent.DELETED),
+             ('posts.follow', ChangeEvent.CREATED)])
+        self.assertEqual(events[1][2]['text'], 'Исправленный')
+        self.assertEqual(events[4][2]['author_id'], ChangeLogTest.author.pk)
+
+    def test_bulk_operations_are_logged(self):
+        post = Post.objects.create(text='Первый', author=ChangeLogTest.author)
+        services.soft_delete_posts(Post.objects.filter(pk=post.pk))
+        event = ChangeEvent.objects.last()
+        self.assertEqual(event.action, ChangeEvent.DELETED)
+        self.assertIsNotNone(json.loads(event.payload)['deleted_at'])
+
+    def test_rolled_back_write_is_not_logged(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Post.objects.create(text='Откат', author=ChangeLogTest.author)
+            raise RuntimeError
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    def test_consume_keeps_offset(self):
+        for number in range(5):
+            Post.objects.create(text=f'Запись {number}',
+                                author=ChangeLogTest.author)
+        batches = []
+        self.assertEqual(changelog.consume(
+            'indexer', lambda events: batches.append(len(events)), 2), 5)
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(changelog.consume('indexer', batches.append), 0)
+
+        def fail(events):
+            raise RuntimeError
+        Post.objects.create(text='Новая', author=ChangeLogTest.author)
+        with self.assertRaises(RuntimeError):
+            changelog.consume('indexer', fail)
+        self.assertEqual(changelog.consume('indexer', batches.append), 1)
+
+        changelog.reset('indexer')
+        self.assertEqual(changelog.consume('indexer', batches.append), 6)
+
+    def test_read_waits_for_gap(self):
+        for number in range(3):
+            Post.objects.create(text=f'Запись {number}',
+                                author=ChangeLogTest.author)
+        first, second, third = ChangeEvent.objects.values_list(
+            'pk', flat=True)
+        # Событие second будто в еще не закоммиченной транзакции
+        ChangeEvent.objects.filter(pk=second).delete()
+        self.assertEqual(changelog.read(first, 10), [])
+        later = timezone.now() + timedelta(
+            seconds=settings.CHANGELOG_GAP_TIMEOUT + 1)
+        self.assertEqual(
+            [event.pk for event in changelog.read(first, 10, now=later)],
+            [third])
+
+    def test_purge_keeps_unread_events(self):
+        for number in range(3):
+            Post.objects.create(text=f'Запись {number}',
+                                author=ChangeLogTest.author)
+        first, second, _ = ChangeEvent.objects.values_list('pk', flat=True)
+        ChangeConsumer.objects.create(name='fast', position=second)
+        ChangeConsumer.objects.create(name='slow', position=first)
+        later = timezone.now() + timedelta(days=30)
+        self.assertEqual(changelog.purge(now=later), 1)
+        self.assertEqual(changelog.purge(), 0)
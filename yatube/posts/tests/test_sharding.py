@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts import counters, sharding
+from posts.models import Comment, Follow, Group, Post, User
+from posts.storage import release_image
+
+SHARDS = ['test_shard_0', 'test_shard_1']
+
+
+@override_settings(POST_SHARDS=SHARDS, WRITE_BEHIND_EAGER=True)
+class ShardingTests(TransactionTestCase):
+    """Шарды - отдельные файлы SQLite, подключаемые на время теста."""
+
+    def setUp(self):
+        cache.clear()
+        # Просмотры из буфера не должны уйти в базы после удаления шардов
+        self.addCleanup(counters.local.take)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        for alias in SHARDS:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': f'{directory}/{alias}.sqlite3',
+            }
+            self.addCleanup(self.drop_shard, alias)
+            call_command('migrate', database=alias, verbosity=0)
+            # Миграции SQLite снова включают проверку внешних ключей
+            connections[alias].close()
+        self.authors = [User.objects.create(username=f'author{number}')
+                        for number in range(2)]
+        self.assertNotEqual(*(sharding.shard_for(author.pk)
+                              for author in self.authors))
+        self.group = Group.objects.create(title='Сообщество', slug='group')
+        self.posts = [
+            Post.objects.create(
+                text=f'Запись {number}', author=self.authors[number % 2],
+                group=self.group if number % 3 == 0 else None)
+            for number in range(12)
+        ]
+
+    @staticmethod
+    def drop_shard(alias):
+        connections[alias].close()
+        del connections.databases[alias]
+        if hasattr(connections._connections, alias):
+            delattr(connections._connections, alias)
+
+    def shard_posts(self, alias):
+        return set(Post.objects.using(alias).values_list('text', flat=True))
+
+    def test_posts_stored_on_author_shard(self):
+        for author in self.authors:
+            alias = sharding.shard_for(author.pk)
+            self.assertEqual(
+                self.shard_posts(alias),
+                {post.text for post in self.posts if post.author == author})
+        self.assertFalse(Post.objects.using('default').exists())
+        ids = [post.pk for post in self.posts]
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_foreign_keys_checked_outside_shards(self):
+        def foreign_keys(alias):
+            with connections[alias].cursor() as cursor:
+                cursor.execute('PRAGMA foreign_keys')
+                return cursor.fetchone()[0]
+        self.assertEqual(foreign_keys('default'), 1)
+        self.assertEqual([foreign_keys(alias) for alias in SHARDS], [0, 0])
+
+    def test_shared_image_kept_while_any_shard_uses_it(self):
+        name = 'posts/aa/bb/' + 'a' * 64 + '.png'
+        first, second = self.posts[:2]
+        self.assertNotEqual(first._state.db, second._state.db)
+        for post in (first, second):
+            post.image = name
+            post.save()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as image:
+                image.write(b'png')
+            past = time.time() - settings.IMAGE_RELEASE_GRACE - 1
+            os.utime(path, (past, past))
+
+            # Правка записи освобождает прежнюю картинку после коммита
+            first.image = ''
+            first.save()
+            self.assertTrue(os.path.exists(path))
+            self.assertFalse(release_image(name))
+            call_command('cleanup_media', min_age=0, reset=True,
+                         checkpoint=os.path.join(media, 'checkpoint.json'),
+                         stdout=StringIO())
+            self.assertTrue(os.path.exists(path))
+
+            second.image = ''
+            second.save()
+            self.assertFalse(os.path.exists(path))
+
+    def test_index_merges_shards(self):
+        response = self.client.get(reverse('index'))
+        newest = list(reversed(self.posts))
+        self.assertEqual(list(response.context['page']), newest[:10])
+        self.assertEqual(response.context['next_cursor'], newest[9].pk)
+        response = self.client.get(
+            reverse('index'), {'after': response.context['next_cursor']})
+        self.assertEqual(list(response.context['page']), newest[10:])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_group_and_follow_feeds(self):
+        response = self.client.get(reverse('group_posts', args=('group',)))
+        self.assertEqual(
+            list(response.context['page']),
+            [post for post in reversed(self.posts) if post.group_id])
+
+        reader = User.objects.create(username='reader')
+        Follow.objects.create(user=reader, author=self.authors[1])
+        self.client.force_login(reader)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(
+            [post.author for post in response.context['page']],
+            [self.authors[1]] * 6)
+
+    def test_profile_and_post_view(self):
+        author = self.authors[0]
+        response = self.client.get(reverse('profile', args=(author,)))
+        self.assertEqual(response.context['page'].paginator.count, 6)
+
+        post = self.posts[2]
+        self.client.force_login(self.authors[1])
+        self.client.post(reverse('add_comment', args=(author, post.pk)),
+                         {'text': 'Комментарий через шарды'})
+        alias = sharding.shard_for(author.pk)
+        comment = Comment.objects.using(alias).get()
+        self.assertEqual(comment.post_id, post.pk)
+        response = self.client.get(
+            reverse('post_view', args=(author, post.pk)))
+        self.assertEqual(response.context['post'].comment_count, 1)
+        self.assertContains(response, 'Комментарий через шарды')
+        self.assertEqual(self.client.get(reverse(
+            'post_view', args=(self.authors[1], post.pk))).status_code, 404)
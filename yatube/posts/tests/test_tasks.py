@@ -0,0 +1,147 @@
+import threading
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from posts import tasks, writebehind
+from posts.models import Task
+
+calls = []
+
+
+@tasks.task('tests.record', max_attempts=2, concurrency=1)
+def record(value):
+    calls.append(value)
+
+
+@tasks.task('tests.fail', max_attempts=2)
+def fail():
+    raise RuntimeError('сбой')
+
+
+@tasks.task('tests.reclaimed')
+def reclaimed():
+    # Пока задача выполняется, ее блокировка истекает и задачу забирают
+    Task.objects.filter(name='tests.reclaimed').update(
+        locked_by='fresh', attempts=F('attempts') + 1)
+
+
+@override_settings(TASKS_RETRY_BACKOFF=10)
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_with_key_is_idempotent(self):
+        first = record.enqueue(key='once', value=1)
+        second = record.enqueue(key='once', value=2)
+        self.assertEqual(first, second)
+        self.assertEqual(Task.objects.get().kwargs, '{"value": 1}')
+
+    def test_rolled_back_enqueue(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            record.enqueue(value=1)
+            raise RuntimeError
+        self.assertFalse(Task.objects.exists())
+
+    def test_claim_respects_schedule_and_concurrency(self):
+        record.enqueue(value=1)
+        record.enqueue(value=2)
+        later = fail.enqueue(delay=60)
+        now = timezone.now()
+        first = tasks.claim('worker', 10, now)
+        self.assertEqual(len(first), 1)
+        # Второй record ждет: предел concurrency=1
+        self.assertEqual(tasks.claim('other', 10, now), [])
+        self.assertEqual(tasks.claim('other', 10, now + timedelta(
+            seconds=70)), [later.pk])
+
+        # Задача упавшего воркера достается другому после таймаута
+        expired = now + timedelta(seconds=tasks.registry[
+            'tests.record'].timeout + 1)
+        self.assertIn(first[0], tasks.claim('other', 1, expired))
+        self.assertEqual(Task.objects.get(pk=first[0]).attempts, 2)
+
+    def test_execute_retries_with_backoff(self):
+        failing = fail.enqueue()
+        tasks.claim('worker', 1)
+        self.assertFalse(tasks.execute(failing.pk, 'worker'))
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, Task.PENDING)
+        self.assertIn('сбой', failing.error)
+        self.assertGreater(failing.run_at,
+                           timezone.now() + timedelta(seconds=5))
+
+        tasks.claim('worker', 1, failing.run_at)
+        tasks.execute(failing.pk, 'worker')
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, Task.FAILED)
+        self.assertEqual(failing.attempts, 2)
+
+        done = record.enqueue(value='ok')
+        tasks.claim('worker', 1)
+        self.assertTrue(tasks.execute(done.pk, 'worker'))
+        self.assertEqual(calls, ['ok'])
+        self.assertEqual(Task.objects.get(pk=done.pk).status, Task.DONE)
+
+    def test_failed_task_releases_key(self):
+        failing = fail.enqueue(key='retry-me')
+        for attempt in range(2):
+            tasks.claim('worker', 1, timezone.now() + timedelta(hours=1))
+            tasks.execute(failing.pk, 'worker')
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, Task.FAILED)
+        self.assertIsNone(failing.key)
+        self.assertNotEqual(fail.enqueue(key='retry-me').pk, failing.pk)
+
+    def test_expired_owner_does_not_overwrite_result(self):
+        slow = reclaimed.enqueue()
+        tasks.claim('slow', 1)
+        self.assertFalse(tasks.execute(slow.pk, 'slow'))
+        slow.refresh_from_db()
+        self.assertEqual((slow.status, slow.locked_by),
+                         (Task.RUNNING, 'fresh'))
+        # Чужую задачу воркер не выполняет
+        self.assertFalse(tasks.execute(slow.pk, 'slow'))
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_mode(self):
+        done = record.enqueue(value=1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(done.status, Task.DONE)
+        self.assertEqual(fail.enqueue().status, Task.PENDING)
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(tasks.backoff(1), 10)
+        self.assertEqual(tasks.backoff(3), 40)
+        with self.settings(TASKS_RETRY_MAX_DELAY=30):
+            self.assertEqual(tasks.backoff(3), 30)
+
+
+@override_settings(WRITE_BEHIND_EAGER=False)
+class WriteBehindTests(TestCase):
+
+    def test_waiting_job_with_same_key_replaced(self):
+        queue = writebehind.WriteBehindQueue()
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+        queue.put(block)
+        started.wait(5)
+        done = []
+        queue.put(partial(done.append, 1), key='views')
+        queue.put(partial(done.append, 2))
+        queue.put(partial(done.append, 3), key='views')
+        release.set()
+        queue.join()
+        self.assertEqual(done, [3, 2])
+        # Выполненная задача больше не ждет: ключ свободен
+        queue.put(partial(done.append, 4), key='views')
+        queue.join()
+        self.assertEqual(done, [3, 2, 4])
@@ -38,7 +38,11 @@ class PostsURLTests(TestCase):
             '/',
             f'/group/{group.slug}/',
             f'/{author.username}/',
-            f'/{author.username}/{post.id}/'
+            f'/{author.username}/{post.id}/',
+            f'/{author.username}/followers/',
+            f'/{author.username}/following/',
+            '/trending/',
+            '/group/'
         )
         for value in responses:
             with self.subTest(response=value):
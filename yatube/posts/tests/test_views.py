@@ -1,15 +1,18 @@
 import shutil
 import tempfile
+from datetime import timedelta
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
+from posts import archive, counters, notifications, services
 from posts.forms import CommentForm, PostForm
-from posts.models import Follow, Group, Post, User
-from yatube.settings import POST_COUNT
+from posts.models import Comment, Follow, Group, Notification, Post, User
+from yatube.settings import FOLLOW_LIST_COUNT, POST_COUNT
 
 TEMP_MEDIA = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -196,6 +199,14 @@ class PostsViewsTests(TestCase):
                     kwargs={'slug': PostsViewsTests.group.slug}))
         self.assertIn(PostsViewsTests.post, response.context['page'])
 
+    def test_group_index_valid_context(self):
+        response = self.authorized_client.get(reverse('group_index'))
+        self.assertTemplateUsed(response, 'posts/group_index.html')
+        group = response.context['page'][0]
+        self.assertEqual(group, PostsViewsTests.group)
+        self.assertEqual(group.posts_count, 1)
+        self.assertEqual(group.last_post, PostsViewsTests.post)
+
     def test_wrong_group_post(self):
         # Пост не попадает в неподходящую группу
         wrong_group = Group.objects.create(
@@ -300,6 +311,7 @@ class FollowTestViews(TestCase):
         cls.author = User.objects.create(username='author')
 
     def setUp(self):
+        cache.clear()
         self.reader_client = Client()
         self.reader_client.force_login(FollowTestViews.reader_user)
 
@@ -340,6 +352,51 @@ class FollowTestViews(TestCase):
 
         self.assertEqual(Follow.objects.count(), followers_count - 1)
 
+    def test_follow_batch(self):
+        authors = [
+            User.objects.create(username=f'batch_author_{i}')
+            for i in range(3)
+        ]
+        Follow.objects.create(
+            user=FollowTestViews.reader_user, author=authors[0])
+        usernames = ' '.join(
+            [author.username for author in authors]
+            + [FollowTestViews.reader_user.username, 'no_such_user'])
+
+        response = self.reader_client.post(
+            reverse('follow_batch'),
+            data={'action': 'follow', 'usernames': usernames},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.json()['authors']),
+            {author.pk for author in authors})
+        self.assertEqual(
+            FollowTestViews.reader_user.follower.count(), len(authors))
+
+        response = self.reader_client.post(
+            reverse('follow_batch'),
+            data={'action': 'unfollow', 'usernames': usernames})
+        self.assertRedirects(response, reverse('follow_index'))
+        self.assertFalse(FollowTestViews.reader_user.follower.exists())
+
+    def test_follow_batch_invalidates_counts(self):
+        author = FollowTestViews.author
+        self.assertEqual(services.follow_counts(author)['followers'], 0)
+        self.reader_client.post(
+            reverse('follow_batch'),
+            data={'action': 'follow', 'usernames': author.username})
+        self.assertEqual(services.follow_counts(author)['followers'], 1)
+
+    def test_follow_batch_limit(self):
+        usernames = ','.join(
+            f'user_{i}' for i in range(settings.FOLLOW_BATCH_LIMIT + 1))
+        response = self.reader_client.post(
+            reverse('follow_batch'),
+            data={'action': 'follow', 'usernames': usernames})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('usernames', response.json()['errors'])
+
     def test_followers_index(self):
         authors_post = Post.objects.create(
             text='Запись для теста подписок',
@@ -367,3 +424,355 @@ class FollowTestViews(TestCase):
         response = not_reader_client.get(reverse('follow_index'))
         self.assertFalse(
             authors_post in response.context['page'])
+
+
+class FollowListViewsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.followers = [
+            User.objects.create(username=f'follower_{i}')
+            for i in range(FOLLOW_LIST_COUNT + 3)
+        ]
+        Follow.objects.bulk_create(
+            Follow(user=follower, author=cls.author)
+            for follower in cls.followers
+        )
+        Follow.objects.create(user=cls.reader, author=cls.followers[-1])
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(FollowListViewsTests.reader)
+
+    def test_followers_keyset_pages(self):
+        url = reverse('profile_followers',
+                      kwargs={'username': FollowListViewsTests.author})
+        response = self.reader_client.get(url)
+        people = response.context['people']
+        self.assertEqual(len(people), FOLLOW_LIST_COUNT)
+        # Новые подписчики идут первыми
+        self.assertEqual(people[0], FollowListViewsTests.followers[-1])
+
+        next_cursor = response.context['next_cursor']
+        self.assertIsNotNone(next_cursor)
+        response = self.reader_client.get(url + f'?after={next_cursor}')
+        self.assertEqual(len(response.context['people']), 3)
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_followers_is_followed_annotation(self):
+        response = self.reader_client.get(
+            reverse('profile_followers',
+                    kwargs={'username': FollowListViewsTests.author}))
+        followed = [
+            person for person in response.context['people']
+            if person.is_followed
+        ]
+        self.assertEqual(followed, [FollowListViewsTests.followers[-1]])
+
+    def test_following_list(self):
+        follower = FollowListViewsTests.followers[0]
+        response = self.client.get(
+            reverse('profile_following',
+                    kwargs={'username': follower.username}))
+        self.assertTemplateUsed(response, 'posts/follow_list.html')
+        self.assertEqual(
+            response.context['people'], [FollowListViewsTests.author])
+        self.assertFalse(response.context['people'][0].is_followed)
+
+
+@override_settings(WRITE_BEHIND_EAGER=True)
+class NotificationViewsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(NotificationViewsTests.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(NotificationViewsTests.reader)
+
+    def comment(self, client, text):
+        post = NotificationViewsTests.post
+        client.post(
+            reverse('add_comment', kwargs={'username': post.author.username,
+                                           'post_id': post.id}),
+            data={'text': text})
+
+    def test_comments_coalesced(self):
+        self.comment(self.reader_client, 'раз')
+        self.comment(self.reader_client, 'два')
+        self.comment(self.author_client, 'свой комментарий')
+        notification = Notification.objects.get()
+        self.assertEqual(notification.recipient, NotificationViewsTests.author)
+        self.assertEqual(notification.verb, Notification.COMMENT)
+        self.assertEqual(notification.count, 2)
+
+    def test_new_follower_notified_once(self):
+        author = NotificationViewsTests.author
+        for _ in range(2):
+            self.reader_client.get(
+                reverse('profile_follow', kwargs={'username': author}))
+        notification = Notification.objects.get(verb=Notification.FOLLOW)
+        self.assertEqual(notification.actor, NotificationViewsTests.reader)
+        self.assertEqual(notification.count, 1)
+
+    def test_inbox_marks_read(self):
+        self.comment(self.reader_client, 'раз')
+        response = self.author_client.get(reverse('index'))
+        self.assertEqual(response.context['unread_notifications'], 1)
+
+        response = self.author_client.get(reverse('notification_index'))
+        self.assertEqual(len(response.context['page']), 1)
+        response = self.author_client.get(reverse('index'))
+        self.assertEqual(response.context['unread_notifications'], 0)
+        self.assertFalse(Notification.objects.filter(is_read=False).exists())
+
+    def test_inbox_marks_only_shown_versions(self):
+        author = NotificationViewsTests.author
+        now = timezone.now()
+        for number in range(POST_COUNT + 1):
+            Notification.objects.create(
+                recipient=author, actor=NotificationViewsTests.reader,
+                verb=Notification.FOLLOW,
+                updated=now - timedelta(minutes=number))
+        response = self.author_client.get(reverse('notification_index'))
+        shown = list(response.context['page'])
+        self.assertEqual(len(shown), POST_COUNT)
+        # Самое старое - на второй странице
+        unread = Notification.objects.filter(is_read=False)
+        self.assertEqual(list(unread), [Notification.objects.last()])
+
+        # Уведомление дополнили уже после показа
+        Notification.objects.update(is_read=False)
+        Notification.objects.filter(pk=shown[0].pk).update(
+            count=2, updated=timezone.now())
+        notifications.mark_read(author, shown)
+        self.assertEqual(
+            set(unread.values_list('pk', flat=True)),
+            {shown[0].pk, Notification.objects.last().pk})
+
+    def test_unread_count_cached(self):
+        self.author_client.get(reverse('index'))
+        Comment.objects.bulk_create([Comment(
+            post=NotificationViewsTests.post,
+            author=NotificationViewsTests.reader, text='мимо сигналов')])
+        Notification.objects.create(
+            recipient=NotificationViewsTests.author,
+            actor=NotificationViewsTests.reader,
+            verb=Notification.COMMENT,
+            updated=NotificationViewsTests.post.pub_date)
+        response = self.author_client.get(reverse('index'))
+        self.assertEqual(response.context['unread_notifications'], 0)
+
+
+class SoftDeleteArchiveViewsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(title='Сообщество', slug='group')
+        cls.post = Post.objects.create(
+            text='Старая запись', author=cls.author, group=cls.group)
+        cls.comment = Comment.objects.create(
+            post=cls.post, author=cls.author, text='Старый комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(SoftDeleteArchiveViewsTests.author)
+        self.url = reverse('post_view', kwargs={
+            'username': 'author',
+            'post_id': SoftDeleteArchiveViewsTests.post.pk})
+
+    def test_soft_deleted_post_hidden(self):
+        services.soft_delete_posts(
+            Post.objects.filter(pk=SoftDeleteArchiveViewsTests.post.pk))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['page']), 0)
+        group = Group.objects.get(pk=SoftDeleteArchiveViewsTests.group.pk)
+        self.assertEqual((group.posts_count, group.last_post), (0, None))
+        self.assertTrue(Post.all_objects.exists())
+
+    def test_soft_deleted_comment_hidden(self):
+        post = SoftDeleteArchiveViewsTests.post
+        services.soft_delete_comments(Comment.objects.filter(post=post))
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['comments']), 0)
+        self.assertEqual(response.context['post'].comment_count, 0)
+
+    def test_archived_post_still_served(self):
+        archive.archive_batch(timezone.now(), 10)
+        self.assertFalse(Post.all_objects.exists())
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['archived'])
+        self.assertEqual(response.context['post'].text, 'Старая запись')
+        self.assertEqual([comment.text for comment
+                          in response.context['comments']],
+                         ['Старый комментарий'])
+        self.assertNotContains(response, 'Добавить комментарий:')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['page']), 0)
+
+
+@override_settings(WRITE_BEHIND_EAGER=True)
+class ViewCounterTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.posts = [Post.objects.create(text=f'Запись {number}',
+                                         author=cls.author)
+                     for number in range(2)]
+
+    def setUp(self):
+        cache.clear()
+        counters.local.take()
+
+    def view(self, post, times=1):
+        url = reverse('post_view', args=('author', post.pk))
+        for _ in range(times):
+            self.client.get(url)
+
+    def views(self):
+        return list(Post.objects.order_by('pk').values_list(
+            'views', flat=True))
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=60)
+    def test_local_buffer_flushes_in_one_update(self):
+        first, second = ViewCounterTests.posts
+        self.view(first, 3)
+        self.view(second)
+        self.assertEqual(self.views(), [0, 0])
+        with self.assertNumQueries(1):
+            counters.flush()
+        self.assertEqual(self.views(), [3, 1])
+        response = self.client.get(
+            reverse('post_view', args=('author', first.pk)))
+        self.assertContains(response, 'Просмотров: 3')
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=60,
+                       VIEW_COUNT_MAX_PENDING=2)
+    def test_local_buffer_flushes_when_full(self):
+        first, second = ViewCounterTests.posts
+        self.view(first, 2)
+        self.view(second)
+        self.assertEqual(self.views(), [2, 1])
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=60)
+    def test_local_buffer_written_on_shutdown(self):
+        first, second = ViewCounterTests.posts
+        self.view(first, 2)
+        counters.local.shutdown()
+        self.assertEqual(self.views(), [2, 0])
+
+    @override_settings(VIEW_COUNT_MODE='cache')
+    def test_shared_cache_mode(self):
+        first, second = ViewCounterTests.posts
+        self.view(first, 2)
+        self.view(second)
+        self.assertEqual(self.views(), [0, 0])
+        # Повторный просмотр только увеличивает счетчик записи
+        self.assertEqual(cache.get(counters.LAST_SLOT_KEY), 2)
+        self.assertEqual(counters.flush(), 2)
+        self.assertEqual(self.views(), [2, 1])
+        self.assertEqual(counters.flush(), 0)
+        self.view(first)
+        counters.flush()
+        self.assertEqual(self.views(), [3, 1])
+
+
+@override_settings(WRITE_BEHIND_EAGER=True, FEED_CONDITIONAL_GET=True)
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(title='Сообщество', slug='group')
+        cls.other_group = Group.objects.create(title='Другое', slug='other')
+        cls.post = Post.objects.create(
+            text='Запись', author=cls.author, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url):
+        """Код ответа на повторный запрос с ETag первого."""
+        etag = self.client.get(url)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def assertChangedBy(self, url, change, changed=True):
+        etag = self.client.get(url)['ETag']
+        change()
+        status = self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+        self.assertEqual(status, 200 if changed else 304)
+
+    def test_repeat_visit_gets_not_modified(self):
+        url = reverse('index')
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        for url in (reverse('group_posts', args=('group',)),
+                    reverse('profile', args=('author',)),
+                    reverse('post_view',
+                            args=('author', ConditionalGetTests.post.pk))):
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url), 304)
+        self.assertEqual(
+            self.client.get(reverse('group_posts', args=('missing',)),
+                            HTTP_IF_NONE_MATCH='"x"').status_code, 404)
+
+    @override_settings(FEED_CONDITIONAL_GET=None)
+    def test_process_local_cache_disables_conditional_get(self):
+        url = reverse('index')
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH='"x"').status_code, 200)
+
+    def test_changes_in_scope_refresh_page(self):
+        author = ConditionalGetTests.author
+        post = ConditionalGetTests.post
+        group_url = reverse('group_posts', args=('group',))
+        post_url = reverse('post_view', args=('author', post.pk))
+        self.assertChangedBy(reverse('index'), lambda: Post.objects.create(
+            text='Новая', author=ConditionalGetTests.reader))
+        self.assertChangedBy(group_url, lambda: Post.objects.create(
+            text='Чужое сообщество', author=author,
+            group=ConditionalGetTests.other_group), changed=False)
+        self.assertChangedBy(group_url, lambda: Post.objects.create(
+            text='Это сообщество', author=author,
+            group=ConditionalGetTests.group))
+        self.assertChangedBy(post_url, lambda: Comment.objects.create(
+            post=post, author=author, text='Комментарий'))
+        self.assertChangedBy(group_url, lambda: services.soft_delete_posts(
+            Post.objects.filter(text='Чужое сообщество')))
+
+    def test_page_depends_on_reader(self):
+        url = reverse('profile', args=('author',))
+        anonymous_etag = self.client.get(url)['ETag']
+        self.client.force_login(ConditionalGetTests.reader)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertChangedBy(url, lambda: services.follow(
+            ConditionalGetTests.reader, [ConditionalGetTests.author.pk]))
+        self.assertChangedBy(reverse('follow_index'), lambda: services.follow(
+            ConditionalGetTests.reader, [ConditionalGetTests.author.pk]),
+            changed=False)
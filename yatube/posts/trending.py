@@ -0,0 +1,104 @@
+"""Инкрементальный подсчет популярного.
+
+Каждое событие (комментарий, новый пост, подписка) увеличивает счетчик
+в кольце корзин по TRENDING_BUCKET секунд. Рейтинг собирается только
+из последних TRENDING_BUCKETS корзин с затуханием по возрасту и кладется
+в кэш готовым списком, так что страницы не выполняют GROUP BY.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+POST = 'post'
+GROUP = 'group'
+AUTHOR = 'author'
+
+COUNTER_KEY = 'trending:{kind}:{bucket}:{pk}'
+MEMBERS_KEY = 'trending:{kind}:{bucket}'
+TOP_KEY = 'trending:top:{kind}'
+
+
+def current_bucket(now=None):
+    return int((now or time.time()) // settings.TRENDING_BUCKET)
+
+
+def bucket_timeout():
+    return settings.TRENDING_BUCKET * (settings.TRENDING_BUCKETS + 1)
+
+
+def record(kind, pk, now=None):
+    record_many(kind, (pk,), now)
+
+
+def record_many(kind, pks, now=None):
+    bucket = current_bucket(now)
+    timeout = bucket_timeout()
+    for pk in pks:
+        key = COUNTER_KEY.format(kind=kind, bucket=bucket, pk=pk)
+        if not cache.add(key, 1, timeout):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout)
+    # Состав корзины обновляется без блокировки: в худшем случае
+    # конкурентная запись потеряет кандидата до следующего события
+    members_key = MEMBERS_KEY.format(kind=kind, bucket=bucket)
+    members = cache.get(members_key, set())
+    if not members.issuperset(pks):
+        cache.set(members_key, members.union(pks), timeout)
+
+
+def scores(kind, now=None):
+    newest = current_bucket(now)
+    totals = {}
+    for age in range(settings.TRENDING_BUCKETS):
+        bucket = newest - age
+        members = cache.get(MEMBERS_KEY.format(kind=kind, bucket=bucket))
+        if not members:
+            continue
+        counters = cache.get_many([
+            COUNTER_KEY.format(kind=kind, bucket=bucket, pk=pk)
+            for pk in members
+        ])
+        weight = settings.TRENDING_DECAY ** age
+        for pk in members:
+            count = counters.get(
+                COUNTER_KEY.format(kind=kind, bucket=bucket, pk=pk))
+            if count:
+                totals[pk] = totals.get(pk, 0) + count * weight
+    return totals
+
+
+def refresh(now=None):
+    from .models import Post
+
+    post_scores = scores(POST, now)
+    author_scores = scores(AUTHOR, now)
+    if author_scores and post_scores:
+        # Подписки на автора поднимают его обсуждаемые посты
+        authors = dict(Post.objects.filter(pk__in=post_scores)
+                       .values_list('pk', 'author_id'))
+        for pk, author_id in authors.items():
+            post_scores[pk] += (settings.TRENDING_FOLLOW_WEIGHT
+                                * author_scores.get(author_id, 0))
+    top = {
+        POST: ranked(post_scores),
+        GROUP: ranked(scores(GROUP, now)),
+    }
+    cache.set_many(
+        {TOP_KEY.format(kind=kind): ids for kind, ids in top.items()},
+        settings.TRENDING_TOP_TIMEOUT)
+    return top
+
+
+def ranked(totals):
+    return sorted(totals, key=lambda pk: (-totals[pk], -pk))[
+        :settings.TRENDING_COUNT]
+
+
+def top(kind):
+    ids = cache.get(TOP_KEY.format(kind=kind))
+    if ids is None:
+        ids = refresh()[kind]
+    return ids
@@ -3,14 +3,23 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+    path('group/', views.group_index, name='group_index'),
     path('group/<slug:slug>/', views.group_posts, name='group_posts'),
     path('', views.index, name='index'),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('follow/batch/', views.follow_batch, name='follow_batch'),
+    path('trending/', views.trending_index, name='trending_index'),
+    path('notifications/', views.notification_index,
+         name='notification_index'),
     path('<str:username>/follow/', views.profile_follow,
          name='profile_follow'),
     path('<str:username>/unfollow/', views.profile_unfollow,
          name='profile_unfollow'),
+    path('<str:username>/followers/', views.profile_followers,
+         name='profile_followers'),
+    path('<str:username>/following/', views.profile_following,
+         name='profile_following'),
     path('<str:username>/', views.profile, name='profile'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post_view'),
     path('<str:username>/<int:post_id>/edit/',
@@ -0,0 +1,114 @@
+"""Версии данных для условных GET-запросов лент.
+
+Каждая область (сообщество, автор, запись, подписки читателя, все ленты)
+хранит в кэше метку времени последнего изменения. Сигналы и массовые
+операции сдвигают метки в on_commit, прямо в запросе: новая метка не
+появится раньше самих данных, а редирект после POST уже увидит новую
+версию. ETag страницы собирается из меток ее областей и того, что
+зависит от читателя, и проверяется декоратором condition до запросов
+лент: повторный визит без изменений получает 304 без отрисовки.
+Вытесненная из кэша метка создается заново, тогда ответ просто будет
+200.
+
+Метки должны быть общими для всех воркеров: с кэшем процесса (locmem)
+воркер, не видевший записи, отвечал бы 304 без срока. Поэтому с таким
+кэшем условные GET выключены, если FEED_CONDITIONAL_GET не задан явно.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.http import condition
+
+from yatube import caches
+
+from .notifications import unread_count
+
+FEEDS = 'feeds'
+BULK = 'bulk'
+GROUP = 'group:{}'
+AUTHOR = 'author:{}'
+POST = 'post:{}'
+FOLLOWS = 'follows:{}'
+RECOMMENDATIONS = 'recommendations'
+
+VERSION_KEY = 'version:{}'
+
+
+def enabled():
+    if settings.FEED_CONDITIONAL_GET is not None:
+        return settings.FEED_CONDITIONAL_GET
+    return caches.is_shared()
+
+
+def bump_now(*scopes):
+    stamp = datetime.now(timezone.utc).timestamp()
+    cache.set_many(
+        {VERSION_KEY.format(scope): stamp for scope in scopes}, None)
+
+
+def bump(*scopes, using=None):
+    if settings.WRITE_BEHIND_EAGER:
+        # Как и defer: в тестах коммита может не быть
+        return bump_now(*scopes)
+    transaction.on_commit(partial(bump_now, *scopes), using=using)
+
+
+def stamps(scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    stamp = datetime.now(timezone.utc).timestamp()
+    for key in keys:
+        if key not in found:
+            # add, а не set: не затираем метку, сдвинутую параллельно
+            cache.add(key, stamp, None)
+            found[key] = cache.get(key, stamp)
+    return [found[key] for key in keys]
+
+
+def conditional(get_scopes):
+    """condition() с ETag и Last-Modified из меток областей get_scopes.
+
+    get_scopes(request, *args, **kwargs) возвращает список областей или
+    None, если проверять нечего (например, объекта нет и будет 404).
+    Без общего кэша (см. enabled) представление вызывается как есть.
+    """
+    def request_stamps(request, *args, **kwargs):
+        if not hasattr(request, '_version_stamps'):
+            scopes = get_scopes(request, *args, **kwargs)
+            request._version_stamps = (
+                None if scopes is None else stamps(scopes))
+        return request._version_stamps
+
+    def etag(request, *args, **kwargs):
+        found = request_stamps(request, *args, **kwargs)
+        if found is None:
+            return None
+        user = request.user
+        # Навигация и форма зависят от читателя, CSRF-токен - от cookie
+        parts = [settings.FEED_ETAG_VERSION, *found, user.pk,
+                 unread_count(user) if user.is_authenticated else None,
+                 request.COOKIES.get(settings.CSRF_COOKIE_NAME)]
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        found = request_stamps(request, *args, **kwargs)
+        if found is None or request.user.is_authenticated:
+            # Одной даты мало для страницы, зависящей от читателя
+            return None
+        return datetime.fromtimestamp(max(found), timezone.utc)
+
+    def decorator(view):
+        checked = condition(
+            etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not enabled():
+                return view(request, *args, **kwargs)
+            return checked(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,29 +1,105 @@
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
 
-from yatube.settings import POST_COUNT
+from yatube.ratelimit import ratelimit
+from yatube.settings import FOLLOW_LIST_COUNT, GROUP_COUNT, POST_COUNT
 
-from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from . import (counters, notifications, services, sharding, trending,
+               versions)
+from .forms import BatchFollowForm, CommentForm, PostForm
+from .models import ArchivedPost, Follow, Group, Post, User
 
 
-def paginated_page(request, post_list):
-    paginator = Paginator(post_list, POST_COUNT)
+def paginated_page(request, post_list, per_page=POST_COUNT):
+    paginator = Paginator(post_list, per_page)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
     return page
 
 
+def keyset_page(request, queryset, per_page):
+    # Курсор ?after=<id> вместо OFFSET: цена страницы не зависит от ее номера
+    after = request.GET.get('after', '')
+    if after.isdigit():
+        queryset = queryset.filter(id__lt=int(after))
+    rows = list(queryset.order_by('-id')[:per_page + 1])
+    next_cursor = rows[per_page - 1].id if len(rows) > per_page else None
+    return rows[:per_page], next_cursor
+
+
+def index_versions(request):
+    return [versions.FEEDS, versions.BULK]
+
+
+def group_versions(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is None:
+        return None
+    return [versions.GROUP.format(group_id), versions.BULK]
+
+
+def author_id(username):
+    return User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+
+
+def profile_versions(request, username):
+    pk = author_id(username)
+    if pk is None:
+        return None
+    # Кнопка подписки зависит от подписок читателя
+    return [versions.AUTHOR.format(pk), versions.BULK,
+            versions.RECOMMENDATIONS, versions.FOLLOWS.format(
+                request.user.pk)]
+
+
+def post_versions(request, username, post_id):
+    pk = author_id(username)
+    if pk is None:
+        return None
+    return [versions.POST.format(post_id), versions.AUTHOR.format(pk),
+            versions.BULK]
+
+
+def follow_versions(request):
+    return [versions.FEEDS, versions.BULK, versions.RECOMMENDATIONS,
+            versions.FOLLOWS.format(request.user.pk)]
+
+
+@versions.conditional(index_versions)
 def index(request):
+    if sharding.enabled():
+        posts, next_cursor = sharding.feed_page(request, POST_COUNT)
+        return render(request, 'posts/index.html',
+                      {'page': posts, 'next_cursor': next_cursor})
     post_list = Post.objects.select_related('author')
     page = paginated_page(request, post_list)
     return render(request, 'posts/index.html',
                   {'page': page})
 
 
+def group_index(request):
+    group_list = Group.objects.select_related('last_post__author').order_by(
+        F('last_post_date').desc(nulls_last=True), 'title')
+    page = paginated_page(request, group_list, GROUP_COUNT)
+    return render(request, 'posts/group_index.html', {'page': page})
+
+
+@versions.conditional(group_versions)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
+    if sharding.enabled():
+        posts, next_cursor = sharding.feed_page(
+            request, POST_COUNT, group_id=group.pk)
+        return render(request, 'posts/group.html',
+                      {'group': group, 'page': posts,
+                       'next_cursor': next_cursor})
     post_list = group.posts.all()
     page = paginated_page(request, post_list)
     return render(request, 'posts/group.html',
@@ -31,8 +107,21 @@ def group_posts(request, slug):
                    'page': page})
 
 
+def trending_index(request):
+    post_ids = trending.top(trending.POST)
+    group_ids = trending.top(trending.GROUP)
+    posts = Post.objects.select_related('author', 'group').in_bulk(post_ids)
+    groups = Group.objects.in_bulk(group_ids)
+    return render(request, 'posts/trending.html',
+                  {'posts': [posts[pk] for pk in post_ids if pk in posts],
+                   'groups': [groups[pk] for pk in group_ids
+                              if pk in groups]})
+
+
+@versions.conditional(profile_versions)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
+    # При шардировании роутер направит запрос в шард автора
     post_list = author.posts.all()
     page = paginated_page(request, post_list)
     following = request.user.is_authenticated and (
@@ -41,25 +130,47 @@ def profile(request, username):
     return render(request, 'posts/profile.html',
                   {'author': author,
                    'page': page,
-                   'following': following})
+                   'following': following,
+                   'follow_counts': services.follow_counts(author),
+                   'recommendations': services.recommended_authors(
+                       request.user, exclude=author)})
 
 
+@versions.conditional(post_versions)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = sharding.author_posts(
+        username, Post.objects.select_related('author', 'group')).filter(
+        id=post_id).first()
+    archived = post is None
+    if archived:
+        # Старые записи вынесены в архив, ссылки на них продолжают работать
+        post = get_object_or_404(
+            ArchivedPost.objects.select_related('author', 'group'),
+            author__username=username, id=post_id, deleted_at=None)
+    else:
+        counters.hit(post)
     form = CommentForm()
+    comments = sharding.related(
+        post.comments.filter(deleted_at=None), 'author')
     return render(request, 'posts/post.html',
                   {'post': post,
-                   'form': form}
+                   'archived': archived,
+                   'comments': comments,
+                   'form': form,
+                   'follow_counts': services.follow_counts(post.author)}
                   )
 
 
 @login_required
+@ratelimit('post')
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        # Журнал изменений пишется в той же транзакции
+        with transaction.atomic():
+            post.save()
         return redirect('index')
     return render(request, 'posts/new_post.html',
                   {'form': form})
@@ -67,7 +178,8 @@ def new_post(request):
 
 @login_required
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_object_or_404(
+        sharding.author_posts(username, Post.objects.all()), id=post_id)
     if request.user != post.author:
         return redirect('post_view', post_id=post_id,
                         username=post.author)
@@ -75,7 +187,8 @@ def post_edit(request, username, post_id):
     form = PostForm(
         request.POST or None, files=request.FILES or None, instance=post)
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            form.save()
         return redirect('post_view', post_id=post_id,
                         username=request.user.username)
     return render(request, 'posts/new_post.html',
@@ -83,43 +196,131 @@ def post_edit(request, username, post_id):
 
 
 @login_required
+@ratelimit('comment')
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
-    form = CommentForm(
-        request.POST)
+    post = get_object_or_404(sharding.author_posts(
+        username, Post.objects.only('id', 'group_id', 'author_id')),
+        id=post_id)
+    form = CommentForm(request.POST)
     if form.is_valid():
-        comment = form.save(commit=False)
-        comment.author = request.user
-        comment.post = post
-        comment.save()
-    return redirect('post_view', post_id=post_id,
-                    username=post.author.username)
+        comment = services.add_comment(post, request.user, form)
+        if request.is_ajax():
+            return render(request, 'includes/comment.html',
+                          {'item': comment}, status=201)
+    elif request.is_ajax():
+        return JsonResponse({'errors': form.errors}, status=400)
+    return redirect('post_view', post_id=post_id, username=username)
 
 
 @login_required
+def notification_index(request):
+    notification_list = request.user.notifications.select_related(
+        'actor', 'post__author')
+    page = paginated_page(request, notification_list)
+    response = render(request, 'posts/notifications.html', {'page': page})
+    notifications.mark_read(request.user, page)
+    return response
+
+
+@login_required
+@versions.conditional(follow_versions)
 def follow_index(request):
+    if sharding.enabled():
+        posts, next_cursor = sharding.feed_page(
+            request, POST_COUNT, author_ids=Follow.objects.filter(
+                user=request.user).values_list('author_id', flat=True))
+        return render(request, 'posts/follow.html',
+                      {'page': posts,
+                       'next_cursor': next_cursor,
+                       'recommendations': services.recommended_authors(
+                           request.user)})
     post_list = Post.objects.filter(
         author__following__user=request.user
     ).select_related('author')
     page = paginated_page(request, post_list)
-    return render(request, 'posts/follow.html', {'page': page})
+    return render(request, 'posts/follow.html',
+                  {'page': page,
+                   'recommendations': services.recommended_authors(
+                       request.user)})
 
 
 @login_required
+@ratelimit('follow', methods=('GET', 'POST'))
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+    services.follow(request.user, [author.pk])
     return redirect('profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=request.user, author=author).delete()
+    services.unfollow(request.user, [author.pk])
     return redirect('profile', username=username)
 
 
+def follow_cost(request):
+    # Каждый автор пакета - отдельная подписка в лимите follow
+    return len(BatchFollowForm.split(request.POST.get('usernames', '')))
+
+
+@login_required
+@require_POST
+@ratelimit('follow', cost=follow_cost)
+def follow_batch(request):
+    form = BatchFollowForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    authors = services.author_ids(form.cleaned_data['usernames'])
+    if form.cleaned_data['action'] == BatchFollowForm.FOLLOW:
+        authors = services.follow(request.user, authors)
+    else:
+        authors = services.unfollow(request.user, authors)
+    if request.is_ajax():
+        return JsonResponse({'action': form.cleaned_data['action'],
+                             'authors': authors})
+    return redirect('follow_index')
+
+
+def follow_list(request, username, lookup, person):
+    author = get_object_or_404(User, username=username)
+    follow_list = Follow.objects.filter(
+        **{lookup: author}).select_related(person)
+    if request.user.is_authenticated:
+        follow_list = follow_list.annotate(is_followed=Exists(
+            Follow.objects.filter(
+                user=request.user, author=OuterRef(person))))
+    rows, next_cursor = keyset_page(request, follow_list, FOLLOW_LIST_COUNT)
+    people = []
+    for row in rows:
+        user = getattr(row, person)
+        user.is_followed = getattr(row, 'is_followed', False)
+        people.append(user)
+    return author, people, next_cursor
+
+
+def profile_followers(request, username):
+    author, people, next_cursor = follow_list(
+        request, username, lookup='author', person='user')
+    return render(request, 'posts/follow_list.html',
+                  {'author': author,
+                   'people': people,
+                   'next_cursor': next_cursor,
+                   'followers': True,
+                   'follow_counts': services.follow_counts(author)})
+
+
+def profile_following(request, username):
+    author, people, next_cursor = follow_list(
+        request, username, lookup='user', person='author')
+    return render(request, 'posts/follow_list.html',
+                  {'author': author,
+                   'people': people,
+                   'next_cursor': next_cursor,
+                   'followers': False,
+                   'follow_counts': services.follow_counts(author)})
+
+
 def page_not_found(request, exception):
     return render(
         request,
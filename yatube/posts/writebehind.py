@@ -0,0 +1,91 @@
+"""Отложенная производная работа: инвалидация кэша, уведомления и т.п.
+
+Запрос кладет задачу в очередь после коммита и сразу отвечает, а
+фоновый поток разбирает очередь. Если очередь переполнена, задача
+выполняется прямо в запросе: так нагрузка не копится без предела.
+Задачи с одинаковым key схлопываются: пока задача ждет в очереди,
+новая с тем же key заменяет ее на прежнем месте, и работа выполняется
+один раз.
+"""
+import logging
+import queue
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+
+    def __init__(self):
+        self.queue = None
+        self.lock = threading.Lock()
+        # Ждущие в очереди задачи с ключом; в очереди лежит только ключ
+        self.keyed = {}
+
+    def start(self):
+        with self.lock:
+            if self.queue is None:
+                self.queue = queue.Queue(settings.WRITE_BEHIND_QUEUE_SIZE)
+                threading.Thread(target=self.work, name='write-behind',
+                                 daemon=True).start()
+
+    def put(self, job, key=None):
+        if settings.WRITE_BEHIND_EAGER:
+            return run(job)
+        self.start()
+        if key is not None:
+            with self.lock:
+                waiting = key in self.keyed
+                self.keyed[key] = job
+            if waiting:
+                return
+        try:
+            self.queue.put_nowait((key, job))
+        except queue.Full:
+            run(self.take(key, job))
+
+    def take(self, key, job):
+        if key is None:
+            return job
+        with self.lock:
+            return self.keyed.pop(key)
+
+    def work(self):
+        while True:
+            key, job = self.queue.get()
+            try:
+                run(self.take(key, job))
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        if self.queue is not None:
+            self.queue.join()
+
+
+def run(job):
+    try:
+        job()
+    except Exception:
+        logger.exception('Отложенная задача %r завершилась ошибкой', job)
+
+
+write_behind = WriteBehindQueue()
+
+
+def defer(func, *args, key=None, **kwargs):
+    """Выполняет func после коммита в очереди write-behind.
+
+    key подходит задачам, которые читают текущее состояние или которым
+    достаточно последних аргументов: ждущая задача с тем же key
+    заменяется новой.
+    """
+    job = partial(func, *args, **kwargs)
+    if settings.WRITE_BEHIND_EAGER:
+        # В тестах коммита может не быть, выполняем сразу
+        return run(job)
+    transaction.on_commit(partial(write_behind.put, job, key))
@@ -0,0 +1,114 @@
+"""Хэширование паролей: scrypt и ограничение одновременных хэшей.
+
+ScryptPasswordHasher повторяет формат хэшера из Django 4.0, так что
+после обновления Django сохраненные пароли останутся рабочими. Хэши
+других алгоритмов пересчитываются при первом удачном входе.
+
+Хэш никуда не выносится: вход и регистрация синхронные и ждут его в
+потоке запроса, а при занятых слотах ждут и слота. Вход быстрее
+исходного PBKDF2 только за счет более дешевых параметров scrypt;
+сравнение печатает benchmarks/password_hashing.py.
+"""
+import base64
+import hashlib
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         BasePasswordHasher, mask_hash)
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+_slots = None
+
+
+def slots():
+    global _slots
+    if _slots is None:
+        _slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS)
+    return _slots
+
+
+def limited(func, *args, **kwargs):
+    # Хэш считается в потоке запроса без тайм-аута: вход не падает с
+    # ошибкой. hashlib и argon2 отпускают GIL, а семафор ограничивает
+    # число одновременных хэшей: и ядра, и память scrypt не
+    # переподписываются
+    with slots():
+        return func(*args, **kwargs)
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    """scrypt из hashlib: память 128 * block_size * work_factor байт."""
+
+    algorithm = 'scrypt'
+    work_factor = 2 ** 14
+    block_size = 8
+    parallelism = 1
+    maxmem = 64 * 2 ** 20
+
+    def derive(self, password, salt, n, r, p):
+        return limited(
+            hashlib.scrypt, password.encode(), salt=salt.encode(),
+            n=n, r=r, p=p, maxmem=self.maxmem, dklen=64)
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash = base64.b64encode(
+            self.derive(password, salt, n, r, p)).decode('ascii').strip()
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash)
+
+    def decode(self, encoded):
+        algorithm, work_factor, salt, block_size, parallelism, hash = (
+            encoded.split('$', 5))
+        assert algorithm == self.algorithm
+        return {
+            'algorithm': algorithm,
+            'work_factor': int(work_factor),
+            'salt': salt,
+            'block_size': int(block_size),
+            'parallelism': int(parallelism),
+            'hash': hash,
+        }
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(
+            password, decoded['salt'], decoded['work_factor'],
+            decoded['block_size'], decoded['parallelism'])
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return {
+            _('algorithm'): decoded['algorithm'],
+            _('work factor'): decoded['work_factor'],
+            _('block size'): decoded['block_size'],
+            _('parallelism'): decoded['parallelism'],
+            _('salt'): mask_hash(decoded['salt']),
+            _('hash'): mask_hash(decoded['hash']),
+        }
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        return (decoded['work_factor'], decoded['block_size'],
+                decoded['parallelism']) != (
+            self.work_factor, self.block_size, self.parallelism)
+
+    def harden_runtime(self, password, encoded):
+        # Параметры устаревшего хэша пересчитываются при входе
+        pass
+
+
+class LimitedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 из argon2-cffi под тем же ограничением."""
+
+    def encode(self, password, salt):
+        return limited(super().encode, password, salt)
+
+    def verify(self, password, encoded):
+        return limited(super().verify, password, encoded)
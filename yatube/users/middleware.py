@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from yatube import caches
+
+USER_KEY = 'auth_user:{}'
+
+
+def get_user(request):
+    """Как auth.get_user, но сам пользователь берется из кэша.
+
+    С общим кэшем запрос к базе не нужен: сохранение пользователя
+    сбрасывает его запись через post_save. Кэш процесса не узнает о
+    смене пароля в другом воркере, поэтому с ним пароль и is_active на
+    каждый запрос сверяются с базой одним запросом по первичному ключу, а
+    устаревший объект перечитывается. QuerySet.update сигналов не шлет:
+    после него нужно вызвать invalidate_user.
+    """
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    key = USER_KEY.format(user_id)
+    user = cache.get(key)
+    if user is not None and not caches.is_shared():
+        current = auth.get_user_model()._default_manager.filter(
+            pk=user_id).values_list('password', 'is_active').first()
+        if current is None:
+            cache.delete(key)
+            return AnonymousUser()
+        if (user.password, user.is_active) != current:
+            user = None
+    if user is None:
+        user = auth.load_backend(backend_path).get_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+
+    session_hash = request.session.get(auth.HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(
+            session_hash, user.get_session_auth_hash())):
+        request.session.flush()
+        return AnonymousUser()
+    return user
+
+
+def invalidate_user(user_id):
+    cache.delete(USER_KEY.format(user_id))
+
+
+def cached_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_user(request)
+    return request._cached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """Подставляет request.user из кэша; с кэшем процесса сверяет с
+    базой пароль и is_active."""
+
+    def process_request(self, request):
+        assert hasattr(request, 'session'), (
+            'CachedAuthenticationMiddleware requires SessionMiddleware '
+            'to be installed before it.')
+        request.user = SimpleLazyObject(lambda: cached_user(request))
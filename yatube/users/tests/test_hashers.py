@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (check_password, identify_hasher,
+                                         make_password)
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users.hashers import ScryptPasswordHasher
+
+User = get_user_model()
+
+
+class LightScryptPasswordHasher(ScryptPasswordHasher):
+    work_factor = 2 ** 10
+
+
+class ScryptPasswordHasherTests(TestCase):
+
+    def test_new_passwords_use_scrypt(self):
+        encoded = make_password('лучший-пароль')
+        self.assertTrue(encoded.startswith('scrypt$16384$'))
+        self.assertTrue(check_password('лучший-пароль', encoded))
+        self.assertFalse(check_password('другой-пароль', encoded))
+
+    def test_compatible_with_django_4(self):
+        # Хэш ScryptPasswordHasher из Django 4.0 для тех же данных
+        encoded = ('scrypt$16384$seasalt$8$1$Qj3+9PPyRjSJIebHnG81TMjsqtaIGx'
+                   'NQG/aEB/NYafTJ7tibgfYz71m0ldQESkXFRkdVCBhhY8mx7rQwite/P'
+                   'w==')
+        self.assertEqual(make_password('lètmein', 'seasalt', 'scrypt'),
+                         encoded)
+        self.assertTrue(check_password('lètmein', encoded))
+
+    def test_changed_parameters_need_update(self):
+        encoded = make_password('лучший-пароль')
+        hasher = identify_hasher(encoded)
+        self.assertFalse(hasher.must_update(encoded))
+        self.assertTrue(LightScryptPasswordHasher().must_update(encoded))
+
+    def test_legacy_hash_upgraded_on_login(self):
+        user = User.objects.create(
+            username='reader',
+            password=make_password('лучший-пароль', hasher='pbkdf2_sha256'))
+        response = self.client.post(reverse('login'), {
+            'username': 'reader', 'password': 'лучший-пароль'})
+        self.assertEqual(response.status_code, 302)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, 'scrypt')
+
+    @override_settings(PASSWORD_HASHERS=[
+        'users.tests.test_hashers.LightScryptPasswordHasher',
+        'users.hashers.ScryptPasswordHasher',
+    ])
+    def test_work_factor_change_rehashes_on_login(self):
+        user = User.objects.create(
+            username='reader',
+            password=ScryptPasswordHasher().encode('лучший-пароль', 'salt1'))
+        self.assertTrue(self.client.login(
+            username='reader', password='лучший-пароль'))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$1024$'))
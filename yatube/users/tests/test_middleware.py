@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+User = get_user_model()
+
+
+class CachedAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='reader', password='old-password-123')
+        self.client = Client()
+        self.client.login(username='reader', password='old-password-123')
+
+    def queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            client.get(url)
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_shared_cache_adds_no_queries(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        with override_settings(
+                CACHES={'default': {
+                    'BACKEND':
+                        'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': location,
+                }},
+                SESSION_ENGINE='django.contrib.sessions.backends.cached_db'):
+            client = Client()
+            client.login(username='reader', password='old-password-123')
+            url = reverse('index')
+            client.get(url)
+            anonymous = self.queries(Client(), url)
+            logged_in = self.queries(client, url)
+            self.assertEqual(len(logged_in), len(anonymous))
+            for sql in logged_in:
+                self.assertNotIn('django_session', sql)
+                self.assertNotIn('auth_user', sql)
+
+            self.user.is_active = False
+            self.user.save()
+            response = client.get(url)
+            self.assertFalse(response.context['user'].is_authenticated)
+
+    def test_local_cache_checks_only_password_and_is_active(self):
+        url = reverse('index')
+        self.client.get(url)
+        logged_in = self.queries(self.client, url)
+        user_queries = [sql for sql in logged_in if 'auth_user' in sql]
+        self.assertEqual(len(user_queries), 1)
+        self.assertNotIn('username', user_queries[0])
+
+    def test_user_in_context(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_password_change_ends_other_sessions(self):
+        self.client.get(reverse('index'))
+        self.user.set_password('new-password-456')
+        self.user.save()
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.context['user'].is_authenticated)
+
+    def test_deactivated_user_logged_out(self):
+        self.client.get(reverse('index'))
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.context['user'].is_authenticated)
+
+    def test_changes_missed_by_cache_end_sessions(self):
+        # Другой процесс или QuerySet.update не чистят кэш процесса
+        self.client.get(reverse('index'))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.context['user'].is_authenticated)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.client.login(username='reader', password='old-password-123')
+        self.client.get(reverse('index'))
+        self.user.set_password('new-password-456')
+        User.objects.filter(pk=self.user.pk).update(
+            password=self.user.password)
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.context['user'].is_authenticated)
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        client = Client()
+        client.login(username='reader', password='old-password-123')
+        client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(reverse('index'))
+        self.assertEqual(response.context['user'], self.user)
+        for query in context.captured_queries:
+            self.assertNotIn('django_session', query['sql'])
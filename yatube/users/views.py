@@ -1,9 +1,13 @@
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.generic import CreateView
 
+from yatube.ratelimit import client_ip, ratelimit
+
 from .forms import CreationForm
 
 
+@method_decorator(ratelimit('signup', key=client_ip), name='dispatch')
 class SignUp(CreateView):
     form_class = CreationForm
     success_url = reverse_lazy("login")
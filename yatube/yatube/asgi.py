@@ -0,0 +1,13 @@
+"""ASGI-приложение живых обновлений (posts.live).
+
+Django 2.2 обслуживает страницы только через WSGI, поэтому этот процесс
+отдает лишь адреса LIVE_URL: uvicorn yatube.asgi:application
+"""
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+django.setup()
+
+from posts.live import application  # noqa: E402,F401
@@ -0,0 +1,18 @@
+"""Общий ли кэш для всех воркеров.
+
+Кэш процесса (locmem) не узнает об инвалидации в другом воркере, поэтому
+то, что на нее полагается, с таким кэшем выключается или проверяется
+по базе.
+"""
+from django.conf import settings
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared(backend=None):
+    if backend is None:
+        backend = settings.CACHES['default']['BACKEND']
+    return backend not in LOCAL_CACHES
@@ -0,0 +1,148 @@
+"""Сжатие ответов на лету: brotli, если он установлен и клиент его
+принимает, иначе gzip.
+
+Сжимаются только текстовые типы. Файлы с готовым Content-Encoding
+(заранее сжатая статика), картинки и ответы, которые отдает сам
+веб-сервер (X-Accel-Redirect, X-Sendfile), проходят как есть. Потоковые
+ответы сжимаются по кусочкам, каждый кусок сбрасывается клиенту сразу.
+С HTML_MINIFY из HTML убираются отступы и пустые строки шаблонов.
+"""
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .files import accepted_encodings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+# Внутри этих тегов пробелы значимы
+PRESERVED_RE = re.compile(r'(<(pre|textarea)\b.*?</\2>)',
+                          re.IGNORECASE | re.DOTALL)
+INDENT_RE = re.compile(r'\n\s+')
+
+
+def minify_html(html):
+    """Схлопывает отступы и пустые строки в один перевод строки.
+
+    Перевод строки остается пробельным символом, поэтому текст и
+    строчные элементы выглядят так же, а скрипты не теряют границы строк.
+    """
+    parts = PRESERVED_RE.split(html)
+    # split с двумя группами: текст, блок, имя тега, текст...
+    for index in range(0, len(parts), 3):
+        parts[index] = INDENT_RE.sub('\n', parts[index])
+    del parts[2::3]
+    return ''.join(parts)
+
+
+def choose_encoding(request):
+    accepted = accepted_encodings(request)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compressor(encoding):
+    """Объект с compress/flush для потокового сжатия."""
+    if encoding == 'br':
+        return BrotliStream(settings.BROTLI_QUALITY)
+    return GzipStream(settings.GZIP_LEVEL)
+
+
+class GzipStream:
+
+    def __init__(self, level):
+        # wbits 16 + 15: заголовок и контрольная сумма gzip
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return (self.compressor.compress(data)
+                + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def compressed_stream(chunks, encoding):
+    stream = compressor(encoding)
+    for chunk in chunks:
+        if chunk:
+            yield stream.compress(chunk)
+    yield stream.finish()
+
+
+def compressible(response):
+    if response.has_header('Content-Encoding'):
+        return False
+    if (response.has_header('X-Accel-Redirect')
+            or response.has_header('X-Sendfile')):
+        return False
+    content_type = response.get('Content-Type', '').lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """Замена GZipMiddleware с brotli, потоковыми ответами и
+    необязательной минификацией HTML."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not compressible(response):
+            return response
+        if (settings.HTML_MINIFY and not response.streaming
+                and response.get('Content-Type', '').startswith('text/html')):
+            response.content = minify_html(
+                response.content.decode(response.charset)).encode(
+                response.charset)
+            response['Content-Length'] = str(len(response.content))
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compressed_stream(
+                response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            stream = compressor(encoding)
+            content = stream.compress(response.content) + stream.finish()
+            # Сжатие, которое не выиграло, только тратит время клиента
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # Сжатые байты другие, поэтому ETag, как в GZipMiddleware, слабый
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
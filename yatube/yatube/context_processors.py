@@ -1,5 +1,7 @@
 import datetime as dt
 
+from django.conf import settings
+
 
 def year(request):
     current_year = dt.datetime.now().year
@@ -7,3 +9,20 @@ def year(request):
     return {
         'year': current_year
     }
+
+
+def unread_notifications(request):
+    from posts.notifications import unread_count
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'unread_notifications': unread_count(user)
+    }
+
+
+def live(request):
+    return {
+        'live_url': settings.LIVE_URL
+    }
@@ -0,0 +1,98 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# Хэш в имени: static от ManifestStaticFilesStorage, картинки постов
+# из ContentAddressedStorage и миниатюры sorl. Такие файлы не меняются.
+FINGERPRINT_RE = re.compile(r'(\.[0-9a-f]{12}|/[0-9a-f]{32,64})\.\w+$')
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def cache_control(path):
+    if FINGERPRINT_RE.search(path):
+        return 'public, max-age=31536000, immutable'
+    return f'public, max-age={settings.FILES_MAX_AGE}'
+
+
+def negotiate(request, fullpath):
+    """Выбирает заранее сжатый вариант файла, если клиент его примет."""
+    accepted = accepted_encodings(request)
+    chosen, has_variants = (fullpath, None), False
+    for coding, extension in ENCODINGS:
+        if os.path.isfile(fullpath + extension):
+            has_variants = True
+            if coding in accepted and chosen[1] is None:
+                chosen = (fullpath + extension, coding)
+    return chosen, has_variants
+
+
+def file_response(served_path, content_type, document_root, url_prefix):
+    if settings.SENDFILE_BACKEND and url_prefix:
+        # Байты отдает сам веб-сервер, Python только выставляет заголовки
+        response = HttpResponse(content_type=content_type)
+        if settings.SENDFILE_BACKEND == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = url_prefix + os.path.relpath(
+                served_path, document_root).replace(os.sep, '/')
+        else:
+            response['X-Sendfile'] = served_path
+        return response
+    # FileResponse отдает файл через wsgi.file_wrapper, то есть
+    # sendfile() у gunicorn и uWSGI
+    return FileResponse(open(served_path, 'rb'), content_type=content_type)
+
+
+def serve(request, path, document_root=None, url_prefix=None):
+    path = posixpath.normpath(path).lstrip('/')
+    fullpath = safe_join(document_root, path)
+    if not os.path.isfile(fullpath):
+        raise Http404(f'"{path}" не найден')
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    (served_path, content_encoding), has_variants = (
+        ((fullpath, encoding), False) if encoding
+        else negotiate(request, fullpath))
+
+    stat = os.stat(served_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        response = HttpResponseNotModified()
+    else:
+        response = file_response(
+            served_path, content_type, document_root, url_prefix)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control(path)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    if has_variants:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def files_urlpatterns(prefix, document_root, url_prefix=None):
+    return [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(prefix.lstrip('/')), serve,
+                {'document_root': document_root, 'url_prefix': url_prefix}),
+    ]
@@ -0,0 +1,149 @@
+"""Ограничение частоты запросов корзиной токенов.
+
+Корзина группы хранится в общем кэше как пара (токены, время) и
+пополняется лениво при проверке, так что проверка стоит одного get и
+одного set. Если кэш недоступен, корзины ведутся в памяти процесса.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.shortcuts import render
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = 'ratelimit:{group}:{key}'
+REJECTED_KEY = 'ratelimit:rejected:{}'
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60): не больше 10 запросов за минуту."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+class LocalBuckets:
+    """Запасное хранилище корзин с интерфейсом кэша и пределом размера."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.buckets.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.buckets[key] = value
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+
+
+local_buckets = LocalBuckets(settings.RATELIMIT_LOCAL_MAX_KEYS)
+
+
+def take(store, key, rate, now, cost=1):
+    """Забирает cost токенов; возвращает 0 или через сколько секунд
+    повторить.
+
+    Запрос дороже емкости корзины ждет полной корзины и уводит ее в
+    минус: следующие запросы ждут, пока долг не восполнится, так что
+    средняя частота не превышает rate.
+    """
+    capacity, period = parse_rate(rate)
+    refill = capacity / period
+    tokens, stamp = store.get(key) or (capacity, now)
+    tokens = min(capacity, tokens + (now - stamp) * refill)
+    need = min(cost, capacity)
+    if tokens < need:
+        return (need - tokens) / refill
+    tokens -= cost
+    # Без блокировки: конкурентные запросы могут проскочить на пару
+    # токенов больше, зато проверка не требует атомарных операций кэша
+    store.set(key, (tokens, now),
+              math.ceil(max(period, (capacity - tokens) / refill)))
+    return 0
+
+
+def consume(group, key, rate, now=None, cost=1):
+    now = time.time() if now is None else now
+    bucket_key = BUCKET_KEY.format(group=group, key=key)
+    try:
+        return take(caches[settings.RATELIMIT_CACHE], bucket_key, rate, now,
+                    cost)
+    except Exception:
+        logger.warning('Кэш ограничителя недоступен, корзина в процессе',
+                       exc_info=True)
+        return take(local_buckets, bucket_key, rate, now, cost)
+
+
+def record_rejected(group):
+    key = REJECTED_KEY.format(group)
+    try:
+        cache = caches[settings.RATELIMIT_CACHE]
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+    except Exception:
+        logger.warning('Не удалось учесть отказ %s', group, exc_info=True)
+
+
+def rejected(group):
+    """Сколько запросов группы отклонено с последней очистки кэша."""
+    return caches[settings.RATELIMIT_CACHE].get(REJECTED_KEY.format(group), 0)
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def user_or_ip(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def too_many_requests(request, retry_after):
+    if request.is_ajax():
+        response = JsonResponse(
+            {'error': 'Слишком много запросов, попробуйте позже'},
+            status=429)
+    else:
+        response = render(request, 'misc/429.html',
+                          {'retry_after': retry_after}, status=429)
+    response['Retry-After'] = retry_after
+    return response
+
+
+def ratelimit(group, key=user_or_ip, methods=('POST',), cost=None):
+    """Ограничивает view по корзине settings.RATELIMITS[group].
+
+    key строит ключ корзины из запроса: по умолчанию это пользователь,
+    а для анонимов IP-адрес. cost считает по запросу, сколько токенов он
+    стоит, например число объектов пакетной операции; по умолчанию один.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            rate = settings.RATELIMITS.get(group)
+            if (settings.RATELIMIT_ENABLE and rate
+                    and request.method in methods):
+                bucket = key(request)
+                wait = consume(group, bucket, rate,
+                               cost=max(1, cost(request)) if cost else 1)
+                if wait:
+                    record_rejected(group)
+                    logger.info('Отклонен запрос %s к %s', bucket, group)
+                    return too_many_requests(request, math.ceil(wait))
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
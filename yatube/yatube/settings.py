@@ -1,5 +1,7 @@
 import os
 
+from yatube.caches import is_shared
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 SECRET_KEY = 'b@j1thr03@^+@+jkgsk6!z$o@7ne$xq)cs_f6ck4%l7#f8r-ao'
@@ -28,10 +30,11 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'yatube.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -50,6 +53,8 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'yatube.context_processors.year',
+                'yatube.context_processors.unread_notifications',
+                'yatube.context_processors.live',
             ],
         },
     },
@@ -61,6 +66,16 @@ CACHES = {
     }
 }
 
+# Sessions: 'cached_db' reads through the cache and falls back to the
+# database, 'signed_cookies' keeps the session in the browser. A logout
+# clears the cached session only in the current process, so 'cached_db'
+# needs a cache shared by all workers; with locmem sessions stay in 'db'
+SESSION_MODE = 'cached_db' if is_shared(CACHES['default']['BACKEND']) else 'db'
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + SESSION_MODE
+# The logged-in user is cached too. With a process-local cache its password
+# and is_active are still checked against the database on every request
+USER_CACHE_TIMEOUT = 60 * 15
+
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
@@ -70,6 +85,11 @@ DATABASES = {
     }
 }
 
+# Optional sharding of posts and comments by author (posts.sharding): add
+# the shard databases above and list their aliases in POST_SHARDS
+POST_SHARDS = []
+DATABASE_ROUTERS = ['posts.sharding.PostShardRouter']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -85,6 +105,21 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing: the first hasher is used for new passwords, hashes made
+# by the others are upgraded on the next successful login. Argon2 needs
+# argon2-cffi; put it first when the package is installed
+PASSWORD_HASHERS = [
+    'users.hashers.ScryptPasswordHasher',
+    'users.hashers.LimitedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+# Hashes are not offloaded: login and signup compute them in the request
+# thread, which waits for one of these slots when all are busy. Logins are
+# faster than with Django's PBKDF2 only because the scrypt parameters are
+# cheaper; benchmarks/password_hashing.py prints the comparison
+PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+
 LANGUAGE_CODE = 'ru'
 
 TIME_ZONE = 'UTC'
@@ -98,11 +133,51 @@ USE_TZ = True
 # Static location
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+if not DEBUG:
+    # collectstatic writes hashed names and precompressed copies
+    STATICFILES_STORAGE = (
+        'yatube.storage.CompressedManifestStaticFilesStorage')
 
 # Uploaded Media
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Serving static and media from Django (yatube.files.serve). Independent of
+# DEBUG: with DEBUG off it serves the hashed and precompressed collectstatic
+# output; YATUBE_SERVE_FILES=0 when a web server serves the files instead
+SERVE_FILES = os.environ.get('YATUBE_SERVE_FILES', '1') == '1'
+FILES_MAX_AGE = 60 * 60
+# None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+SENDFILE_BACKEND = None
+SENDFILE_STATIC_PREFIX = '/protected/static/'
+SENDFILE_MEDIA_PREFIX = '/protected/media/'
+
+# Response compression (yatube.compression): brotli when it is installed
+# and accepted, gzip otherwise. Smaller bodies are sent as is
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSION_MIN_SIZE = 512
+# Collapse template indentation and blank lines in HTML responses
+HTML_MINIFY = True
+
+# Uploaded images are downscaled to this master size, metadata is dropped
+IMAGE_MAX_UPLOAD_SIZE = 20 * 2 ** 20
+IMAGE_MAX_SIZE = (1920, 1920)
+# Checked from the header before decoding, bounds the processing time
+IMAGE_MAX_PIXELS = 40 * 10 ** 6
+IMAGE_WORKERS = 2
+IMAGE_PROCESS_TIMEOUT = 30
+# A reused image younger than this is kept on release: the post that
+# references it may not have committed yet
+IMAGE_RELEASE_GRACE = 60 * 5
+IMAGE_LOCK_TIMEOUT = 10
+MEDIA_CLEANUP_CHECKPOINT = os.path.join(BASE_DIR, '.cleanup_media.json')
+# Thumbnails prebuilt by the posts.warm_thumbnails task, keep in sync with
+# includes/post_item.html
+POST_THUMBNAILS = [
+    ('960x339', {'crop': 'center', 'upscale': True}),
+]
+
 # Login
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'index'
@@ -111,5 +186,130 @@ LOGIN_REDIRECT_URL = 'index'
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Email digest (manage.py send_digest)
+DIGEST_SITE_URL = 'http://localhost:8000'
+DIGEST_POST_COUNT = 10
+DIGEST_CHUNK_SIZE = 500
+DIGEST_SEND_BATCH_SIZE = 100
+DIGEST_WORKERS = 4
+DIGEST_CHECKPOINT = os.path.join(BASE_DIR, '.send_digest.json')
+
+# Write-behind queue for derived work (cache invalidation, notifications)
+WRITE_BEHIND_EAGER = False
+WRITE_BEHIND_QUEUE_SIZE = 10000
+
+# Post view counters (posts.counters): 'local' buffers views per process
+# and writes them every VIEW_COUNT_FLUSH_INTERVAL seconds and on exit,
+# 'cache' adds them up in the shared cache for the posts.flush_view_counts
+# task
+VIEW_COUNT_MODE = 'local'
+VIEW_COUNT_FLUSH_INTERVAL = 10
+VIEW_COUNT_MAX_PENDING = 1000
+
+# Background tasks (posts.tasks, manage.py run_tasks); with TASKS_EAGER a
+# task runs right away when enqueued. Failed tasks are retried after
+# TASKS_RETRY_BACKOFF * 2 ** (attempt - 1) seconds
+TASKS_EAGER = False
+TASKS_WORKERS = 4
+TASKS_POLL_INTERVAL = 1
+TASKS_MAX_ATTEMPTS = 5
+TASKS_RETRY_BACKOFF = 10
+TASKS_RETRY_MAX_DELAY = 60 * 60
+# A running task is handed to another worker after this many seconds
+TASKS_TIMEOUT = 60 * 5
+TASKS_RETENTION_DAYS = 7
+# name: (task, period in seconds)
+TASKS_PERIODIC = {
+    'refresh-trending': ('posts.refresh_trending', 60),
+    'purge-changelog': ('posts.purge_changelog', 60 * 60),
+    'purge-tasks': ('posts.purge_tasks', 60 * 60),
+}
+# Local view counters are flushed by the web processes themselves
+if VIEW_COUNT_MODE == 'cache':
+    TASKS_PERIODIC['flush-view-counts'] = (
+        'posts.flush_view_counts', VIEW_COUNT_FLUSH_INTERVAL)
+
+# Soft deletion and archive (manage.py archive_posts)
+POST_ARCHIVE_DAYS = 365
+SOFT_DELETE_RETENTION_DAYS = 30
+ARCHIVE_BATCH_SIZE = 1000
+
+# Admin bulk moderation jobs (posts.moderation), run by manage.py run_tasks
+MODERATION_BATCH_SIZE = 500
+MODERATION_WORKERS = 1
+MODERATION_TIMEOUT = 60 * 60
+
+# Rate limits: token buckets per view group as 'count/period', the period
+# is s, m, h or d. Buckets live in RATELIMIT_CACHE, in-process if it fails
+RATELIMIT_ENABLE = True
+RATELIMIT_CACHE = 'default'
+RATELIMIT_LOCAL_MAX_KEYS = 10000
+RATELIMITS = {
+    'post': '30/h',
+    'comment': '30/m',
+    'follow': '60/m',
+    'signup': '20/h',
+}
+
+# Notifications
+NOTIFICATIONS_UNREAD_TIMEOUT = 60 * 60
+
+# Live feed updates over Server-Sent Events (posts.live). They are served by
+# the separate ASGI app yatube.asgi:application, the proxy routes LIVE_URL
+# to it. None turns the feature off in templates
+LIVE_URL = None
+LIVE_POLL_INTERVAL = 1
+LIVE_KEEPALIVE = 15
+# Milliseconds before EventSource reconnects
+LIVE_RETRY = 5000
+LIVE_MAX_CONNECTIONS = 5000
+# Comment fragments waiting for a slow listener before it is dropped
+LIVE_QUEUE_SIZE = 20
+LIVE_BATCH_SIZE = 500
+LIVE_DB_WORKERS = 2
+
+# Change log for downstream consumers (manage.py consume_changes); events
+# read by every consumer are purged after CHANGELOG_RETENTION_DAYS
+CHANGELOG_BATCH_SIZE = 500
+CHANGELOG_POLL_INTERVAL = 1
+CHANGELOG_RETENTION_DAYS = 7
+# Readers wait this long for a gap in event ids to be filled by a
+# transaction that has not committed yet
+CHANGELOG_GAP_TIMEOUT = 60
+
+# Feed pages answer 304 Not Modified by ETags built from data versions
+# (posts.versions); bump after changing feed templates
+FEED_ETAG_VERSION = 1
+# The versions must live in a cache shared by all workers. None turns
+# conditional GET on for shared backends and off for locmem/dummy caches
+FEED_CONDITIONAL_GET = None
+
 # Paginator
 POST_COUNT = 10
+# Admin changelists of bigger unfiltered tables show an estimated count
+ADMIN_EXACT_COUNT_LIMIT = 100000
+FOLLOW_LIST_COUNT = 20
+GROUP_COUNT = 20
+
+# Follow
+FOLLOW_BATCH_LIMIT = 100
+FOLLOW_COUNTS_TIMEOUT = 60 * 15
+
+# Recommendations
+RECOMMENDATION_COUNT = 10
+RECOMMENDATION_SHOW_COUNT = 5
+RECOMMENDATION_BLOCK_SIZE = 5000
+RECOMMENDATION_CANDIDATES = 100
+RECOMMENDATION_WEIGHTS = {
+    'friends': 1.0,
+    'groups': 2.0,
+    'comments': 3.0,
+}
+
+# Trending
+TRENDING_BUCKET = 60 * 5
+TRENDING_BUCKETS = 12 * 6
+TRENDING_DECAY = 0.97
+TRENDING_FOLLOW_WEIGHT = 0.5
+TRENDING_COUNT = 10
+TRENDING_TOP_TIMEOUT = 60
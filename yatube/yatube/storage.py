@@ -0,0 +1,43 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.html', '.json',
+                           '.map', '.xml', '.ico')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Хэшированные имена плюс заранее сжатые .gz и .br рядом с файлами.
+
+    Сжатие выполняется один раз в collectstatic, а не на каждый запрос.
+    """
+
+    def post_process(self, *args, **kwargs):
+        for name, hashed_name, processed in super().post_process(
+                *args, **kwargs):
+            if not isinstance(processed, Exception) and hashed_name:
+                self.compress(hashed_name)
+            yield name, hashed_name, processed
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        path = self.path(name)
+        with open(path, 'rb') as source:
+            content = source.read()
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for extension, compressed in variants:
+            # Сжатый вариант, который не меньше оригинала, только мешает
+            if len(compressed) < len(content):
+                with open(path + extension, 'wb') as target:
+                    target.write(compressed)
+            elif os.path.exists(path + extension):
+                os.remove(path + extension)
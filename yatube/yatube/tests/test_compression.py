@@ -0,0 +1,88 @@
+import gzip
+from unittest import skipIf
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import reverse
+
+from yatube.compression import CompressionMiddleware, brotli, minify_html
+
+HTML = ('<div>\n    <p>Текст</p>\n\n'
+        '    <pre>  код\n    с отступом</pre>\n</div>')
+TEXT = 'строка текста для сжатия\n' * 100
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200, HTML_MINIFY=False)
+class CompressionMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def process(self, response, encoding='gzip'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_gzip(self):
+        response = HttpResponse(TEXT, content_type='text/plain')
+        response['ETag'] = '"version"'
+        response = self.process(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"version"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content).decode(), TEXT)
+        self.assertEqual(int(response['Content-Length']),
+                         len(response.content))
+
+    @skipIf(brotli is None, 'brotli не установлен')
+    def test_brotli_preferred(self):
+        response = self.process(HttpResponse(TEXT), 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content).decode(), TEXT)
+
+    def test_streaming(self):
+        chunks = [line.encode() for line in TEXT.splitlines(True)]
+        response = self.process(StreamingHttpResponse(
+            iter(chunks), content_type='text/plain'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)).decode(),
+            TEXT)
+
+    def test_skipped_responses(self):
+        encoded = HttpResponse(TEXT)
+        encoded['Content-Encoding'] = 'gzip'
+        sendfile = HttpResponse(content_type='text/css')
+        sendfile['X-Accel-Redirect'] = '/protected/static/site.css'
+        for name, response in (
+                ('короткий', HttpResponse('коротко')),
+                ('картинка', HttpResponse(b'\x89PNG' * 200,
+                                          content_type='image/png')),
+                ('уже сжат', encoded),
+                ('отдает сервер', sendfile)):
+            with self.subTest(name):
+                body = response.content
+                response = self.process(response)
+                self.assertEqual(response.content, body)
+                self.assertNotEqual(response.get('Content-Encoding'), 'br')
+        response = self.process(HttpResponse(TEXT), 'identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(HTML_MINIFY=True)
+    def test_html_minified(self):
+        response = self.process(HttpResponse(HTML), 'identity')
+        self.assertEqual(
+            response.content.decode(),
+            '<div>\n<p>Текст</p>\n<pre>  код\n    с отступом</pre>\n</div>')
+        self.assertEqual(minify_html('<p>a</p>'), '<p>a</p>')
+
+
+class CompressedPagesTests(TestCase):
+
+    def test_feed_page_compressed(self):
+        response = self.client.get(reverse('index'),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        html = gzip.decompress(response.content).decode()
+        self.assertIn('Последние обновления', html)
+        self.assertNotIn('\n    ', html)
@@ -0,0 +1,117 @@
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from yatube.files import serve
+from yatube.storage import CompressedManifestStaticFilesStorage
+
+CSS = b'body { margin: 0; padding: 0; }\n' * 50
+
+
+class ServeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.factory = RequestFactory()
+        for name, content in (
+                ('site.0123456789ab.css', CSS),
+                ('site.0123456789ab.css.gz', gzip.compress(CSS)),
+                ('plain.css', CSS)):
+            with open(os.path.join(self.root, name), 'wb') as file:
+                file.write(content)
+
+    def get(self, path, url_prefix=None, **headers):
+        request = self.factory.get('/static/' + path, **headers)
+        return serve(request, path, document_root=self.root,
+                     url_prefix=url_prefix)
+
+    def test_precompressed_variant(self):
+        response = self.get('site.0123456789ab.css',
+                            HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)), CSS)
+
+    def test_identity_when_not_accepted(self):
+        response = self.get('site.0123456789ab.css',
+                            HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), CSS)
+
+    def test_cache_control(self):
+        self.assertIn('immutable',
+                      self.get('site.0123456789ab.css')['Cache-Control'])
+        self.assertNotIn('immutable', self.get('plain.css')['Cache-Control'])
+
+    def test_not_modified(self):
+        response = self.get('plain.css')
+        response = self.get(
+            'plain.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(SENDFILE_BACKEND='x-accel-redirect')
+    def test_x_accel_redirect(self):
+        response = self.get('site.0123456789ab.css', url_prefix='/internal/',
+                            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/internal/site.0123456789ab.css.gz')
+        self.assertEqual(response.content, b'')
+
+
+class CompressedStorageTests(SimpleTestCase):
+
+    def test_compress(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        storage = CompressedManifestStaticFilesStorage(location=root)
+        with open(os.path.join(root, 'app.css'), 'wb') as file:
+            file.write(CSS)
+        with open(os.path.join(root, 'logo.png'), 'wb') as file:
+            file.write(b'\x89PNG')
+        storage.compress('app.css')
+        storage.compress('logo.png')
+        with open(os.path.join(root, 'app.css.gz'), 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), CSS)
+        self.assertFalse(os.path.exists(os.path.join(root, 'logo.png.gz')))
+
+
+class ManifestServeTests(SimpleTestCase):
+
+    def setUp(self):
+        source = tempfile.mkdtemp()
+        static_root = tempfile.mkdtemp()
+        for directory in (source, static_root):
+            self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with open(os.path.join(source, 'app.css'), 'wb') as file:
+            file.write(CSS)
+        settings = override_settings(
+            STATIC_ROOT=static_root, STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=[
+                'django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATICFILES_STORAGE=(
+                'yatube.storage.CompressedManifestStaticFilesStorage'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0,
+                     stdout=StringIO())
+
+    def test_hashed_precompressed_file_served(self):
+        url = staticfiles_storage.url('app.css')
+        self.assertRegex(url, r'^/static/app\.[0-9a-f]{12}\.css$')
+        path = url[len('/static/'):]
+        request = RequestFactory().get(url, HTTP_ACCEPT_ENCODING='gzip')
+        response = serve(request, path,
+                         document_root=staticfiles_storage.location)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)), CSS)
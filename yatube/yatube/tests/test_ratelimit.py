@@ -0,0 +1,109 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Post, User
+from yatube import ratelimit
+
+
+class TokenBucketTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_burst_then_refill(self):
+        for _ in range(3):
+            self.assertEqual(ratelimit.consume('g', 'k', '3/m', now=100), 0)
+        self.assertAlmostEqual(
+            ratelimit.consume('g', 'k', '3/m', now=100), 20)
+        self.assertEqual(ratelimit.consume('g', 'k', '3/m', now=120), 0)
+        self.assertGreater(ratelimit.consume('g', 'k', '3/m', now=120), 0)
+
+    def test_cost_over_capacity_borrows(self):
+        self.assertEqual(
+            ratelimit.consume('g', 'k', '3/m', now=100, cost=2), 0)
+        self.assertAlmostEqual(
+            ratelimit.consume('g', 'k', '3/m', now=100, cost=2), 20)
+        # Пакет больше корзины проходит только с полной корзиной и
+        # оставляет долг: средняя частота та же
+        self.assertEqual(
+            ratelimit.consume('g', 'k', '3/m', now=160, cost=6), 0)
+        self.assertAlmostEqual(
+            ratelimit.consume('g', 'k', '3/m', now=160), 80)
+
+    def test_keys_are_independent(self):
+        self.assertEqual(ratelimit.consume('g', 'a', '1/h', now=100), 0)
+        self.assertGreater(ratelimit.consume('g', 'a', '1/h', now=100), 0)
+        self.assertEqual(ratelimit.consume('g', 'b', '1/h', now=100), 0)
+
+    def test_local_fallback_when_cache_fails(self):
+        broken = mock.Mock(get=mock.Mock(side_effect=ConnectionError))
+        with mock.patch.object(ratelimit, 'caches', {'default': broken}), \
+                self.assertLogs('yatube.ratelimit', 'WARNING'):
+            self.assertEqual(
+                ratelimit.consume('g', 'local', '1/h', now=100), 0)
+            self.assertGreater(
+                ratelimit.consume('g', 'local', '1/h', now=100), 0)
+
+
+@override_settings(RATELIMITS={'comment': '2/h', 'signup': '1/h'})
+class RateLimitedViewsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='spammer')
+        cls.post = Post.objects.create(text='Запись', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(RateLimitedViewsTests.user)
+        self.url = reverse('add_comment', args=(
+            'spammer', RateLimitedViewsTests.post.pk))
+
+    def test_comments_throttled(self):
+        for _ in range(2):
+            self.client.post(self.url, {'text': 'спам'})
+        response = self.client.post(self.url, {'text': 'спам'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertEqual(ratelimit.rejected('comment'), 1)
+
+    def test_ajax_gets_json(self):
+        for _ in range(2):
+            self.client.post(self.url, {'text': 'спам'})
+        response = self.client.post(
+            self.url, {'text': 'спам'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('error', response.json())
+
+    def test_form_page_not_throttled(self):
+        for _ in range(3):
+            response = self.client.get(reverse('new_post'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_signup_limited_by_ip(self):
+        data = {'username': 'newcomer', 'password1': 'x',
+                'password2': 'y'}
+        self.client.post(reverse('signup'), data)
+        response = self.client.post(reverse('signup'), data)
+        self.assertEqual(response.status_code, 429)
+        response = self.client.post(reverse('signup'), data,
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(RATELIMITS={'follow': '3/h'})
+    def test_batch_follow_costs_token_per_author(self):
+        authors = [User.objects.create(username=f'author{number}')
+                   for number in range(4)]
+        response = self.client.post(reverse('follow_batch'), {
+            'action': 'follow',
+            'usernames': ' '.join(author.username for author in authors)})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(reverse('profile_follow', args=(
+            'author0',)))
+        self.assertEqual(response.status_code, 429)
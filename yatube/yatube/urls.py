@@ -1,9 +1,10 @@
 from django.conf import settings
 from django.conf.urls import handler404, handler500
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from .files import files_urlpatterns
+
 urlpatterns = [
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
@@ -15,8 +16,10 @@ urlpatterns = [
 handler404 = 'posts.views.page_not_found'  # noqa
 handler500 = 'posts.views.server_error'  # noqa
 
-if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(
-        settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+if settings.SERVE_FILES:
+    urlpatterns += files_urlpatterns(
+        settings.MEDIA_URL, settings.MEDIA_ROOT,
+        settings.SENDFILE_MEDIA_PREFIX)
+    urlpatterns += files_urlpatterns(
+        settings.STATIC_URL, settings.STATIC_ROOT,
+        settings.SENDFILE_STATIC_PREFIX)
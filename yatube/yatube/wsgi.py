@@ -1,7 +1,13 @@
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# Просмотры, накопленные в памяти процесса (posts.counters)
+if settings.VIEW_COUNT_MODE == 'local':
+    from posts import counters
+    counters.local.start()